@@ -0,0 +1 @@
+"""Lets ``python -m pytest`` from this directory import ``review_sentiment`` without installing it."""
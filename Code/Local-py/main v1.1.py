@@ -9,81 +9,128 @@ Original file is located at
 Sentimental analysis for Amazon review: an emperical study on decision making
 """
 
-!pip install transformers tqdm pandas statsmodels datasets scikit-learn flax jax jaxlib linearmodels statsmodels datasets scikit-learn matplotlib
+# In Colab, first: pip install transformers tqdm pandas statsmodels datasets scikit-learn linearmodels matplotlib
+# Outside a notebook, run the pipeline one stage at a time instead, each stage loading only what it needs:
+# python -m review_sentiment ingest --category All_Beauty, then score, features, classify, panel, plot (see review_sentiment/cli.py)
+# Many categories across several machines: python -m review_sentiment.batchrun plan/work/status (see review_sentiment/batchrun.py)
 
-"""Here loading dataset directly from huggingface"""
+"""Here loading dataset directly from huggingface
+
+For big categories (Books, Home_and_Kitchen, ...) use the streaming mode instead, which reads local Arrow/Parquet/JSONL shards chunk by chunk and writes the scored results as it goes:
+python -m review_sentiment.ingest <shards> --output sentiment_analysis_results --models distilbert roberta vader
+"""
 
 import datasets
 from datasets import load_dataset
 import pandas as pd
+from review_sentiment.profiling import Profiler, stage
+
+# Each run writes a JSON profile to profiles/: time per stage, rows/s and tokens/s, peak RSS and forward-pass latency percentiles.
+# Set torch_trace_dir (e.g. 'profiles/torch') to also record the first few forward passes with torch.profiler.
+profiler = Profiler('all_beauty', torch_trace_dir=None).start()
 
 datasets.logging.set_verbosity_error()
-data = load_dataset("McAuley-Lab/Amazon-Reviews-2023", "raw_review_All_Beauty", trust_remote_code=True)
+with stage('load_dataset'):
+    data = load_dataset("McAuley-Lab/Amazon-Reviews-2023", "raw_review_All_Beauty", trust_remote_code=True)
 
 print(data["full"].column_names)
 
-df = pd.DataFrame(data["full"])
+with stage('to_pandas') as counts:
+    df = pd.DataFrame(data["full"])
+    counts['rows'] = len(df)
 
 print(df.head())
 
 """Feature Engineering (Here I think still have some space of improvement, like how to find(or build) useful features, i.e. word's appear frequency)"""
 
-df['review_length'] = df['text'].apply(len)
-df['helpful_vote'] = df['helpful_vote'].fillna(0)
-df['verified_purchase'] = df['verified_purchase'].apply(lambda x: 1 if x else 0)
-df['has_images'] = df['images'].apply(lambda x: 1 if x else 0)
-df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-df['year'] = df['timestamp'].dt.year
-df['month'] = df['timestamp'].dt.month
-df['day'] = df['timestamp'].dt.day
-df['weekday'] = df['timestamp'].dt.weekday
+from review_sentiment.features import add_review_features
+
+# review_length, helpful_vote, verified_purchase, has_images and year/month/day/weekday from the timestamp, built with vectorized operations in compact int8/int16/int32 dtypes
+with stage('features', rows=len(df)):
+    df = add_review_features(df)
 print(df.head())
 
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-import torch
 import numpy as np
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from review_sentiment.cache import ScoreCache
 
 #	Load the DistilBERT pre-trained model and the corresponding tokenizer.
 #	Load the model onto the CUDA device (GPU) for inference, which is why I choose to build the project on CoLAB: My laptop chip was M1 Pro which is not support to CUDA, I can only accelerate training through CPU. So for the concern of time cost, I choosed Colab Pro with CUDA support
+#	Without CUDA the device falls back to CPU, and scoring goes through a pool of worker processes that each load their own copy of the model.
+#	Scores are cached on disk by (model, truncation settings, text hash), so duplicate reviews and reruns never go through the network twice.
 
 model_name = "Dmyadav2001/Sentimental-Analysis"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSequenceClassification.from_pretrained(model_name).to('cuda')
+score_cache = ScoreCache('sentiment_cache.sqlite')
 
 # The truncate_text function is used to truncate text that exceeds the maximum length, which will help me decrease GPU memory and RAM usage, speed up the training
+#	The cut is a character budget derived from the token limit (max_length tokens, not characters), and it is applied before tokenization inside the scorer.
+#	Token ids are computed once per tokenizer family and kept in token_cache/, so the scoring passes just load them on reruns.
+from review_sentiment.pretokenize import char_budget, clip_text
+
 def truncate_text(text, max_length=512):
-    return text[:max_length]
-# The preprocess_and_analyze function tokenizes the text, encodes it, and feeds it into the model to compute sentiment scores.
-#	The softmax function is used to compute the probability of each sentiment class, and the difference between the positive and negative sentiment scores is calculated.
-def preprocess_and_analyze(texts):
-    inputs = tokenizer(texts, padding=True, truncation=True, max_length=512, return_tensors="pt").to('cuda')
-    with torch.no_grad():
-        logits = model(**inputs).logits
-    scores = torch.nn.functional.softmax(logits, dim=-1)
-    sentiments = scores[:, 1] - scores[:, 0]  # POSITIVE score - NEGATIVE score
-    return sentiments.cpu().numpy()
-# The parallel_processing function processes each batch of text data, calls the preprocess_and_analyze function for analysis, and returns the sentiment scores. Same purpose of Truncation, it allows me to mapping function to processing data by 20 units per batch.
-def parallel_processing(batch_texts):
-    batch_predictions = preprocess_and_analyze(batch_texts)
-    return np.array(batch_predictions)
-
-batch_size = 20
-all_predictions = []
-
-with ThreadPoolExecutor(max_workers=8) as executor:
-    futures = []
-    for i in range(0, len(df), batch_size):
-        batch_texts = df['text'][i:i+batch_size].tolist()
-        futures.append(executor.submit(parallel_processing, batch_texts))
-
-    for future in tqdm(futures, desc="Processing batches"):
-        all_predictions.extend(future.result())
-
-df['sentiment_score'] = all_predictions
-df.to_csv('sentiment_analysis_results.csv', index=False)
-df.to_json('sentiment_analysis_results.jsonl', orient='records', lines=True)
+    return clip_text(text, char_budget(max_length))
+
+# Batches are packed by a token budget over length-sorted reviews instead of 20 rows in file order, so a single long review no longer pads its whole batch to 512 tokens.
+# The budget (8192 tokens, at most 64 rows) and the CPU worker layout are calibrated per host and model by autotune: short trials on a sample of these reviews, fastest setting under 80% of RAM, saved to autotune.json.
+# Set autotune_scoring = True once on a new machine (or after changing the backend); later runs pick the saved settings up on their own.
+autotune_scoring = False
+# 'torch' is the fp32 model; on CPU 'torch-int8', 'onnx' and 'onnx-int8' are much faster, see the drift check below.
+inference_backend = 'torch'
+
+# Daily refreshes: the dataset only grows, so once the results store exists only reviews that are new or edited since the last run are scored.
+# Reviews are keyed by (user_id, parent_asin, timestamp); a per-category, per-model timestamp watermark skips the key lookup for everything newer, and the new rows are merged into the store.
+# To score reviews as they arrive instead, keep the models warm in the scoring service: python -m review_sentiment.service serve --models distilbert roberta vader
+# DistilBERT, RoBERTa and VADER score each batch of reviews side by side in one pass (each on its share of the cores, or the GPU), so the texts are read and featurized once for all three models.
+from concurrent.futures import ThreadPoolExecutor
+from review_sentiment.incremental import incremental_update, mark_scored
+from review_sentiment.ingest import build_scorers
+from review_sentiment.checkpoint import checkpointed_scores
+from review_sentiment.store import ResultsStore
+
+incremental_refresh = True
+score_models = ['distilbert', 'roberta', 'vader']
+results = ResultsStore('sentiment_analysis_results')
+
+if autotune_scoring:
+    from review_sentiment.autotune import autotune
+    from review_sentiment.scoring import MODELS
+    for name in score_models:
+        if name != 'vader':
+            with stage(f'autotune {name}'):
+                autotune(MODELS[name][0], df['text'].sample(min(len(df), 10_000), random_state=0), backend=inference_backend)
+
+scorers = build_scorers(score_models, cache=score_cache, backend=inference_backend, token_cache_dir='token_cache')
+try:
+    if incremental_refresh and results.parts():
+        refresh = incremental_update([df], results, scorers, category='All_Beauty')
+        print(f"New reviews: {refresh['new']}, edited: {refresh['changed']}, already scored: {refresh['skipped']}")
+        df = results.read()
+    else:
+        # Finished ranges of 10,000 reviews are checkpointed to scoring_checkpoint/, so a crashed or preempted run resumes where it stopped.
+        # The checkpoint is removed once every range is scored, so a later run over other data starts clean.
+        with ThreadPoolExecutor(len(scorers)) as executor:
+            df = df.assign(**checkpointed_scores(scorers, df['text'], 'scoring_checkpoint', executor=executor,
+                                                 progress=lambda it: tqdm(it, desc="Scoring chunks"), cleanup=True))
+        # Results go to a partitioned Parquet store instead of CSV + JSONL; each analysis section reads back only the columns it needs.
+        with stage('write_results', rows=len(df)):
+            results.write(df)
+        # Watermarks for the first full run, so the next refresh only looks up the keys of older reviews.
+        mark_scored(results, 'All_Beauty', scorers, df['timestamp'])
+finally:
+    for scorer in scorers.values():
+        scorer.close()
+
+for column, scorer in scorers.items():
+    if hasattr(scorer, 'stats'):
+        print(f"{column}: tokens processed: {scorer.stats['tokens']}, padding ratio: {scorer.stats['padding_ratio']:.2%}")
+print(f"Cache hit rate: {score_cache.hit_rate():.2%} ({score_cache.stats['unique']} distinct of {score_cache.stats['rows']} review scores)")
+
+# List faster backends here to measure how far their scores drift from the fp32 sentiment_score on a held-out sample before using them.
+from review_sentiment.backends import check_backend_drift
+
+candidate_backends = []
+for backend in candidate_backends:
+    print(backend, check_backend_drift(df, model_name, backend, cache=score_cache))
 print(df.head())
 
 import numpy as np
@@ -94,26 +141,17 @@ from sklearn.metrics import roc_auc_score, roc_curve, classification_report, con
 from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 import seaborn as sns
-import json
+from review_sentiment.store import ResultsStore
 
-jsonl_file_path = '/content/sentiment_analysis_results.jsonl'
-
-with open(jsonl_file_path, 'r') as f:
-    jsonl_data = [json.loads(line) for line in f]
-
-df = pd.DataFrame(jsonl_data)
+results = ResultsStore('sentiment_analysis_results')
+df = results.read(columns=['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images',
+                           'year', 'month', 'day', 'weekday', 'sentiment_score'])
 
 # Assuming df is already loaded and preprocessed
-# Convert sentiment scores to three classes: negative, neutral, positive
-def categorize_sentiment(score):
-    if score > 0.35:  # Threshold for positive sentiment
-        return 2
-    elif score < -0.35:  # Threshold for negative sentiment
-        return 0
-    else:
-        return 1  # Neutral sentiment
+# Convert sentiment scores to three classes: negative (< -0.35), neutral, positive (> 0.35), in one vectorized pass
+from review_sentiment.features import sentiment_labels
 
-df['sentiment_label'] = df['sentiment_score'].apply(categorize_sentiment)
+df['sentiment_label'] = sentiment_labels(df['sentiment_score'], threshold=0.35)
 
 # Prepare feature and target data
 X = df[['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images', 'year', 'month', 'day', 'weekday']]
@@ -128,47 +166,44 @@ X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_
 
 # List of different iteration numbers to evaluate
 iterations = [10, 50, 100, 200, 500, 1000, 2000, 3000, 4000, 5000]
-accuracies = []
 
-# Train and evaluate the logistic regression model for different iteration numbers
-for iter_num in iterations:
-    log_reg = LogisticRegression(max_iter=iter_num, multi_class='multinomial', solver='lbfgs')
-    log_reg.fit(X_train, y_train)
+# One warm-started model is trained through the checkpoints in order, so the whole study costs a single fit of max(iterations) instead of refitting from scratch for every entry.
+from review_sentiment.convergence import convergence_study
 
-    # Predict on the test set
-    y_pred = log_reg.predict(X_test)
-    accuracy = accuracy_score(y_test, y_pred)
-    accuracies.append(accuracy)
-
-    # Save detailed evaluation results for the highest number of iterations
-    if iter_num == max(iterations):
-        y_pred_proba = log_reg.predict_proba(X_test)
-        auc = roc_auc_score(y_test, y_pred_proba, multi_class='ovr')
-        print(f"AUC: {auc:.4f}")
-        print(classification_report(y_test, y_pred))
-        cm = confusion_matrix(y_test, y_pred)
-        print(cm)
-
-        # Plot ROC curve for each class
-        plt.figure(figsize=(10, 6))
-        for i in range(3):  # We have three classes now
-            fpr, tpr, _ = roc_curve(y_test, y_pred_proba[:, i], pos_label=i)
-            plt.plot(fpr, tpr, lw=2, label=f'Class {i} (AUC = {roc_auc_score(y_test == i, y_pred_proba[:, i]):.4f})')
-
-        plt.plot([0, 1], [0, 1], 'k--', lw=2, label='Random Guessing')
-        plt.xlabel('False Positive Rate')
-        plt.ylabel('True Positive Rate')
-        plt.title('ROC Curve')
-        plt.legend(loc='lower right')
-        plt.show()
-
-        # Plot confusion matrix
-        plt.figure(figsize=(10, 6))
-        sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Neutral', 'Positive'], yticklabels=['Negative', 'Neutral', 'Positive'])
-        plt.xlabel('Predicted')
-        plt.ylabel('Actual')
-        plt.title('Confusion Matrix')
-        plt.show()
+with stage('logistic_regression_convergence', rows=len(X_train)):
+    study, log_reg = convergence_study(X_train, y_train, X_test, y_test, iterations, solver='lbfgs')
+print(study)
+accuracies = study['accuracy'].tolist()
+
+# Save detailed evaluation results for the highest number of iterations
+y_pred = log_reg.predict(X_test)
+y_pred_proba = log_reg.predict_proba(X_test)
+auc = roc_auc_score(y_test, y_pred_proba, multi_class='ovr')
+print(f"AUC: {auc:.4f}")
+print(classification_report(y_test, y_pred))
+cm = confusion_matrix(y_test, y_pred)
+print(cm)
+
+# Plot ROC curve for each class
+plt.figure(figsize=(10, 6))
+for i in range(3):  # We have three classes now
+    fpr, tpr, _ = roc_curve(y_test, y_pred_proba[:, i], pos_label=i)
+    plt.plot(fpr, tpr, lw=2, label=f'Class {i} (AUC = {roc_auc_score(y_test == i, y_pred_proba[:, i]):.4f})')
+
+plt.plot([0, 1], [0, 1], 'k--', lw=2, label='Random Guessing')
+plt.xlabel('False Positive Rate')
+plt.ylabel('True Positive Rate')
+plt.title('ROC Curve')
+plt.legend(loc='lower right')
+plt.show()
+
+# Plot confusion matrix
+plt.figure(figsize=(10, 6))
+sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Neutral', 'Positive'], yticklabels=['Negative', 'Neutral', 'Positive'])
+plt.xlabel('Predicted')
+plt.ylabel('Actual')
+plt.title('Confusion Matrix')
+plt.show()
 
 # Visualize the relationship between number of iterations and accuracy
 plt.figure(figsize=(10, 6))
@@ -187,26 +222,17 @@ from sklearn.metrics import roc_auc_score, roc_curve, classification_report, con
 from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 import seaborn as sns
-import json
-
-jsonl_file_path = '/content/drive/MyDrive/TER/Code/Training Result/sentiment_analysis_results_RoBERTa.jsonl'
-
-with open(jsonl_file_path, 'r') as f:
-    jsonl_data = [json.loads(line) for line in f]
+from review_sentiment.store import ResultsStore
 
-df = pd.DataFrame(jsonl_data)
+results = ResultsStore('sentiment_analysis_results')
+df = results.read(columns=['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images',
+                           'year', 'month', 'day', 'weekday', 'sentiment_score', 'sentiment_score_roberta'])
 
 # Assuming df is already loaded and preprocessed
-# Convert sentiment scores to three classes: negative, neutral, positive
-def categorize_sentiment(score):
-    if score > 0.35:  # Threshold for positive sentiment
-        return 2
-    elif score < -0.35:  # Threshold for negative sentiment
-        return 0
-    else:
-        return 1  # Neutral sentiment
+# Convert sentiment scores to three classes: negative (< -0.35), neutral, positive (> 0.35), in one vectorized pass
+from review_sentiment.features import sentiment_labels
 
-df['sentiment_label'] = df['sentiment_score_roberta'].apply(categorize_sentiment)
+df['sentiment_label'] = sentiment_labels(df['sentiment_score_roberta'], threshold=0.35)
 
 # Prepare feature and target data
 X = df[['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images', 'year', 'month', 'day', 'weekday']]
@@ -221,47 +247,44 @@ X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_
 
 # List of different iteration numbers to evaluate
 iterations = [10, 50, 100, 200, 500, 1000]
-accuracies = []
 
-# Train and evaluate the logistic regression model for different iteration numbers
-for iter_num in iterations:
-    log_reg = LogisticRegression(max_iter=iter_num, multi_class='multinomial', solver='lbfgs')
-    log_reg.fit(X_train, y_train)
+# One warm-started model is trained through the checkpoints in order, so the whole study costs a single fit of max(iterations) instead of refitting from scratch for every entry.
+from review_sentiment.convergence import convergence_study
+
+with stage('logistic_regression_convergence', rows=len(X_train)):
+    study, log_reg = convergence_study(X_train, y_train, X_test, y_test, iterations, solver='lbfgs')
+print(study)
+accuracies = study['accuracy'].tolist()
+
+# Save detailed evaluation results for the highest number of iterations
+y_pred = log_reg.predict(X_test)
+y_pred_proba = log_reg.predict_proba(X_test)
+auc = roc_auc_score(y_test, y_pred_proba, multi_class='ovr')
+print(f"AUC: {auc:.4f}")
+print(classification_report(y_test, y_pred))
+cm = confusion_matrix(y_test, y_pred)
+print(cm)
+
+# Plot ROC curve for each class
+plt.figure(figsize=(10, 6))
+for i in range(3):  # We have three classes now
+    fpr, tpr, _ = roc_curve(y_test, y_pred_proba[:, i], pos_label=i)
+    plt.plot(fpr, tpr, lw=2, label=f'Class {i} (AUC = {roc_auc_score(y_test == i, y_pred_proba[:, i]):.4f})')
 
-    # Predict on the test set
-    y_pred = log_reg.predict(X_test)
-    accuracy = accuracy_score(y_test, y_pred)
-    accuracies.append(accuracy)
-
-    # Save detailed evaluation results for the highest number of iterations
-    if iter_num == max(iterations):
-        y_pred_proba = log_reg.predict_proba(X_test)
-        auc = roc_auc_score(y_test, y_pred_proba, multi_class='ovr')
-        print(f"AUC: {auc:.4f}")
-        print(classification_report(y_test, y_pred))
-        cm = confusion_matrix(y_test, y_pred)
-        print(cm)
-
-        # Plot ROC curve for each class
-        plt.figure(figsize=(10, 6))
-        for i in range(3):  # We have three classes now
-            fpr, tpr, _ = roc_curve(y_test, y_pred_proba[:, i], pos_label=i)
-            plt.plot(fpr, tpr, lw=2, label=f'Class {i} (AUC = {roc_auc_score(y_test == i, y_pred_proba[:, i]):.4f})')
-
-        plt.plot([0, 1], [0, 1], 'k--', lw=2, label='Random Guessing')
-        plt.xlabel('False Positive Rate')
-        plt.ylabel('True Positive Rate')
-        plt.title('ROC Curve')
-        plt.legend(loc='lower right')
-        plt.show()
-
-        # Plot confusion matrix
-        plt.figure(figsize=(10, 6))
-        sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Neutral', 'Positive'], yticklabels=['Negative', 'Neutral', 'Positive'])
-        plt.xlabel('Predicted')
-        plt.ylabel('Actual')
-        plt.title('Confusion Matrix')
-        plt.show()
+plt.plot([0, 1], [0, 1], 'k--', lw=2, label='Random Guessing')
+plt.xlabel('False Positive Rate')
+plt.ylabel('True Positive Rate')
+plt.title('ROC Curve')
+plt.legend(loc='lower right')
+plt.show()
+
+# Plot confusion matrix
+plt.figure(figsize=(10, 6))
+sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Neutral', 'Positive'], yticklabels=['Negative', 'Neutral', 'Positive'])
+plt.xlabel('Predicted')
+plt.ylabel('Actual')
+plt.title('Confusion Matrix')
+plt.show()
 
 # Visualize the relationship between number of iterations and accuracy
 plt.figure(figsize=(10, 6))
@@ -275,25 +298,35 @@ plt.show()
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
-from xgboost import XGBClassifier, plot_importance
+from xgboost import plot_importance
 from sklearn.metrics import roc_auc_score, roc_curve, classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-df['sentiment_label'] = np.where(df['sentiment_score'] > 0, 1, 0)
+from review_sentiment.features import add_interaction_features, binary_labels
+
+df['sentiment_label'] = binary_labels(df['sentiment_score'])
 
 X = df[['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images', 'year']]
 y = df['sentiment_label']
 
-X['log_review_length'] = np.log(X['review_length'] + 1)
-X['rating_review_length'] = X['rating'] * X['review_length']
-
-X = X.drop(columns=['review_length'])
+X = add_interaction_features(X).drop(columns=['review_length'])
 
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-xgb_clf = XGBClassifier(learning_rate=0.1, max_depth=6, n_estimators=100)
-xgb_clf.fit(X_train, y_train)
+# 5-fold CV over a small grid instead of one guessed fit: the training set is quantized once and the fold matrices are shared by every grid point,
+# the fits run side by side within the core budget, and each one stops when the validation AUC has not improved for 20 rounds.
+from review_sentiment.boosting import cross_validate_xgboost, train_best_xgboost
+
+with stage('xgboost_cv', rows=len(X_train)):
+    xgb_cv = cross_validate_xgboost(X_train, y_train, grid={'max_depth': [4, 6, 8], 'learning_rate': [0.05, 0.1]},
+                                    n_splits=5, early_stopping_rounds=20)
+print(xgb_cv['folds'][['max_depth', 'learning_rate', 'fold', 'best_iteration', 'valid_auc', 'seconds']])
+print(xgb_cv['summary'])
+print(f"Best: {xgb_cv['best_params']}, {xgb_cv['best_rounds']} rounds; CV took {xgb_cv['seconds']:.1f}s")
+
+with stage('xgboost_fit', rows=len(X_train)):
+    xgb_clf = train_best_xgboost(X_train, y_train, xgb_cv)
 
 y_pred = xgb_clf.predict(X_test)
 y_pred_proba = xgb_clf.predict_proba(X_test)[:, 1]
@@ -329,19 +362,45 @@ plt.ylabel('Actual')
 plt.title('Confusion Matrix')
 plt.show()
 
-!pip install
+# Fold timings of the CV search, one bar per fit.
+plt.figure(figsize=(10, 6))
+sns.barplot(data=xgb_cv['folds'].assign(params=xgb_cv['folds']['max_depth'].astype(str) + ' / ' + xgb_cv['folds']['learning_rate'].astype(str)),
+            x='params', y='seconds', hue='fold')
+plt.xlabel('max_depth / learning_rate')
+plt.ylabel('Seconds per fold')
+plt.title('XGBoost Cross-Validation Fit Times')
+plt.show()
+
+# Text features: hashed word + bigram TF-IDF (2^20 columns, no stored vocabulary) plus the standardized metadata columns, as sparse CSR chunks.
+# An SGD logistic regression learns from one results-store part at a time with partial_fit, so this runs on a full category without a transformer.
+from review_sentiment.features import METADATA_FEATURES
+from review_sentiment.textfeatures import TextFeaturizer, train_text_classifier
+
+text_batches = lambda: (results.read_part(part, ['text', *METADATA_FEATURES, 'sentiment_score']) for part in results.parts())
+with TextFeaturizer(ngram_range=(1, 2), tfidf=True) as featurizer, stage('text_classifier'):
+    text_clf, text_metrics = train_text_classifier(text_batches, featurizer, label=lambda part: binary_labels(part['sentiment_score']),
+                                                   epochs=2, progress=tqdm)
+print(f"Hashed TF-IDF + SGD AUC: {text_metrics['auc']:.4f}, accuracy: {text_metrics['accuracy']:.4f} on {text_metrics['rows']} held-out reviews")
+print(text_metrics['confusion_matrix'])
+
+fpr, tpr, _ = roc_curve(text_metrics['y_true'], text_metrics['y_proba'][:, 1])
+plt.figure(figsize=(10, 6))
+plt.plot(fpr, tpr, label=f"Hashed TF-IDF + SGD (AUC = {text_metrics['auc']:.4f})")
+plt.plot([0, 1], [0, 1], 'k--', lw=2, label='Random Guessing')
+plt.xlabel('False Positive Rate')
+plt.ylabel('True Positive Rate')
+plt.title('ROC Curve')
+plt.legend(loc='lower right')
+plt.show()
 
 from linearmodels.panel import PanelOLS
 from linearmodels.panel import RandomEffects
 import statsmodels.api as sm
-import json
-file_path = '/content/sentiment_analysis_results.jsonl'
-data = []
+from review_sentiment.store import ResultsStore
 
-with open(file_path, 'r') as file:
-    for line in file:
-        data.append(json.loads(line))
-df = pd.DataFrame(data)
+results = ResultsStore('sentiment_analysis_results')
+df = results.read(columns=['user_id', 'timestamp', 'rating', 'review_length', 'helpful_vote', 'verified_purchase',
+                           'has_images', 'year', 'month', 'day', 'weekday', 'sentiment_score'])
 
 print(df.columns)
 
@@ -352,61 +411,67 @@ y = df['sentiment_score']
 
 X = sm.add_constant(X)
 
-fixed_effects_model = PanelOLS(y, X, entity_effects=True)
-fixed_effects_results = fixed_effects_model.fit()
+with stage('linearmodels_fit', rows=len(X)):
+    fixed_effects_model = PanelOLS(y, X, entity_effects=True)
+    fixed_effects_results = fixed_effects_model.fit()
 
 print(fixed_effects_results)
 
-random_effects_model = RandomEffects(y, X)
-random_effects_results = random_effects_model.fit()
+with stage('linearmodels_fit', rows=len(X)):
+    random_effects_model = RandomEffects(y, X)
+    random_effects_results = random_effects_model.fit()
 
 print(random_effects_results)
 
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-from linearmodels.panel import PanelOLS, RandomEffects
-from sklearn.preprocessing import StandardScaler
-import json
-file_path = '/content/sentiment_analysis_results.jsonl'
-data = []
+from review_sentiment.store import ResultsStore
+from review_sentiment.panel import PanelAccumulator, PanelMoments, fit_panel_store
 
-with open(file_path, 'r') as file:
-    for line in file:
-        data.append(json.loads(line))
-df = pd.DataFrame(data)
+results = ResultsStore('sentiment_analysis_results')
+df = results.read(columns=['user_id', 'timestamp', 'rating', 'review_length', 'helpful_vote', 'verified_purchase',
+                           'has_images', 'year', 'month', 'day', 'weekday', 'sentiment_score'])
 
-df['log_review_length'] = np.log(df['review_length'] + 1)
-df['rating_review_length'] = df['rating'] * df['review_length']
+from review_sentiment.features import add_interaction_features
 
-scaler = StandardScaler()
-df[['rating', 'log_review_length', 'helpful_vote', 'verified_purchase', 'has_images',
-    'year', 'month', 'day', 'weekday', 'rating_review_length']] = scaler.fit_transform(
-    df[['rating', 'log_review_length', 'helpful_vote', 'verified_purchase', 'has_images',
-        'year', 'month', 'day', 'weekday', 'rating_review_length']])
+df = add_interaction_features(df)
 
-df = df.set_index(['user_id', 'timestamp'])
-
-X = df[['rating', 'log_review_length', 'helpful_vote', 'verified_purchase', 'has_images',
-        'year', 'month', 'day', 'weekday', 'rating_review_length']]
-y = df['sentiment_score']
+panel_regressors = ['rating', 'log_review_length', 'helpful_vote', 'verified_purchase', 'has_images',
+                    'year', 'month', 'day', 'weekday', 'rating_review_length']
 
-X = sm.add_constant(X)
+# One pass builds the sufficient statistics; standardizing them is the same as running StandardScaler on X first.
+# Fixed effects, random effects, GLS (no sigma, i.e. pooled OLS) and the Hausman test are then all solved from the cached moments,
+# with the same coefficients and unadjusted standard errors as PanelOLS / RandomEffects / sm.GLS on the standardized X.
+with stage('panel_moments', rows=len(df)):
+    panel_stats = PanelAccumulator(panel_regressors, 'sentiment_score').update(df).standardized()
+    panel_moments = PanelMoments.from_accumulator(panel_stats)
+    panel_moments.save('panel_moments.npz')
 
-fixed_effects_model = PanelOLS(y, X, entity_effects=True)
-fixed_effects_results = fixed_effects_model.fit()
+with stage('panel_fit'):
+    panel_fits = panel_moments.fit()
 print("Fixed Effects Model Results:")
-print(fixed_effects_results)
-
-random_effects_model = RandomEffects(y, X)
-random_effects_results = random_effects_model.fit()
+print(panel_fits['fixed_effects'])
 print("Random Effects Model Results:")
-print(random_effects_results)
-
-gls_model = sm.GLS(y, X)
-gls_results = gls_model.fit()
+print(panel_fits['random_effects'])
 print("GLS Model Results:")
-print(gls_results.summary())
+print(panel_fits['gls'])
+print("Hausman test (FE vs RE):", panel_fits['hausman'])
+
+# Another specification is only a small solve on the cached moments, e.g. without the date features.
+# PanelMoments.load('panel_moments.npz') brings them back in a later session without re-reading the data.
+reduced_fits = panel_moments.fit(['rating', 'log_review_length', 'helpful_vote', 'verified_purchase', 'has_images',
+                                  'rating_review_length'])
+print(reduced_fits['fixed_effects'])
+print(reduced_fits['random_effects'])
+print("Hausman test (FE vs RE, no date features):", reduced_fits['hausman'])
+
+# Out-of-core version of the fixed and random effects fits above, for categories whose design matrix does not fit in memory.
+# The within/between moments are accumulated part by part from the results store across worker processes, and a second pass collects the entity-clustered scores; coefficients and clustered standard errors match linearmodels.
+with stage('panel_fit_store', rows=len(results)):
+    panel_results = fit_panel_store(results, panel_regressors, target='sentiment_score', standardize=True)
+print(panel_results['fixed_effects'])
+print(panel_results['random_effects'])
+print("Hausman test (FE vs RE):", panel_results['hausman'])
 
 import numpy as np
 import pandas as pd
@@ -416,20 +481,20 @@ from sklearn.metrics import roc_auc_score, roc_curve, classification_report, con
 import matplotlib.pyplot as plt
 import statsmodels.api as sm
 
-df['sentiment_label'] = np.where(df['sentiment_score'] > 0, 1, 0)
+from review_sentiment.features import add_interaction_features, binary_labels
+
+df['sentiment_label'] = binary_labels(df['sentiment_score'])
 
 X = df[['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images', 'year', 'month', 'day', 'weekday']]
 y = df['sentiment_label']
 
-X.loc[:, 'log_review_length'] = np.log(X['review_length'] + 1)
-X.loc[:, 'rating_review_length'] = X['rating'] * X['review_length']
-
-X = X.drop(columns=['review_length'])
+X = add_interaction_features(X).drop(columns=['review_length'])
 
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
 log_reg = LogisticRegression(max_iter=1000)
-log_reg.fit(X_train, y_train)
+with stage('logistic_regression_fit', rows=len(X_train)):
+    log_reg.fit(X_train, y_train)
 
 y_pred = log_reg.predict(X_test)
 y_pred_proba = log_reg.predict_proba(X_test)[:, 1]
@@ -443,7 +508,8 @@ print(confusion_matrix(y_test, y_pred))
 
 X_train_sm = sm.add_constant(X_train)
 logit_model = sm.Logit(y_train, X_train_sm)
-logit_results = logit_model.fit()
+with stage('statsmodels_logit_fit', rows=len(X_train)):
+    logit_results = logit_model.fit()
 print(logit_results.summary())
 
 fpr, tpr, thresholds = roc_curve(y_test, y_pred_proba)
@@ -459,35 +525,31 @@ plt.show()
 
 import matplotlib.pyplot as plt
 import seaborn as sns
-import json
 from mpl_toolkits.mplot3d import Axes3D
+from review_sentiment.store import ResultsStore
 # roberta
-jsonl_file_path = '/content/drive/MyDrive/TER/Code/Training Result/sentiment_analysis_results_RoBERTa.jsonl'
-
-with open(jsonl_file_path, 'r') as f:
-    jsonl_data = [json.loads(line) for line in f]
-
-df = pd.DataFrame(jsonl_data)
+# Every chart below is drawn from a small summary built in one pass over the store, not from one point per review:
+# per-day count/mean/variance cells for each model (rolled up to month, year, ... with a 95% interval) and fixed-bin 2D/3D histograms for the scatter views.
+from review_sentiment.cube import plot_binned_3d, plot_heatmap, plot_histogram, plot_trend, summarize_store
+
+results = ResultsStore('sentiment_analysis_results')
+with stage('analysis_summary'):
+    summary = summarize_store(results)
+summary['cube'].save('sentiment_cube.parquet')
 sns.set(style="whitegrid")
 
 plt.figure(figsize=(10, 6))
-sns.histplot(df['sentiment_score_roberta'], bins=50, kde=True)
+plot_histogram(summary['score'])
 plt.title('Sentiment Score Distribution')
 plt.xlabel('Sentiment Score')
 plt.ylabel('Frequency')
 plt.show()
 
-# Create a 3D scatter plot
+# 3D view: one marker per (year, score, helpful vote) bin, sized by how many reviews fall in it
 fig = plt.figure(figsize=(10, 6))
 ax = fig.add_subplot(111, projection='3d')
 
-# Scatter plot data
-x = df['year']
-y = df['sentiment_score_roberta']
-z = df['helpful_vote']
-
-# Create the scatter plot
-scatter = ax.scatter(x, y, z, c=z, cmap='viridis')
+scatter = plot_binned_3d(summary['year_score_votes'], ax)
 
 # Add labels and title
 ax.set_title('Year vs Sentiment Score vs Helpful Vote')
@@ -502,87 +564,38 @@ cbar.set_label('Helpful Vote')
 plt.show()
 
 plt.figure(figsize=(10, 6))
-sns.scatterplot(x='review_length', y='sentiment_score_roberta', data=df)
+plot_heatmap(summary['length_score'], log_x=True)
 plt.title('Review Length vs Sentiment Score')
 plt.xlabel('Review Length')
 plt.ylabel('Sentiment Score')
 plt.show()
 
-plt.figure(figsize=(10, 6))
-sns.lineplot(x='month', y='sentiment_score_roberta', data=df)
-plt.title('Month vs Sentiment Score')
-plt.xlabel('Month')
-plt.ylabel('Sentiment Score')
-plt.show()
-
-plt.figure(figsize=(10, 6))
-sns.lineplot(x='year', y='sentiment_score_roberta', data=df)
-plt.title('Year vs Sentiment Score')
-plt.xlabel('Year')
-plt.ylabel('Sentiment Score')
-plt.show()
-
-plt.figure(figsize=(10, 6))
-sns.lineplot(x='day', y='sentiment_score_roberta', data=df)
-plt.title('Day vs Sentiment Score')
-plt.xlabel('Day')
-plt.ylabel('Sentiment Score')
-plt.show()
-
-plt.figure(figsize=(10, 6))
-sns.lineplot(x='weekday', y='sentiment_score_roberta', data=df)
-plt.title('Weekday vs Sentiment Score')
-plt.xlabel('Weekday')
-plt.ylabel('Sentiment Score')
-plt.show()
-
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-import torch
-from tqdm import tqdm
-
-model_name = "Eugenia/roberta-base-bne-finetuned-amazon_reviews_multi"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSequenceClassification.from_pretrained(model_name).to('cuda')
-
-def preprocess_and_analyze_roberta(texts):
-    inputs = tokenizer(texts, padding=True, truncation=True, max_length=512, return_tensors="pt").to('cuda')
-    with torch.no_grad():
-        logits = model(**inputs).logits
-    scores = torch.nn.functional.softmax(logits, dim=-1)
-    sentiments = scores[:, 1] - scores[:, 0]  # Positive score - Negative score
-    return sentiments.cpu().numpy()
-
-batch_size = 20
-all_predictions_roberta = []
+for dimension in ['month', 'year', 'day', 'weekday']:
+    plt.figure(figsize=(10, 6))
+    for score, label in [('sentiment_score_roberta', 'RoBERTa'), ('sentiment_score', 'DistilBERT'), ('sentiment_score_vader', 'VADER')]:
+        if score in summary['cube'].scores:
+            plot_trend(summary['cube'], dimension, score, label=label)
+    plt.title(f'{dimension.capitalize()} vs Sentiment Score')
+    plt.xlabel(dimension.capitalize())
+    plt.ylabel('Sentiment Score')
+    plt.legend()
+    plt.show()
 
-for i in tqdm(range(0, len(df), batch_size)):
-    batch_texts = df['text'][i:i+batch_size].tolist()
-    batch_predictions = preprocess_and_analyze_roberta(batch_texts)
-    all_predictions_roberta.extend(batch_predictions)
+from review_sentiment.store import ResultsStore
 
-df['sentiment_score_roberta'] = all_predictions_roberta
+# The RoBERTa and VADER scores were written next to the DistilBERT ones by the scoring pass at the top, so nothing is re-scored here.
+results = ResultsStore('sentiment_analysis_results')
+df = results.read()
 
-df.to_csv('sentiment_analysis_results_RoBERTa.csv', index=False)
-df.to_json('sentiment_analysis_results_RoBERTa.jsonl', orient='records', lines=True)
-
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import roc_auc_score, classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-analyzer = SentimentIntensityAnalyzer()
-
-def analyze_sentiment_vader(text):
-    score = analyzer.polarity_scores(text)
-    return score['compound']
-
-all_predictions_vader = [analyze_sentiment_vader(text) for text in tqdm(df['text'])]
-
-df['sentiment_score_vader'] = all_predictions_vader
+from review_sentiment.features import binary_labels
 
-df['sentiment_label_vader'] = np.where(df['sentiment_score_vader'] > 0, 1, 0)
+df['sentiment_label_vader'] = binary_labels(df['sentiment_score_vader'])
 
 X = df[['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images', 'year', 'month', 'day', 'weekday']]
 y = df['sentiment_label_vader']
@@ -590,7 +603,8 @@ y = df['sentiment_label_vader']
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
 log_reg_vader = LogisticRegression(max_iter=1000)
-log_reg_vader.fit(X_train, y_train)
+with stage('logistic_regression_fit', rows=len(X_train)):
+    log_reg_vader.fit(X_train, y_train)
 
 y_pred_vader = log_reg_vader.predict(X_test)
 y_pred_proba_vader = log_reg_vader.predict_proba(X_test)[:, 1]
@@ -599,13 +613,29 @@ print(f"VADER + Logistic Regression AUC: {auc_vader:.4f}")
 print(classification_report(y_test, y_pred_vader))
 print(confusion_matrix(y_test, y_pred_vader))
 
-from google.colab import drive
-drive.mount('/content/drive')
+# One evaluation pass for all three scorers against the star ratings (1-2 negative, 3 neutral, 4-5 positive): full ROC, AUC and accuracy at 0 with
+# 95% bootstrap intervals, and 3-class confusion matrices for every neutral band from 0 to 0.9 instead of the fixed ±0.35 and 0 cut-offs.
+from review_sentiment.evaluation import band_table, evaluate_scores, rating_classes, report
+
+score_columns = {'DistilBERT': 'sentiment_score', 'RoBERTa': 'sentiment_score_roberta', 'VADER': 'sentiment_score_vader'}
+with stage('evaluation', rows=len(df)):
+    evaluation = evaluate_scores({name: df[column] for name, column in score_columns.items()}, rating_classes(df['rating']))
+print(report(evaluation))
+print(band_table(evaluation))
+
+print(f"Profile written to {profiler.write()}")
+
+try:
+    from google.colab import drive
+    drive.mount('/content/drive')
+except ImportError:
+    pass
 
 plt.figure(figsize=(10, 6))
 
-fpr_roberta, tpr_roberta, _ = roc_curve(df['sentiment_label'], df['sentiment_score_roberta'])
-plt.plot(fpr_roberta, tpr_roberta, label=f'Roberta (AUC = {roc_auc_score(df["sentiment_label"], df["sentiment_score_roberta"]):.4f})')
+for name, result in evaluation.items():
+    fpr, tpr, _ = result['roc']
+    plt.plot(fpr, tpr, label=f"{name} (AUC = {result['auc']:.4f}, 95% CI {result['auc_ci'][0]:.4f}-{result['auc_ci'][1]:.4f})")
 
 fpr_vader, tpr_vader, _ = roc_curve(y_test, y_pred_proba_vader)
 plt.plot(fpr_vader, tpr_vader, label=f'VADER + Logistic Regression (AUC = {auc_vader:.4f})')
@@ -618,14 +648,18 @@ plt.title('ROC Curve Comparison')
 plt.legend(loc='lower right')
 plt.show()
 
-cm_roberta = confusion_matrix(df['sentiment_label'], np.where(df['sentiment_score_roberta'] > 0, 1, 0))
+roberta = evaluation['RoBERTa']
+best_band = int(np.argmax(roberta['band_accuracy']))
 plt.figure(figsize=(10, 6))
-sns.heatmap(cm_roberta, annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Positive'], yticklabels=['Negative', 'Positive'])
+sns.heatmap(roberta['band_confusion'][best_band], annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Neutral', 'Positive'], yticklabels=['Negative', 'Neutral', 'Positive'])
 plt.xlabel('Predicted')
-plt.ylabel('Actual')
-plt.title('Confusion Matrix - Roberta')
+plt.ylabel('Actual (rating)')
+plt.title(f"Confusion Matrix - Roberta (neutral band ±{roberta['bands'][best_band]:.2f})")
 plt.show()
 
 plt.figure(figsize=(10, 6))
-sns.heatmap(confusion_matrix(y_test, y_pred_log_reg), annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Positive'], yticklabels=['Negative', 'Positive'])
-plt.xlabel('Pred
\ No newline at end of file
+sns.heatmap(confusion_matrix(y_test, y_pred_vader), annot=True, fmt='d', cmap='Blues', xticklabels=['Negative', 'Positive'], yticklabels=['Negative', 'Positive'])
+plt.xlabel('Predicted')
+plt.ylabel('Actual')
+plt.title('Confusion Matrix - VADER + Logistic Regression')
+plt.show()
@@ -0,0 +1,5 @@
+"""Helpers for the Amazon review sentiment pipeline in ``main v1.1.py``.
+
+Submodules are imported explicitly by the stages that need them, so importing
+the package itself stays cheap.
+"""
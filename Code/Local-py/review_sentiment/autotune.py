@@ -0,0 +1,220 @@
+"""Calibrate the transformer scoring stage for this host, model and review sample.
+
+The batch budget and worker layout that suit a Colab GPU are wrong on a CPU
+node, and the best values move with the core count and with how long the
+reviews are. ``autotune`` runs short scoring trials on a sample of the
+actual texts:
+
+1. on CPU, every split of the cores into worker processes and intra-op
+   threads, at the default batch budget;
+2. at the fastest layout, a range of token budgets and then batch row caps.
+
+Each trial starts a fresh ``TransformerScorer`` without a score cache, warms
+it up outside the timed region and samples the resident memory of the
+parent and its workers while it scores. Trials above ``memory_limit_mb``
+are rejected and the fastest remaining configuration is saved in
+``autotune.json`` under ``host|model|backend|device``. ``build_scorers``
+picks it up from there.
+
+    python -m review_sentiment.autotune shards/*.parquet --models distilbert roberta
+"""
+
+import argparse
+import json
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+TUNING_FILE = 'autotune.json'
+BATCH_TOKENS = (2048, 4096, 8192, 16384)
+BATCH_SIZES = (16, 32, 64, 128)
+
+
+def total_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2 ** 20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def rss_mb(pid):
+    """Current resident memory of process ``pid`` in MiB, or None where it cannot be read."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+
+        return psutil.Process(pid).memory_info().rss / 2 ** 20
+    except Exception:
+        return None
+
+
+class MemorySampler:
+    """Background thread tracking the peak summed RSS of ``pids()`` while it runs."""
+
+    def __init__(self, pids, interval=0.05):
+        self.pids = pids
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            sizes = [rss_mb(pid) for pid in self.pids()]
+            self.peak = max(self.peak, sum(size for size in sizes if size))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def core_layouts(cores=None):
+    """``(processes, intra_op_threads)`` splits of ``cores`` for 1, 2, 4, ... threads per worker."""
+    cores = cores or os.cpu_count() or 1
+    layouts = []
+    threads = 1
+    while threads <= cores:
+        layouts.append((cores // threads, threads))
+        threads *= 2
+    return layouts
+
+
+def run_trial(model_name, texts, backend='torch', device=None, **settings):
+    """Score ``texts`` once with ``settings`` (``TransformerScorer`` arguments); returns throughput and memory."""
+    from .scoring import TransformerScorer
+
+    with TransformerScorer(model_name, device=device, backend=backend, **settings) as scorer:
+        # Start the workers and load the model on every one of them before timing.
+        processes = settings.get('processes') or 1
+        scorer(texts[:min(len(texts), 2 * processes * settings.get('max_batch_size', 64))])
+        tokens_before = scorer.stats['tokens']
+        with MemorySampler(scorer.pids) as memory:
+            start = time.perf_counter()
+            scorer(texts)
+            elapsed = time.perf_counter() - start
+        tokens = scorer.stats['tokens'] - tokens_before
+    return dict(settings, rows_per_s=len(texts) / elapsed, tokens_per_s=tokens / elapsed,
+                peak_rss_mb=memory.peak or None)
+
+
+def tuning_key(model_name, backend='torch', device='cpu'):
+    return f'{platform.node()}|{model_name}|{backend}|{device}'
+
+
+def load_tunings(path=TUNING_FILE):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def tuned_settings(model_name, backend='torch', device='cpu', path=TUNING_FILE):
+    """``TransformerScorer`` keyword arguments saved by ``autotune`` for this host, or ``{}``."""
+    entry = load_tunings(path).get(tuning_key(model_name, backend, device))
+    if not entry:
+        return {}
+    return {name: entry[name] for name in ('processes', 'intra_op_threads', 'max_tokens', 'max_batch_size')
+            if entry.get(name) is not None}
+
+
+def autotune(model_name, texts, backend='torch', device=None, memory_limit_mb=None, sample_rows=1000, seed=0,
+             path=TUNING_FILE, log=print):
+    """Find and save the fastest scoring settings for ``model_name`` on a sample of ``texts``.
+
+    ``memory_limit_mb`` defaults to 80% of the machine's memory. Returns
+    the saved entry: the chosen settings, their throughput and peak memory,
+    and every trial that was run.
+    """
+    from .inference import select_device
+
+    device = select_device(device)
+    texts = list(texts)
+    rng = np.random.default_rng(seed)
+    sample = [texts[i] for i in rng.choice(len(texts), min(sample_rows, len(texts)), replace=False)]
+    if memory_limit_mb is None and total_memory_mb():
+        memory_limit_mb = 0.8 * total_memory_mb()
+    trials = []
+
+    def trial(**settings):
+        result = run_trial(model_name, sample, backend, device, **settings)
+        result['within_limit'] = not (memory_limit_mb and result['peak_rss_mb'] and
+                                      result['peak_rss_mb'] > memory_limit_mb)
+        trials.append(result)
+        log(f"{settings}: {result['rows_per_s']:.1f} rows/s, {result['tokens_per_s']:.0f} tokens/s, "
+            f"peak {result['peak_rss_mb'] or float('nan'):.0f} MiB{'' if result['within_limit'] else ' (over limit)'}")
+        return result
+
+    def best(candidates):
+        allowed = [t for t in candidates if t['within_limit']]
+        return max(allowed, key=lambda t: t['rows_per_s']) if allowed else None
+
+    base = {'max_tokens': 8192, 'max_batch_size': 64}
+    layout = {}
+    if device == 'cpu':
+        chosen = best([trial(processes=p, intra_op_threads=t, **base) for p, t in core_layouts()])
+        if chosen is None:
+            raise RuntimeError(f"no worker layout fits in {memory_limit_mb:.0f} MiB; lower the batch budget")
+        layout = {'processes': chosen['processes'], 'intra_op_threads': chosen['intra_op_threads']}
+    # The batch row cap is lifted while the token budget is chosen, then brought back down.
+    chosen_tokens = best([trial(max_tokens=m, max_batch_size=max(BATCH_SIZES), **layout) for m in BATCH_TOKENS])
+    max_tokens = chosen_tokens['max_tokens'] if chosen_tokens else min(BATCH_TOKENS)
+    chosen = best([trial(max_tokens=max_tokens, max_batch_size=b, **layout) for b in BATCH_SIZES])
+    if chosen is None:
+        raise RuntimeError(f"no batch setting fits in {memory_limit_mb:.0f} MiB")
+
+    entry = dict(chosen, model=model_name, backend=backend, device=device, host=platform.node(),
+                 cpu_count=os.cpu_count(), memory_limit_mb=memory_limit_mb, sample_rows=len(sample),
+                 median_chars=float(np.median([len(t) for t in sample])),
+                 tuned=time.strftime('%Y-%m-%dT%H:%M:%S'), trials=trials)
+    tunings = load_tunings(path)
+    tunings[tuning_key(model_name, backend, device)] = entry
+    with open(path + '.tmp', 'w') as f:
+        json.dump(tunings, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return entry
+
+
+def main(argv=None):
+    from .ingest import iter_record_batches
+    from .scoring import MODELS
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('shards', nargs='+', help='review shards to take the calibration sample from')
+    parser.add_argument('--models', nargs='+', default=['distilbert'], choices=list(MODELS))
+    parser.add_argument('--backend', default='torch', help='torch, torch-int8, onnx or onnx-int8')
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--sample-rows', type=int, default=1000)
+    parser.add_argument('--memory-limit-mb', type=float, default=None, help='default: 80%% of the machine memory')
+    parser.add_argument('--output', default=TUNING_FILE)
+    args = parser.parse_args(argv)
+
+    # A few batches' worth of rows from the front of the shards is plenty to sample from.
+    texts = []
+    for chunk in iter_record_batches(args.shards, batch_rows=10 * args.sample_rows, columns=['text']):
+        texts.extend(chunk['text'].tolist())
+        if len(texts) >= 10 * args.sample_rows:
+            break
+    for name in args.models:
+        entry = autotune(MODELS[name][0], texts, args.backend, args.device, args.memory_limit_mb, args.sample_rows,
+                         path=args.output)
+        print(f"{name}: processes={entry.get('processes')}, intra_op_threads={entry.get('intra_op_threads')}, "
+              f"max_tokens={entry['max_tokens']}, max_batch_size={entry['max_batch_size']} "
+              f"-> {entry['rows_per_s']:.1f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Inference backends for the transformer scorers.
+
+``torch``       the fp32 PyTorch model, as before
+``torch-int8``  the same model with its Linear layers dynamically quantized to int8
+``onnx``        the model exported to ONNX and run with ONNX Runtime
+``onnx-int8``   the ONNX export with dynamically quantized int8 weights
+
+Every backend turns padded ``(input_ids, attention_mask)`` arrays into the
+positive-minus-negative sentiment score. The int8 and ONNX variants trade a
+little accuracy for CPU speed, so ``drift_report`` compares their scores
+against the fp32 ``sentiment_score`` on a held-out sample before they are
+trusted for a full category.
+"""
+
+import os
+
+import numpy as np
+
+BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+
+
+def _softmax_sentiment(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=-1, keepdims=True)
+    return (probs[:, 1] - probs[:, 0]).astype(np.float32)  # POSITIVE score - NEGATIVE score
+
+
+class TorchBackend:
+    def __init__(self, model, device='cpu'):
+        self.model = model
+        self.device = device
+
+    def scores(self, input_ids, attention_mask):
+        from .inference import encoded_scores
+
+        return encoded_scores(self.model, input_ids, attention_mask, self.device)
+
+
+class OnnxBackend:
+    def __init__(self, path, intra_op_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def scores(self, input_ids, attention_mask):
+        feeds = {'input_ids': np.asarray(input_ids, dtype=np.int64),
+                 'attention_mask': np.asarray(attention_mask, dtype=np.int64)}
+        logits, = self.session.run(['logits'], feeds)
+        return _softmax_sentiment(logits)
+
+
+def quantize_dynamic_int8(model):
+    """Copy of ``model`` with int8 weights and dynamically quantized activations in every Linear layer."""
+    import torch
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(model, path, opset_version=14):
+    """Export ``model`` to ``path`` with dynamic batch and sequence axes; returns ``path``."""
+    import torch
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    dummy = torch.ones((2, 8), dtype=torch.long)
+    axes = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(LogitsOnly(model.cpu().eval()), (dummy, dummy), path,
+                          input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                          dynamic_axes={'input_ids': axes, 'attention_mask': axes, 'logits': {0: 'batch'}},
+                          opset_version=opset_version)
+    return path
+
+
+def onnx_path(model_name, onnx_dir='onnx_models', int8=False):
+    return os.path.join(onnx_dir, model_name.replace('/', '--') + ('-int8' if int8 else '') + '.onnx')
+
+
+def ensure_onnx(model_name, onnx_dir='onnx_models', int8=False):
+    """Path of the (optionally int8) ONNX export of ``model_name``, exporting it on first use."""
+    path = onnx_path(model_name, onnx_dir, int8)
+    if os.path.exists(path):
+        return path
+    fp32_path = onnx_path(model_name, onnx_dir)
+    if not os.path.exists(fp32_path):
+        from .inference import load_model
+
+        _, model = load_model(model_name, 'cpu')
+        export_onnx(model, fp32_path + '.tmp')
+        os.replace(fp32_path + '.tmp', fp32_path)
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, path + '.tmp', weight_type=QuantType.QInt8)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def load_backend(model_name, backend='torch', device='cpu', onnx_dir='onnx_models', intra_op_threads=None):
+    """Build the scoring backend called ``backend`` for ``model_name``."""
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}, expected one of {BACKENDS}")
+    if backend != 'torch' and device != 'cpu':
+        raise ValueError(f"the {backend} backend only runs on CPU")
+    if backend.startswith('onnx'):
+        return OnnxBackend(ensure_onnx(model_name, onnx_dir, int8=backend == 'onnx-int8'), intra_op_threads)
+
+    from .inference import load_model
+
+    _, model = load_model(model_name, device)
+    if backend == 'torch-int8':
+        model = quantize_dynamic_int8(model)
+    return TorchBackend(model, device)
+
+
+def drift_report(reference, candidate, threshold=0.35):
+    """How far ``candidate`` scores drift from the fp32 ``reference`` scores of the same texts.
+
+    Reports the absolute score differences, their correlation and how often
+    both agree on the three-class label (±``threshold``) and on the sign.
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    diff = np.abs(reference - candidate)
+    classes = lambda s: np.where(s > threshold, 2, np.where(s < -threshold, 0, 1))
+    return {
+        'rows': int(len(reference)),
+        'max_abs_diff': float(diff.max()) if len(diff) else 0.0,
+        'mean_abs_diff': float(diff.mean()) if len(diff) else 0.0,
+        'correlation': float(np.corrcoef(reference, candidate)[0, 1]) if len(diff) > 1 else 1.0,
+        'label_agreement': float((classes(reference) == classes(candidate)).mean()) if len(diff) else 1.0,
+        'sign_agreement': float(((reference > 0) == (candidate > 0)).mean()) if len(diff) else 1.0,
+    }
+
+
+def check_backend_drift(df, model_name, backend, column='sentiment_score', sample_size=2000, seed=42, **scorer_kwargs):
+    """Score a random held-out sample of ``df`` with ``backend`` and compare it with ``df[column]``."""
+    from .scoring import TransformerScorer
+
+    sample = df.sample(n=min(sample_size, len(df)), random_state=seed)
+    with TransformerScorer(model_name, backend=backend, **scorer_kwargs) as scorer:
+        scores = scorer(sample['text'].tolist())
+    return drift_report(sample[column].to_numpy(), scores)
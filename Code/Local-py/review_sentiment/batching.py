@@ -0,0 +1,82 @@
+"""Length-bucketed batching for transformer sentiment scoring.
+
+Fixed 20-row slices in file order mean one very long review makes every other
+review in its batch pad out to 512 tokens. Here reviews are sorted by their
+tokenized length and packed into batches under a token budget (rows x longest
+row), then the scores are scattered back to the original row order.
+"""
+
+import numpy as np
+
+
+def token_lengths(texts, tokenizer, max_length=512, chunk_size=1000):
+    """Number of tokens each text takes after truncation to ``max_length``."""
+    lengths = np.empty(len(texts), dtype=np.int32)
+    for start in range(0, len(texts), chunk_size):
+        chunk = list(texts[start:start + chunk_size])
+        encoded = tokenizer(chunk, truncation=True, max_length=max_length)
+        lengths[start:start + len(chunk)] = [len(ids) for ids in encoded['input_ids']]
+    return lengths
+
+
+def plan_batches(lengths, max_tokens=8192, max_batch_size=64):
+    """Pack row indices into batches whose padded size stays under ``max_tokens``.
+
+    Rows are visited from shortest to longest so every batch holds reviews of
+    similar length. The padded size of a batch is its row count times its
+    longest row, which is what the tokenizer allocates with ``padding=True``.
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    current = []
+    for idx in order:
+        longest = lengths[idx]  # ascending, so the new row is the longest
+        if current and (len(current) >= max_batch_size or (len(current) + 1) * longest > max_tokens):
+            batches.append(np.array(current))
+            current = []
+        current.append(idx)
+    if current:
+        batches.append(np.array(current))
+    return batches
+
+
+def padding_stats(lengths, batches):
+    """Tokens processed, padded tokens allocated and the padding ratio of a plan."""
+    lengths = np.asarray(lengths)
+    tokens = int(lengths.sum())
+    padded = int(sum(len(batch) * lengths[batch].max() for batch in batches))
+    return {
+        'rows': int(len(lengths)),
+        'batches': len(batches),
+        'tokens': tokens,
+        'padded_tokens': padded,
+        'padding_ratio': (padded - tokens) / padded if padded else 0.0,
+    }
+
+
+def scatter_scores(n_rows, batches, batch_scores):
+    """Put per-batch scores back into original row order."""
+    scores = np.empty(n_rows, dtype=np.float32)
+    for batch, values in zip(batches, batch_scores):
+        scores[batch] = values
+    return scores
+
+
+def score_bucketed(texts, tokenizer, score_batches, max_tokens=8192, max_batch_size=64,
+                   max_length=512, lengths=None, make_batch=None):
+    """Score ``texts`` in length-bucketed batches and return ``(scores, stats)``.
+
+    ``score_batches`` takes an iterable of text lists and yields one score
+    array per batch in the same order, e.g. ``lambda b: map(score_fn, b)``.
+    Scores come back aligned with ``texts``. ``make_batch`` turns a batch of
+    row indices into what ``score_batches`` receives; by default the texts.
+    """
+    texts = list(texts)
+    if lengths is None:
+        lengths = token_lengths(texts, tokenizer, max_length=max_length)
+    if make_batch is None:
+        make_batch = lambda batch: [texts[i] for i in batch]
+    batches = plan_batches(lengths, max_tokens=max_tokens, max_batch_size=max_batch_size)
+    scores = scatter_scores(len(texts), batches, score_batches(make_batch(batch) for batch in batches))
+    return scores, padding_stats(lengths, batches)
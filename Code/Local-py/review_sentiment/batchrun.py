@@ -0,0 +1,543 @@
+"""Sharded batch runs over many categories and machines, coordinated through a shared directory.
+
+The script scores the single ``raw_review_All_Beauty`` split on one machine.
+A batch run cuts every category's reviews into row-range shards of
+``shard_rows`` rows, each described by a JSON manifest, and any number of
+workers on any host that mounts the run directory claim and score them:
+
+    python -m review_sentiment.batchrun plan runs/2023 --category All_Beauty Books --cache-dir /shared/hf --models distilbert vader
+    python -m review_sentiment.batchrun work runs/2023      # on every machine
+    python -m review_sentiment.batchrun status runs/2023
+
+Layout of the run directory::
+
+    plan.json                                  categories, models and settings shared by every worker
+    queue.json, queue.lock                     task states, only read or written under the lock
+    shards/<category>/shard-00000.json         manifest: row range and the [file, first, stop) ranges it covers
+    shards/<category>/shard-00000/             store/ (scored reviews), panel.npz, cube.parquet
+    results/<category>/                        store/, panel_moments.npz, sentiment_cube.parquet, summary.json
+
+There is no broker: the queue is ``queue.json``, read and rewritten only
+while holding an exclusive ``fcntl.lockf`` lock on ``queue.lock`` (POSIX
+locks are honoured over NFS). A claim is a lease that the worker renews
+from a heartbeat thread; a lease that has not been renewed for
+``lease_seconds`` (a dead worker or host) goes to the next claimant. A
+failed attempt puts its task back in the queue until it has been tried
+``max_attempts`` times. Every attempt writes under its own name and is
+moved into place only if its lease is still current, so a worker that lost
+its lease cannot overwrite the attempt that replaced it. Leases are wall-clock
+times, so the hosts' clocks have to agree to well within ``lease_seconds``.
+
+Each shard task writes its featurized and scored reviews plus their
+sufficient statistics: the ``PanelAccumulator`` of the panel regression and
+the ``AnalysisCube`` of the charts. Once every shard of a category is done, a
+merge task from the same queue assembles ``results/<category>/``: a
+``ResultsStore`` with one part per shard chunk for the ``classify`` and
+``panel`` stages (``python -m review_sentiment --store
+runs/2023/results/Books/store classify``), the ``PanelMoments`` of the
+merged statistics (``panel --refit --moments .../panel_moments.npz``) and
+the merged cube.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import platform
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .autotune import TUNING_FILE
+from .checkpoint import write_json_atomic
+from .cli import PANEL_REGRESSORS
+from .ingest import arrow_batches, expand_shards
+
+PLAN = 'plan.json'
+QUEUE = 'queue.json'
+
+
+def count_rows(path):
+    """Row count of one Arrow, Parquet or JSONL shard file (Parquet from its footer, the others by a scan)."""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).metadata.num_rows
+    if path.endswith('.arrow'):
+        return sum(batch.num_rows for batch in arrow_batches(path))
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def shard_ranges(files, shard_rows):
+    """Cut the concatenation of ``files`` ([path, rows] pairs) into ``shard_rows`` ranges.
+
+    Returns one dict per shard with its ``start`` and ``stop`` row and the
+    ``sources`` it covers as ``[path, first, stop]`` row ranges within each file.
+    """
+    offsets = np.cumsum([0] + [rows for _, rows in files])
+    shards = []
+    for start in range(0, int(offsets[-1]), shard_rows):
+        stop = min(start + shard_rows, int(offsets[-1]))
+        sources = [[path, max(start - int(offset), 0), min(stop - int(offset), rows)]
+                   for (path, rows), offset in zip(files, offsets[:-1])
+                   if rows and offset + rows > start and offset < stop]
+        shards.append({'start': start, 'stop': stop, 'sources': sources})
+    return shards
+
+
+def _slice_batches(batches, offset, first, stop):
+    for batch in batches:
+        n = len(batch)
+        if offset + n > first:
+            lo, hi = max(first - offset, 0), min(stop - offset, n)
+            yield batch.iloc[lo:hi] if isinstance(batch, pd.DataFrame) else batch.slice(lo, hi - lo)
+        offset += n
+        if offset >= stop:
+            return
+
+
+def read_rows(sources, batch_rows=50_000):
+    """Yield the rows of ``sources`` (``[path, first, stop]`` ranges, see ``shard_ranges``) as DataFrames.
+
+    Parquet files skip straight to the row groups holding the range and
+    Arrow files are memory-mapped, so only JSONL parses the rows it skips.
+    """
+    import pyarrow as pa
+
+    for path, first, stop in sources:
+        offset = 0
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+
+            parquet = pq.ParquetFile(path)
+            bounds = np.cumsum([0] + [parquet.metadata.row_group(i).num_rows for i in range(parquet.num_row_groups)])
+            groups = [i for i in range(parquet.num_row_groups) if bounds[i + 1] > first and bounds[i] < stop]
+            if not groups:
+                continue
+            offset = int(bounds[groups[0]])
+            batches = parquet.iter_batches(batch_size=batch_rows, row_groups=groups)
+        elif path.endswith('.arrow'):
+            batches = arrow_batches(path)
+        else:
+            batches = pd.read_json(path, lines=True, chunksize=batch_rows, dtype=False)
+        pending, pending_rows = [], 0
+        for batch in _slice_batches(batches, offset, first, stop):
+            if isinstance(batch, pd.DataFrame):
+                yield batch.reset_index(drop=True)
+                continue
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= batch_rows:
+                yield pa.Table.from_batches(pending).to_pandas()
+                pending, pending_rows = [], 0
+        if pending:
+            yield pa.Table.from_batches(pending).to_pandas()
+
+
+class WorkQueue:
+    """Leased tasks kept in ``<root>/queue.json`` under an ``fcntl`` lock, shared by every worker of a run.
+
+    A task is a dict with ``status`` (pending, running, done or failed),
+    ``attempts``, ``lease`` and ``errors``; a task with ``requires`` can only
+    be claimed once all of those tasks are done, and fails as soon as one of
+    them has failed for good.
+    """
+
+    def __init__(self, root, lease_seconds=900, max_attempts=3):
+        self.root = root
+        self.path = os.path.join(root, QUEUE)
+        self.lock_path = os.path.join(root, 'queue.lock')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @contextlib.contextmanager
+    def _locked(self, write=True):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as f:
+                    tasks = json.load(f)
+                yield tasks
+                if write:
+                    write_json_atomic(tasks, self.path)
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def create(self, tasks):
+        """Start the queue with ``tasks`` (task id -> dict of extra fields), all pending."""
+        os.makedirs(self.root, exist_ok=True)
+        write_json_atomic({task_id: {**task, 'status': 'pending', 'attempts': 0, 'lease': None, 'errors': []}
+                           for task_id, task in tasks.items()}, self.path)
+
+    def tasks(self):
+        with self._locked(write=False) as tasks:
+            return tasks
+
+    @staticmethod
+    def _fail_blocked(tasks):
+        for task in tasks.values():
+            failed = [other for other in task.get('requires', ()) if tasks[other]['status'] == 'failed']
+            if task['status'] == 'pending' and failed:
+                task['errors'].append(f"required task {failed[0]} failed")
+                task['status'] = 'failed'
+
+    def claim(self, owner):
+        """Lease the next runnable task to ``owner``; returns ``(task_id, task, token)`` or ``None``.
+
+        Pending tasks go first, merges before shards; a running task whose
+        lease has expired is taken over as a new attempt, or marked failed
+        once it has used up ``max_attempts``.
+        """
+        now = time.time()
+        with self._locked() as tasks:
+            for task in tasks.values():
+                if task['status'] == 'running' and task['lease']['expires'] < now:
+                    task['errors'].append(f"lease of {task['lease']['owner']} expired")
+                    task['status'] = 'pending' if task['attempts'] < self.max_attempts else 'failed'
+                    task['lease'] = None
+            self._fail_blocked(tasks)
+            runnable = [task_id for task_id, task in tasks.items()
+                        if task['status'] == 'pending'
+                        and all(tasks[other]['status'] == 'done' for other in task.get('requires', ()))]
+            if not runnable:
+                return None
+            task_id = min(runnable, key=lambda task_id: (tasks[task_id]['kind'] != 'merge', task_id))
+            task = tasks[task_id]
+            token = uuid.uuid4().hex
+            task.update(status='running', attempts=task['attempts'] + 1,
+                        lease={'owner': owner, 'token': token, 'expires': now + self.lease_seconds})
+            return task_id, dict(task), token
+
+    def renew(self, task_id, token):
+        """Extend the lease; ``False`` if it has been lost to another worker."""
+        with self._locked() as tasks:
+            task = tasks[task_id]
+            if task['status'] != 'running' or task['lease']['token'] != token:
+                return False
+            task['lease']['expires'] = time.time() + self.lease_seconds
+            return True
+
+    def complete(self, task_id, token, commit=None):
+        """Mark the task done if ``token`` still holds its lease, calling ``commit()`` first under the lock."""
+        with self._locked() as tasks:
+            task = tasks[task_id]
+            if task['status'] != 'running' or task['lease']['token'] != token:
+                return False
+            if commit is not None:
+                commit()
+            task.update(status='done', lease=None)
+            return True
+
+    def fail(self, task_id, token, error):
+        """Record a failed attempt and queue the task again, unless it has used up ``max_attempts``."""
+        with self._locked() as tasks:
+            task = tasks[task_id]
+            if task['status'] != 'running' or task['lease']['token'] != token:
+                return
+            task['errors'].append(error)
+            task.update(status='pending' if task['attempts'] < self.max_attempts else 'failed', lease=None)
+            self._fail_blocked(tasks)
+
+    def counts(self):
+        counts = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        for task in self.tasks().values():
+            counts[task['status']] += 1
+        return counts
+
+
+def _heartbeat(queue, task_id, token, stop, lost):
+    while not stop.wait(queue.lease_seconds / 4):
+        if not queue.renew(task_id, token):
+            lost.set()
+            return
+
+
+def plan_run(root, sources, models=('distilbert',), shard_rows=500_000, batch_rows=50_000,
+             panel_target='sentiment_score', panel_regressors=PANEL_REGRESSORS, standardize=True,
+             lease_seconds=900, max_attempts=3, log=print):
+    """Write the shard manifests, ``plan.json`` and the queue of a new run under ``root``.
+
+    ``sources`` maps a category name to its shard files (paths, directories
+    or glob patterns readable from every worker). The panel statistics are
+    only collected when ``panel_target`` is one of the scored columns.
+    """
+    from .scoring import MODELS, VADER_COLUMN
+
+    if os.path.exists(os.path.join(root, PLAN)):
+        raise ValueError(f"{root!r} already holds a planned run")
+    columns = [VADER_COLUMN if name == 'vader' else MODELS[name][1] for name in models]
+    plan = {'models': list(models), 'columns': columns, 'shard_rows': shard_rows, 'batch_rows': batch_rows,
+            'panel_target': panel_target if panel_target in columns else None,
+            'panel_regressors': list(panel_regressors), 'standardize': standardize,
+            'lease_seconds': lease_seconds, 'max_attempts': max_attempts, 'categories': {}}
+    tasks = {}
+    for category, paths in sources.items():
+        files = [[os.path.abspath(path), count_rows(path)] for path in expand_shards(paths)]
+        shards = shard_ranges(files, shard_rows)
+        directory = os.path.join(root, 'shards', category)
+        os.makedirs(directory, exist_ok=True)
+        shard_ids = []
+        for index, shard in enumerate(shards):
+            name = f'shard-{index:05d}'
+            write_json_atomic({'category': category, 'index': index, **shard}, os.path.join(directory, name + '.json'))
+            shard_ids.append(f'{category}/{name}')
+            tasks[shard_ids[-1]] = {'kind': 'shard', 'category': category, 'shard': name}
+        tasks[f'{category}/merge'] = {'kind': 'merge', 'category': category, 'requires': shard_ids}
+        plan['categories'][category] = {'rows': sum(rows for _, rows in files), 'files': len(files),
+                                        'shards': len(shards)}
+        log(f"{category}: {plan['categories'][category]['rows']} reviews in {len(files)} files, {len(shards)} shards")
+    write_json_atomic(plan, os.path.join(root, PLAN))
+    WorkQueue(root, lease_seconds, max_attempts).create(tasks)
+    return plan
+
+
+def load_plan(root):
+    with open(os.path.join(root, PLAN)) as f:
+        return json.load(f)
+
+
+def _panel_accumulator(plan):
+    from .panel import PanelAccumulator
+
+    return PanelAccumulator(plan['panel_regressors'], plan['panel_target'])
+
+
+def score_shard(plan, manifest, scorers, output):
+    """Featurize and score one shard's rows into ``output``: ``store/``, ``panel.npz`` and ``cube.parquet``."""
+    from . import profiling
+    from .cube import TIME_DIMENSIONS, AnalysisCube
+    from .features import add_interaction_features, add_review_features
+    from .panel import INTERACTIONS
+    from .scoring import fan_out
+    from .store import ResultsStore
+
+    os.makedirs(output, exist_ok=True)
+    store = ResultsStore(os.path.join(output, 'store'))
+    acc = _panel_accumulator(plan) if plan['panel_target'] else None
+    derived = any(c in INTERACTIONS for c in plan['panel_regressors'])
+    cube = AnalysisCube(TIME_DIMENSIONS, plan['columns'])
+    rows = 0
+    with ThreadPoolExecutor(len(scorers) or 1, thread_name_prefix='scorer') as executor:
+        for chunk in profiling.iterate('read', read_rows(manifest['sources'], plan['batch_rows'])):
+            with profiling.stage('features', rows=len(chunk)):
+                chunk = add_review_features(chunk.reset_index(drop=True))
+            with profiling.stage('score', rows=len(chunk)):
+                chunk = chunk.assign(**fan_out(scorers, chunk['text'], executor))
+            with profiling.stage('write', rows=len(chunk)):
+                store.append(chunk)
+            cube.add(chunk)
+            if acc is not None:
+                acc.update(add_interaction_features(chunk) if derived else chunk)
+            rows += len(chunk)
+    if acc is not None:
+        acc.save(os.path.join(output, 'panel.npz'))
+    if cube.cells is not None:
+        cube.save(os.path.join(output, 'cube.parquet'))
+    return rows
+
+
+def merge_category(root, plan, category, output):
+    """Assemble every finished shard of ``category`` into ``output`` (see the module docstring)."""
+    from .cube import AnalysisCube
+    from .panel import PanelAccumulator, PanelMoments
+    from .store import ResultsStore
+
+    directory = os.path.join(root, 'shards', category)
+    shards = [os.path.join(directory, f'shard-{index:05d}') for index in range(plan['categories'][category]['shards'])]
+    store = ResultsStore(os.path.join(output, 'store'))
+    os.makedirs(store.base_dir)
+    acc = _panel_accumulator(plan) if plan['panel_target'] else None
+    cube = None
+    for shard in shards:
+        shard_store = ResultsStore(os.path.join(shard, 'store'))
+        for part in shard_store.parts():
+            target = os.path.join(store.base_dir, f'part-{len(store.parts()):05d}.parquet')
+            # Hard links keep the shard files for a repeated merge without copying them.
+            try:
+                os.link(os.path.join(shard_store.base_dir, part), target)
+            except OSError:
+                shutil.copyfile(os.path.join(shard_store.base_dir, part), target)
+        if acc is not None and os.path.exists(os.path.join(shard, 'panel.npz')):
+            acc.merge(PanelAccumulator.load(os.path.join(shard, 'panel.npz')))
+        if os.path.exists(os.path.join(shard, 'cube.parquet')):
+            shard_cube = AnalysisCube.load(os.path.join(shard, 'cube.parquet'))
+            cube = shard_cube if cube is None else cube.merge(shard_cube)
+    summary = {'category': category, 'rows': len(store), 'shards': len(shards), 'columns': plan['columns']}
+    if acc is not None and acc.nobs:
+        moments = PanelMoments.from_accumulator(acc.standardized() if plan['standardize'] else acc)
+        moments.save(os.path.join(output, 'panel_moments.npz'))
+        summary.update(panel_rows=moments.nobs, panel_entities=moments.n_entities)
+    if cube is not None:
+        cube.save(os.path.join(output, 'sentiment_cube.parquet'))
+    write_json_atomic(summary, os.path.join(output, 'summary.json'))
+    return summary
+
+
+def _move_into_place(attempt, final):
+    def commit():
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(attempt, final)
+    return commit
+
+
+def run_worker(root, cache=None, device=None, backend='torch', tuning_file=TUNING_FILE, poll_seconds=30,
+               wait=True, log=print):
+    """Claim and run tasks from the run under ``root`` until none is left.
+
+    With ``wait`` the worker keeps polling every ``poll_seconds`` while
+    other workers still hold tasks (whose leases may expire or whose shards
+    unblock a merge); otherwise it stops as soon as nothing is claimable.
+    The scorers are opened once, on the first shard. Returns the number of
+    tasks this worker finished.
+    """
+    from .ingest import build_scorers
+
+    plan = load_plan(root)
+    queue = WorkQueue(root, plan['lease_seconds'], plan['max_attempts'])
+    owner = f'{platform.node()}:{os.getpid()}'
+    scorers = None
+    finished = 0
+    try:
+        while True:
+            claimed = queue.claim(owner)
+            if claimed is None:
+                counts = queue.counts()
+                if not wait or counts['pending'] + counts['running'] == 0:
+                    break
+                time.sleep(poll_seconds)
+                continue
+            task_id, task, token = claimed
+            if task['kind'] == 'shard':
+                final = os.path.join(root, 'shards', task['category'], task['shard'])
+            else:
+                final = os.path.join(root, 'results', task['category'])
+            attempt = f'{final}.attempt-{token}'
+            stop, lost = threading.Event(), threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat, args=(queue, task_id, token, stop, lost), daemon=True)
+            heartbeat.start()
+            start = time.perf_counter()
+            try:
+                if task['kind'] == 'shard':
+                    if scorers is None:
+                        scorers = build_scorers(plan['models'], cache=cache, device=device, backend=backend,
+                                                tuning_file=tuning_file)
+                    with open(final + '.json') as f:
+                        rows = score_shard(plan, json.load(f), scorers, attempt)
+                else:
+                    rows = merge_category(root, plan, task['category'], attempt)['rows']
+            except Exception as error:
+                stop.set()
+                queue.fail(task_id, token, f'{owner}: {type(error).__name__}: {error}')
+                shutil.rmtree(attempt, ignore_errors=True)
+                log(f"{task_id} failed on attempt {task['attempts']}: {error!r}")
+                continue
+            stop.set()
+            try:
+                completed = not lost.is_set() and queue.complete(task_id, token, _move_into_place(attempt, final))
+            except OSError as error:
+                queue.fail(task_id, token, f'{owner}: could not move the result into place: {error}')
+                shutil.rmtree(attempt, ignore_errors=True)
+                log(f"{task_id} failed on attempt {task['attempts']}: {error!r}")
+                continue
+            if not completed:
+                shutil.rmtree(attempt, ignore_errors=True)
+                log(f"{task_id}: lease lost to another worker, result discarded")
+                continue
+            finished += 1
+            log(f"{task_id}: {rows} rows in {time.perf_counter() - start:.1f}s")
+    finally:
+        for scorer in (scorers or {}).values():
+            scorer.close()
+    return finished
+
+
+def status(root):
+    """Task counts per category and status, plus the errors of failed tasks."""
+    summary, errors = {}, {}
+    for task_id, task in WorkQueue(root).tasks().items():
+        counts = summary.setdefault(task['category'], {'pending': 0, 'running': 0, 'done': 0, 'failed': 0})
+        counts[task['status']] += 1
+        if task['status'] == 'failed':
+            errors[task_id] = task['errors']
+    return summary, errors
+
+
+def _parse_sources(args):
+    from .ingest import hub_shards
+
+    sources = {}
+    for source in args.source or []:
+        category, _, pattern = source.partition('=')
+        sources.setdefault(category, []).append(pattern)
+    for category in args.category or []:
+        sources[category] = hub_shards(category, args.cache_dir)
+    return sources
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help='cut the categories into shards and create the queue')
+    plan_parser.add_argument('root', help='run directory on a filesystem every worker mounts')
+    plan_parser.add_argument('--category', nargs='+', default=None,
+                             help='Amazon-Reviews-2023 categories to download, e.g. All_Beauty Books')
+    plan_parser.add_argument('--cache-dir', default=None, help='shared Hugging Face datasets cache directory')
+    plan_parser.add_argument('--source', action='append', metavar='CATEGORY=PATTERN',
+                             help='local shard files for a category, e.g. Books=/data/books/*.parquet (repeatable)')
+    plan_parser.add_argument('--models', nargs='+', default=['distilbert'], help='distilbert, roberta and/or vader')
+    plan_parser.add_argument('--shard-rows', type=int, default=500_000)
+    plan_parser.add_argument('--batch-rows', type=int, default=50_000)
+    plan_parser.add_argument('--panel-target', default='sentiment_score')
+    plan_parser.add_argument('--raw', action='store_true', help='do not standardize the merged panel regressors')
+    plan_parser.add_argument('--lease-seconds', type=int, default=900,
+                             help='a claim not renewed for this long is handed to another worker')
+    plan_parser.add_argument('--max-attempts', type=int, default=3)
+
+    work_parser = commands.add_parser('work', help='claim and run shards until the run is finished')
+    work_parser.add_argument('root')
+    work_parser.add_argument('--cache', default='', help="score cache path on local disk, '' to disable")
+    work_parser.add_argument('--device', default=None)
+    work_parser.add_argument('--backend', default='torch', help='torch, torch-int8, onnx or onnx-int8')
+    work_parser.add_argument('--tuning-file', default=TUNING_FILE,
+                             help="settings saved by review_sentiment.autotune, '' to use the defaults")
+    work_parser.add_argument('--poll-seconds', type=float, default=30)
+    work_parser.add_argument('--no-wait', action='store_true',
+                             help='exit once nothing is claimable instead of waiting for other workers')
+
+    status_parser = commands.add_parser('status', help='task counts per category and failed tasks')
+    status_parser.add_argument('root')
+    args = parser.parse_args(argv)
+
+    if args.command == 'plan':
+        sources = _parse_sources(args)
+        if not sources:
+            parser.error("plan: give --category and/or --source")
+        try:
+            plan_run(args.root, sources, args.models, args.shard_rows, args.batch_rows, args.panel_target,
+                     standardize=not args.raw, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+        except ValueError as error:
+            parser.error(str(error))
+    elif args.command == 'work':
+        from .cache import ScoreCache
+
+        cache = ScoreCache(args.cache) if args.cache else None
+        finished = run_worker(args.root, cache, args.device, args.backend, args.tuning_file, args.poll_seconds,
+                              wait=not args.no_wait)
+        print(f"Finished {finished} tasks")
+    else:
+        summary, errors = status(args.root)
+        print(pd.DataFrame(summary).T.to_string())
+        for task_id, task_errors in errors.items():
+            print(f"FAILED {task_id}: {task_errors[-1]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""Reproducible CPU benchmarks for the scoring, feature, storage and modeling stages.
+
+Every benchmark runs on a review sample of a given size and review length
+distribution: synthetic reviews generated from a fixed seed, or rows drawn
+from a local sample of real reviews (``--sample``, any shard format
+``ingest`` reads). Each one is timed ``repeat`` times after an untimed
+setup, and the median is compared with a baseline file from an earlier run
+on the same host:
+
+    python -m review_sentiment.benchmark --sizes 1000 100000 --save-baseline bench/baseline.json
+    python -m review_sentiment.benchmark --sizes 1000 100000 --baseline bench/baseline.json
+
+A result slower than its baseline by more than ``--tolerance`` is reported
+as a regression and makes the command exit with status 1. The transformer
+scorers are capped at a few thousand rows by default (``--max-rows``
+overrides the caps), since a million-row CPU pass is a job, not a benchmark.
+
+``--startup`` instead times how long ``python -m review_sentiment <stage>
+--help`` takes for each stage and checks that no heavy library is loaded
+before a stage runs; it exits with status 1 past ``--startup-budget``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from .features import METADATA_FEATURES, add_interaction_features, add_review_features, binary_labels
+from .profiling import peak_rss_mb
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+STAGES = ('ingest', 'score', 'features', 'classify', 'panel', 'plot')
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'sklearn', 'scipy', 'statsmodels', 'linearmodels', 'xgboost', 'torch',
+                 'transformers', 'matplotlib', 'seaborn', 'datasets')
+STARTUP_BUDGET_S = 1.0
+
+# Review length in characters: (median, lognormal sigma). 'amazon' mimics the long tail of real reviews.
+LENGTHS = {
+    'short': (60, 0.5),
+    'amazon': (180, 1.1),
+    'long': (1500, 0.4),
+}
+
+_POSITIVE = ('great', 'love', 'excellent', 'perfect', 'amazing', 'soft', 'recommend', 'happy', 'best', 'nice')
+_NEGATIVE = ('bad', 'broke', 'terrible', 'waste', 'disappointed', 'cheap', 'return', 'worst', 'awful', 'smell')
+_NEUTRAL = ('the', 'product', 'it', 'and', 'this', 'was', 'for', 'my', 'skin', 'hair', 'bottle', 'color', 'after',
+            'use', 'days', 'a', 'is', 'very', 'not', 'with', 'i', 'to', 'of', 'size', 'price', 'shipping')
+
+
+def _corpus(rng, sentiment_words, n_words=400_000):
+    words = np.array(_NEUTRAL + sentiment_words)
+    weights = np.r_[np.full(len(_NEUTRAL), 3.0), np.full(len(sentiment_words), 1.0)]
+    return ' '.join(rng.choice(words, n_words, p=weights / weights.sum())) + ' '
+
+
+def synthetic_reviews(n, lengths='amazon', seed=0):
+    """``n`` reviews shaped like the Amazon-Reviews-2023 rows, with texts whose lengths follow ``LENGTHS[lengths]``.
+
+    Positive ratings draw their text from a corpus with positive words and
+    negative ratings from one with negative words, so the scorers and
+    classifiers have some signal to find. Users are skewed, so the panel
+    models see entities with many reviews.
+    """
+    rng = np.random.default_rng(seed)
+    median, sigma = LENGTHS[lengths]
+    chars = np.clip(rng.lognormal(np.log(median), sigma, n).astype(np.int64), 5, 20_000)
+    rating = rng.choice([1.0, 2.0, 3.0, 4.0, 5.0], n, p=[0.1, 0.06, 0.08, 0.16, 0.6])
+    corpora = {'pos': _corpus(rng, _POSITIVE), 'neg': _corpus(rng, _NEGATIVE),
+               'mix': _corpus(rng, _POSITIVE + _NEGATIVE)}
+    tone = np.where(rating >= 4, 'pos', np.where(rating <= 2, 'neg', 'mix'))
+    starts = rng.integers(0, len(corpora['pos']) - 20_001, n)
+    texts = [corpora[t][s:s + c] for t, s, c in zip(tone, starts, chars)]
+
+    n_users = max(1, n // 3)
+    users = (n_users * rng.random(n) ** 2).astype(np.int64)
+    return pd.DataFrame({
+        'rating': rating,
+        'title': 'review title',
+        'text': texts,
+        'images': [[] if has else ['https://example.com/image.jpg'] for has in rng.random(n) > 0.1],
+        'asin': [f'B{a:09d}' for a in rng.integers(0, max(1, n // 20), n)],
+        'parent_asin': [f'B{a:09d}' for a in rng.integers(0, max(1, n // 30), n)],
+        'user_id': [f'U{u:08d}' for u in users],
+        'timestamp': 1_500_000_000_000 + rng.integers(0, 200_000_000_000, n),
+        'helpful_vote': rng.poisson(0.8, n),
+        'verified_purchase': rng.random(n) < 0.9,
+        'sentiment_score': np.tanh(rating - 3 + rng.normal(0, 0.7, n)).astype(np.float32),
+    })
+
+
+def sample_reviews(path, n, seed=0):
+    """``n`` rows drawn (with replacement if the sample is smaller) from local review shards at ``path``."""
+    from .ingest import iter_record_batches
+
+    sample = pd.concat(iter_record_batches([path]), ignore_index=True)
+    rows = np.random.default_rng(seed).choice(len(sample), n, replace=n > len(sample))
+    sample = sample.iloc[rows].reset_index(drop=True)
+    if 'sentiment_score' not in sample.columns:
+        sample['sentiment_score'] = np.tanh(sample['rating'].to_numpy() - 3).astype(np.float32)
+    return sample
+
+
+# Each benchmark takes the featurized reviews and a scratch directory, does its untimed setup
+# and returns the zero-argument callable that is timed (with a ``close`` attribute if it holds resources).
+
+def _bench_features(df, workdir):
+    raw = df.drop(columns=['review_length', 'has_images', 'year', 'month', 'day', 'weekday'])
+    return lambda: add_interaction_features(add_review_features(raw.copy()))
+
+
+def _bench_store_write(df, workdir):
+    from .store import ResultsStore
+
+    store = ResultsStore(os.path.join(workdir, 'store'))
+    return lambda: store.write(df)
+
+
+def _bench_parquet_reload(df, workdir):
+    from .store import ResultsStore
+
+    store = ResultsStore(os.path.join(workdir, 'store'))
+    store.write(df)
+    return lambda: store.read(columns=METADATA_FEATURES + ['sentiment_score'])
+
+
+def _bench_jsonl_reload(df, workdir):
+    path = os.path.join(workdir, 'results.jsonl')
+    df.to_json(path, orient='records', lines=True, date_format='iso')
+    return lambda: pd.read_json(path, lines=True)
+
+
+def _scorer_bench(model):
+    def bench(df, workdir):
+        from .scoring import MODELS, TransformerScorer, VaderScorer
+
+        # Import here so a missing package is reported as skipped rather than as a crashed worker pool.
+        if model == 'vader':
+            import vaderSentiment  # noqa: F401
+            scorer = VaderScorer()
+        else:
+            import torch  # noqa: F401
+            import transformers  # noqa: F401
+            scorer = TransformerScorer(MODELS[model][0], device='cpu')
+        texts = df['text'].tolist()
+        scorer(texts[:64])  # load the model / start the workers outside the timed region
+
+        def run():
+            return scorer(texts)
+        run.close = scorer.close
+        return run
+    return bench
+
+
+def _bench_logistic_regression(df, workdir):
+    from sklearn.linear_model import LogisticRegression
+
+    X, y = df[METADATA_FEATURES], binary_labels(df['sentiment_score'])
+    return lambda: LogisticRegression(max_iter=1000).fit(X, y)
+
+
+def _bench_xgboost(df, workdir):
+    from xgboost import XGBClassifier
+
+    X = add_interaction_features(df[METADATA_FEATURES]).drop(columns=['review_length'])
+    y = binary_labels(df['sentiment_score'])
+    return lambda: XGBClassifier(learning_rate=0.1, max_depth=6, n_estimators=100, tree_method='hist').fit(X, y)
+
+
+def _bench_panel(df, workdir):
+    from .panel import PanelAccumulator, PanelMoments
+
+    regressors = ['rating', 'log_review_length', 'helpful_vote', 'verified_purchase', 'has_images',
+                  'year', 'month', 'day', 'weekday', 'rating_review_length']
+    frame = add_interaction_features(df)
+
+    def run():
+        acc = PanelAccumulator(regressors, 'sentiment_score').update(frame).standardized()
+        return PanelMoments.from_accumulator(acc).fit()
+    return run
+
+
+# name -> (default row cap, benchmark)
+BENCHMARKS = {
+    'features': (None, _bench_features),
+    'store_write': (None, _bench_store_write),
+    'parquet_reload': (None, _bench_parquet_reload),
+    'jsonl_reload': (None, _bench_jsonl_reload),
+    'vader': (100_000, _scorer_bench('vader')),
+    'distilbert': (2_000, _scorer_bench('distilbert')),
+    'roberta': (2_000, _scorer_bench('roberta')),
+    'logistic_regression': (None, _bench_logistic_regression),
+    'xgboost': (None, _bench_xgboost),
+    'panel': (None, _bench_panel),
+}
+
+
+def result_key(result):
+    return f"{result['benchmark']}|{result['rows']}|{result['lengths']}"
+
+
+def run_benchmarks(names=None, sizes=SIZES, lengths=('amazon',), repeat=3, max_rows=None, sample=None, seed=0,
+                   log=print):
+    """Run ``names`` (default: all of ``BENCHMARKS``) for every size and length distribution.
+
+    Returns one dict per run with the median and minimum seconds, rows/s
+    and peak RSS, or a ``skipped`` reason when a dependency is missing or
+    the size is above the benchmark's row cap. A run that raises is recorded
+    with its ``failed`` error and the suite goes on with the next one.
+    """
+    results = []
+    for size in sizes:
+        for length in ([None] if sample else lengths):
+            df = sample_reviews(sample, size, seed) if sample else synthetic_reviews(size, length, seed)
+            df = add_review_features(df)
+            for name in names or BENCHMARKS:
+                cap, bench = BENCHMARKS[name]
+                cap = max_rows or cap
+                result = {'benchmark': name, 'rows': size, 'lengths': length or os.path.basename(sample)}
+                if cap and size > cap:
+                    result['skipped'] = f'above the {cap}-row cap'
+                    results.append(result)
+                    continue
+                workdir = tempfile.mkdtemp(prefix='bench-')
+                run = None
+                try:
+                    run = bench(df, workdir)
+                    timings = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        run()
+                        timings.append(time.perf_counter() - start)
+                except ImportError as exc:
+                    result['skipped'] = f'missing dependency: {exc.name}'
+                    results.append(result)
+                    continue
+                except Exception as exc:
+                    result['failed'] = f'{type(exc).__name__}: {exc}'
+                    results.append(result)
+                    log(f"{result_key(result):45s} FAILED {result['failed']}")
+                    continue
+                finally:
+                    if hasattr(run, 'close'):
+                        run.close()
+                    shutil.rmtree(workdir, ignore_errors=True)
+                median = float(np.median(timings))
+                result.update(median_s=median, min_s=float(min(timings)), repeat=repeat,
+                              rows_per_s=size / median if median else None, peak_rss_mb=peak_rss_mb())
+                results.append(result)
+                log(f"{result_key(result):45s} {median:9.4f}s  {result['rows_per_s']:>12,.0f} rows/s")
+    return results
+
+
+def environment():
+    """Host and library versions recorded next to the results, since timings only compare on the same setup."""
+    versions = {}
+    for module in ('numpy', 'pandas', 'pyarrow', 'sklearn', 'xgboost', 'torch', 'transformers'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return {'host': platform.node(), 'cpu_count': os.cpu_count(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'versions': versions}
+
+
+def startup_benchmark(stages=STAGES, repeat=5, log=print):
+    """Median wall time of ``python -m review_sentiment <stage> --help`` per stage, and the heavy modules
+    that building the command line imports (expected: none)."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('PYTHONPATH')])))
+    probe = ("import sys; from review_sentiment.cli import build_parser; build_parser(); "
+             f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    loaded = subprocess.run([sys.executable, '-c', probe], env=env, capture_output=True, text=True,
+                            check=True).stdout.strip()
+    results = []
+    for stage in stages:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'review_sentiment', stage, '--help'], env=env,
+                           stdout=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        results.append({'stage': stage, 'median_s': float(np.median(times)), 'times_s': times})
+        log(f"{stage:10s} {results[-1]['median_s']:.3f}s")
+    return {'heavy_modules': loaded.split(',') if loaded else [], 'results': results}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Results slower than their ``baseline`` entry by more than ``tolerance``, with the slowdown ratio."""
+    previous = {result_key(r): r for r in baseline['results'] if 'median_s' in r}
+    regressions = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None or 'median_s' not in result:
+            continue
+        ratio = result['median_s'] / before['median_s']
+        if ratio > 1 + tolerance:
+            regressions.append(dict(result, baseline_s=before['median_s'], slowdown=ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=None)
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--lengths', nargs='+', choices=list(LENGTHS), default=['amazon'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-rows', type=int, default=None, help='override the per-benchmark row caps')
+    parser.add_argument('--sample', default=None, help='local review shard(s) to sample rows from instead')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write this run as JSON')
+    parser.add_argument('--baseline', default=None, help='compare against this earlier --output/--save-baseline file')
+    parser.add_argument('--save-baseline', default=None, help='write this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before flagging, 0.2 = 20%%')
+    parser.add_argument('--startup', action='store_true', help='time the command-line startup instead')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_S,
+                        help='seconds a stage may take to start, default %(default)s')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        startup = startup_benchmark(repeat=args.repeat)
+        if args.output:
+            os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+            with open(args.output, 'w') as f:
+                json.dump({'environment': environment(), 'budget_s': args.startup_budget, **startup}, f, indent=2)
+        slow = [r for r in startup['results'] if r['median_s'] > args.startup_budget]
+        if startup['heavy_modules']:
+            print(f"Building the command line imports {', '.join(startup['heavy_modules'])}")
+        for r in slow:
+            print(f"SLOW {r['stage']}: {r['median_s']:.3f}s over the {args.startup_budget}s budget")
+        if slow or startup['heavy_modules']:
+            sys.exit(1)
+        print(f"Every stage starts within {args.startup_budget}s without importing a heavy library")
+        return
+
+    run = {'environment': environment(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat,
+           'seed': args.seed,
+           'results': run_benchmarks(args.benchmarks, args.sizes, args.lengths, args.repeat, args.max_rows,
+                                     args.sample, args.seed)}
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(run, f, indent=2)
+
+    failures = [r for r in run['results'] if 'failed' in r]
+    for r in failures:
+        print(f"FAILED {result_key(r)}: {r['failed']}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['environment']['host'] != run['environment']['host']:
+            print(f"warning: baseline was recorded on {baseline['environment']['host']}, timings may not compare")
+        regressions = compare(run['results'], baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {result_key(r)}: {r['median_s']:.4f}s vs {r['baseline_s']:.4f}s "
+                  f"({r['slowdown']:.2f}x)")
+        if not regressions:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+        if regressions or failures:
+            sys.exit(1)
+    elif failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Cross-validated XGBoost training with shared quantized data, parallel folds and early stopping.
+
+The script fitted one ``XGBClassifier(n_estimators=100)`` on a single split,
+so the round count was a guess and the score depended on the split. Here:
+
+- the histogram cut points are computed once, on a ``QuantileDMatrix`` of
+  the whole training set, and every fold's train/validation matrices are
+  quantized against them once, then shared by every point of the
+  hyperparameter grid (a quantized matrix holds one byte per value, so the
+  k fold copies cost far less than the float frame);
+- the (grid point, fold) fits run concurrently on threads (xgboost releases
+  the GIL), ``parallel_fits`` at a time with ``cores // parallel_fits``
+  threads each, so the whole search stays within ``cores``;
+- every fit stops once the validation AUC has not improved for
+  ``early_stopping_rounds`` rounds, and its best round, AUC and wall time
+  are recorded.
+
+``train_best_xgboost`` then refits the best grid point on all of the
+training data for its mean best round count and returns an ordinary
+``XGBClassifier``, so ``predict_proba`` and ``plot_importance`` work as before.
+Binary labels only.
+"""
+
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_GRID = {'max_depth': [4, 6, 8], 'learning_rate': [0.05, 0.1]}
+
+
+def fold_matrices(X, y, n_splits=5, max_bin=256, seed=42, nthread=None):
+    """``(train, valid)`` ``QuantileDMatrix`` pairs for stratified folds, all sharing one set of cut points."""
+    import xgboost as xgb
+    from sklearn.model_selection import StratifiedKFold
+
+    X, y = pd.DataFrame(X), np.asarray(y)
+    nthread = nthread or os.cpu_count() or 1
+    reference = xgb.QuantileDMatrix(X, y, max_bin=max_bin, nthread=nthread)
+    folds = []
+    for train_index, valid_index in StratifiedKFold(n_splits, shuffle=True, random_state=seed).split(X, y):
+        train = xgb.QuantileDMatrix(X.iloc[train_index], y[train_index], ref=reference, max_bin=max_bin,
+                                    nthread=nthread)
+        valid = xgb.QuantileDMatrix(X.iloc[valid_index], y[valid_index], ref=reference, max_bin=max_bin,
+                                    nthread=nthread)
+        folds.append((train, valid))
+    return folds
+
+
+def parameter_grid(grid):
+    """Every combination of ``grid`` (name -> list of values) as a list of dicts."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))] or [{}]
+
+
+def cross_validate_xgboost(X, y, grid=None, n_splits=5, num_boost_round=1000, early_stopping_rounds=20,
+                           cores=None, parallel_fits=None, max_bin=256, seed=42, log=print):
+    """Run every grid point on every fold and return the per-fold results, a summary and the best point.
+
+    ``grid`` maps xgboost parameter names to candidate values (default
+    ``DEFAULT_GRID``). Returns a dict with ``folds`` (one row per fit: grid
+    point, fold, best iteration, rounds run, validation AUC, seconds),
+    ``summary`` (one row per grid point, best mean AUC first),
+    ``best_params``, ``best_rounds`` and the total ``seconds``.
+    """
+    import xgboost as xgb
+
+    cores = cores or os.cpu_count() or 1
+    points = parameter_grid(DEFAULT_GRID if grid is None else grid)
+    start = time.perf_counter()
+    folds = fold_matrices(X, y, n_splits, max_bin, seed, cores)
+    quantize_seconds = time.perf_counter() - start
+    jobs = [(point, fold) for point in range(len(points)) for fold in range(n_splits)]
+    parallel_fits = parallel_fits or min(len(jobs), cores)
+    nthread = max(1, cores // parallel_fits)
+    log(f"Quantized {len(X)} rows into {n_splits} folds in {quantize_seconds:.1f}s; "
+        f"{len(jobs)} fits, {parallel_fits} at a time with {nthread} threads each")
+
+    def fit(job):
+        point, fold = job
+        train, valid = folds[fold]
+        params = {'objective': 'binary:logistic', 'eval_metric': 'auc', 'tree_method': 'hist', 'max_bin': max_bin,
+                  'nthread': nthread, 'seed': seed, **points[point]}
+        fit_start = time.perf_counter()
+        booster = xgb.train(params, train, num_boost_round, evals=[(valid, 'valid')],
+                            early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+        result = {'point': point, **points[point], 'fold': fold, 'best_iteration': booster.best_iteration,
+                  'rounds': booster.num_boosted_rounds(), 'valid_auc': booster.best_score,
+                  'seconds': time.perf_counter() - fit_start}
+        log(f"  {points[point]} fold {fold}: AUC {result['valid_auc']:.4f} at round {result['best_iteration']} "
+            f"({result['rounds']} rounds, {result['seconds']:.1f}s)")
+        return result
+
+    with ThreadPoolExecutor(parallel_fits) as executor:
+        fold_results = pd.DataFrame(list(executor.map(fit, jobs)))
+    summary = (fold_results.groupby('point')
+               .agg(mean_auc=('valid_auc', 'mean'), std_auc=('valid_auc', 'std'),
+                    mean_best_iteration=('best_iteration', 'mean'), fit_seconds=('seconds', 'sum'))
+               .join(pd.DataFrame(points))
+               .sort_values('mean_auc', ascending=False))
+    best = summary.index[0]
+    return {'folds': fold_results, 'summary': summary, 'best_params': points[best],
+            'best_rounds': int(round(summary.loc[best, 'mean_best_iteration'])) + 1,
+            'quantize_seconds': quantize_seconds, 'seconds': time.perf_counter() - start}
+
+
+def train_best_xgboost(X, y, cv, cores=None, max_bin=256, seed=42):
+    """Fit an ``XGBClassifier`` with ``cv``'s best parameters and round count on all of ``X``."""
+    from xgboost import XGBClassifier
+
+    model = XGBClassifier(n_estimators=cv['best_rounds'], tree_method='hist', max_bin=max_bin,
+                          n_jobs=cores or os.cpu_count() or 1, random_state=seed, eval_metric='auc',
+                          **cv['best_params'])
+    return model.fit(X, y)
@@ -0,0 +1,106 @@
+"""Persistent sentiment score cache keyed by model settings and review text.
+
+Amazon reviews repeat a lot ("Great product!", "Love it") and reruns mostly
+touch texts that were already scored. Scores are stored in SQLite under
+``(model_key, sha1(text))``, where the model key folds in the model name and
+truncation settings, so a changed setting never reuses stale scores.
+"""
+
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+
+def model_key(model_name, max_length=512, truncation='head', backend='torch'):
+    """Cache namespace for one model, truncation setting and inference backend."""
+    key = f"{model_name}|max_length={max_length}|truncation={truncation}"
+    # fp32 torch keys keep their original form so existing caches stay valid.
+    return key if backend == 'torch' else f"{key}|backend={backend}"
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ScoreCache:
+    """SQLite-backed ``(model_key, text hash) -> score`` store with hit-rate counters.
+
+    Safe to share between the scorer threads of one process (see ``scoring.fan_out``).
+    """
+
+    def __init__(self, path='sentiment_cache.sqlite'):
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS scores ('
+            ' model_key TEXT NOT NULL, text_hash TEXT NOT NULL, score REAL NOT NULL,'
+            ' PRIMARY KEY (model_key, text_hash)) WITHOUT ROWID'
+        )
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'rows': 0, 'unique': 0, 'hits': 0, 'misses': 0}
+
+    def hit_rate(self):
+        looked_up = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / looked_up if looked_up else 0.0
+
+    def get_many(self, key, hashes, chunk_size=500):
+        """Scores already stored for ``hashes``, as a ``{hash: score}`` dict."""
+        found = {}
+        for start in range(0, len(hashes), chunk_size):
+            chunk = hashes[start:start + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            with self.lock:
+                rows = self._conn.execute(
+                    f'SELECT text_hash, score FROM scores WHERE model_key = ? AND text_hash IN ({placeholders})',
+                    [key, *chunk],
+                ).fetchall()
+            found.update(rows)
+        return found
+
+    def put_many(self, key, hashes, scores):
+        with self.lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO scores (model_key, text_hash, score) VALUES (?, ?, ?)',
+                [(key, h, float(s)) for h, s in zip(hashes, scores)],
+            )
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def cached_scores(texts, key, cache, score_missing):
+    """Scores for ``texts``, running ``score_missing`` only on distinct uncached texts.
+
+    Duplicate texts are collapsed first, the remaining hashes are looked up
+    in ``cache``, and ``score_missing`` gets the list of texts that still need
+    the model. New scores are written back before the result is expanded to
+    the original row order.
+    """
+    texts = list(texts)
+    hashes = [text_hash(t) for t in texts]
+    unique = list(dict.fromkeys(hashes))
+    found = cache.get_many(key, unique)
+    first_text = dict(zip(hashes, texts))
+    missing = [h for h in unique if h not in found]
+    if missing:
+        new_scores = score_missing([first_text[h] for h in missing])
+        cache.put_many(key, missing, new_scores)
+        found.update(zip(missing, (float(s) for s in new_scores)))
+    with cache.lock:
+        cache.stats['rows'] += len(texts)
+        cache.stats['unique'] += len(unique)
+        cache.stats['hits'] += len(unique) - len(missing)
+        cache.stats['misses'] += len(missing)
+    return np.array([found[h] for h in hashes], dtype=np.float32)
@@ -0,0 +1,123 @@
+"""Checkpointed, resumable scoring jobs.
+
+A long scoring run used to keep every score in memory until the very end, so
+a crash or a reclaimed VM lost all of it. Here the input is cut into fixed
+row ranges (``chunk_rows`` each, independent of where a previous run
+stopped). Every finished range is written to its own file, then recorded in
+a JSON manifest. A restart reads the manifest, skips the ranges it lists and
+scores only the rest, so the assembled result does not depend on where the
+crash happened.
+
+The manifest also stores a description of the job (input fingerprint,
+columns, range size); resuming a different job into the same directory is
+refused instead of silently mixing results.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+
+
+def fingerprint(texts):
+    """sha1 over the 64-bit hashes of ``texts``, identifying the job's input in order."""
+    hashes = pd.util.hash_pandas_object(pd.Series(texts, dtype=object).fillna(''), index=False).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def write_json_atomic(data, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+class Checkpoint:
+    """Manifest of the finished chunks of one job, kept in ``directory``.
+
+    ``job`` is a JSON-serialisable description of the inputs and settings.
+    An existing manifest for another job raises ``ValueError`` unless
+    ``restart`` is set, which discards it.
+    """
+
+    def __init__(self, directory, job, restart=False):
+        self.directory = directory
+        self.job = job
+        self.path = os.path.join(directory, MANIFEST)
+        if restart:
+            self.reset()
+        os.makedirs(directory, exist_ok=True)
+        self.done = set()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest['job'] != job:
+                raise ValueError(f"{directory!r} holds a checkpoint for a different job; "
+                                 f"use another directory or restart=True")
+            self.done = set(manifest['done'])
+
+    def reset(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.done = set()
+
+    def mark_done(self, index):
+        self.done.add(int(index))
+        write_json_atomic({'job': self.job, 'done': sorted(self.done)}, self.path)
+
+    def chunk_path(self, index):
+        return os.path.join(self.directory, f'chunk-{index:05d}.npz')
+
+    def save_chunk(self, index, arrays):
+        """Write ``arrays`` (name -> array) for chunk ``index`` durably, then record it as done."""
+        path = self.chunk_path(index)
+        # np.savez appends .npz to names without it, so the temporary name keeps the suffix.
+        tmp_path = path[:-len('.npz')] + '.tmp.npz'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.mark_done(index)
+
+    def load_chunk(self, index):
+        with np.load(self.chunk_path(index)) as data:
+            return {name: data[name] for name in data.files}
+
+
+def checkpointed_scores(scorers, texts, directory, chunk_rows=10_000, executor=None, progress=None,
+                        restart=False, cleanup=False):
+    """``scoring.fan_out`` over ``texts`` in ``chunk_rows`` ranges, checkpointed to ``directory``.
+
+    Returns column -> float32 scores for every text. Ranges finished by an
+    earlier, interrupted call with the same texts and scorer columns are
+    loaded from disk instead of being scored again. ``cleanup`` removes the
+    checkpoint once the whole job has finished.
+    """
+    from .scoring import fan_out
+
+    texts = list(texts)
+    progress = progress or (lambda it: it)
+    job = {'rows': len(texts), 'chunk_rows': chunk_rows, 'columns': sorted(scorers),
+           'fingerprint': fingerprint(texts)}
+    checkpoint = Checkpoint(directory, job, restart=restart)
+    n_chunks = -(-len(texts) // chunk_rows)
+    results = {column: np.empty(len(texts), dtype=np.float32) for column in scorers}
+    for index in progress(range(n_chunks)):
+        start, stop = index * chunk_rows, min(len(texts), (index + 1) * chunk_rows)
+        if index in checkpoint.done:
+            scores = checkpoint.load_chunk(index)
+        else:
+            scores = fan_out(scorers, texts[start:stop], executor)
+            checkpoint.save_chunk(index, {column: np.asarray(values, dtype=np.float32)
+                                          for column, values in scores.items()})
+        for column in scorers:
+            results[column][start:stop] = scores[column]
+    if cleanup:
+        checkpoint.reset()
+    return results
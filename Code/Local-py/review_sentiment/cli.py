@@ -0,0 +1,328 @@
+"""Command-line entry point running the pipeline one stage at a time.
+
+``main v1.1.py`` runs everything top to bottom: installs, dataset download,
+two transformer models, regressions and plots, so redrawing one chart pays
+for all of it. Here every stage is a subcommand that reads its inputs from
+the results store and writes its outputs back (or next to it):
+
+    python -m review_sentiment ingest --category All_Beauty
+    python -m review_sentiment score --model distilbert roberta vader
+    python -m review_sentiment features
+    python -m review_sentiment classify --model logistic xgboost text
+    python -m review_sentiment panel
+    python -m review_sentiment plot --output-dir figures
+
+Only the standard library is imported until a subcommand runs; each stage
+then imports what it needs (torch and transformers for ``score``, xgboost
+for ``classify --model xgboost``, matplotlib for ``plot``, ...), so an
+analysis-only command starts in a fraction of a second. ``python -m
+review_sentiment.benchmark --startup`` measures that.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+STORE = 'sentiment_analysis_results'
+PANEL_REGRESSORS = ['rating', 'log_review_length', 'helpful_vote', 'verified_purchase', 'has_images',
+                    'year', 'month', 'day', 'weekday', 'rating_review_length']
+
+
+def _progress():
+    from tqdm import tqdm
+
+    return tqdm
+
+
+def _write_json(data, path):
+    if path:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2, default=lambda value: getattr(value, 'tolist', lambda: str(value))())
+        print(f"Wrote {path}")
+
+
+def run_ingest(args):
+    from .ingest import hub_shards, stream_pipeline
+    from .store import ResultsStore
+
+    if not args.shards and not args.category:
+        raise SystemExit("ingest: give shard paths or --category")
+    shards = list(args.shards) + (hub_shards(args.category, args.cache_dir) if args.category else [])
+    rows = stream_pipeline(shards, ResultsStore(args.store), {}, args.batch_rows, progress=_progress(),
+                           resume=args.resume)
+    print(f"Wrote {rows} reviews with their features to {args.store}")
+
+
+def run_score(args):
+    import numpy as np
+
+    from .autotune import TUNING_FILE
+    from .cache import ScoreCache
+    from .incremental import backfill_column
+    from .ingest import build_scorers
+    from .store import ResultsStore
+
+    store = ResultsStore(args.store)
+    cache = ScoreCache(args.cache) if args.cache else None
+    tuning_file = TUNING_FILE if args.tuning_file is None else args.tuning_file
+    # One model at a time here, so each one gets the whole machine.
+    for name in args.model:
+        scorers = build_scorers([name], cache=cache, device=args.device, backend=args.backend, tuning_file=tuning_file)
+        try:
+            for column, scorer in scorers.items():
+                if args.rescore and column in store.columns():
+                    store.add_column(column, np.full(len(store), np.nan, dtype=np.float32))
+                scored = backfill_column(store, column, scorer, args.category, progress=_progress())
+                print(f"{column}: scored {scored} reviews")
+        finally:
+            for scorer in scorers.values():
+                scorer.close()
+    if cache is not None:
+        print(f"Cache hit rate: {cache.hit_rate():.2%}")
+
+
+def _text_batches(store, target):
+    from .features import METADATA_FEATURES
+
+    columns = ['text', *METADATA_FEATURES, target]
+    return lambda: (store.read_part(part, columns) for part in store.parts())
+
+
+def run_features(args):
+    from .store import ResultsStore
+    from .textfeatures import TextFeaturizer, fit_featurizer
+
+    store = ResultsStore(args.store)
+    with TextFeaturizer(n_features=2 ** args.hash_bits, ngram_range=args.ngram_range, tfidf=not args.counts,
+                        processes=args.processes) as featurizer:
+        fit_featurizer(_text_batches(store, args.target), featurizer, args.test_fraction, args.seed, _progress())
+        featurizer.save(args.output)
+    print(f"Document frequencies and metadata moments of {featurizer.n_docs} reviews written to {args.output}")
+
+
+def _classify_text(args, store):
+    from .features import binary_labels
+    from .textfeatures import TextFeaturizer, train_text_classifier
+
+    featurizer = TextFeaturizer.load(args.text_features) if os.path.exists(args.text_features) else TextFeaturizer()
+    with featurizer:
+        _, metrics = train_text_classifier(_text_batches(store, args.target), featurizer,
+                                           label=lambda df: binary_labels(df[args.target]), epochs=args.epochs,
+                                           test_fraction=args.test_fraction, seed=args.seed, progress=_progress())
+    return {'auc': metrics['auc'], 'accuracy': metrics['accuracy'], 'rows': metrics['rows'],
+            'confusion_matrix': metrics['confusion_matrix'], 'epochs': metrics['epochs']}
+
+
+def run_classify(args):
+    from .features import METADATA_FEATURES, add_interaction_features, binary_labels
+    from .store import ResultsStore
+
+    store = ResultsStore(args.store)
+    report = {}
+    tabular = [name for name in args.model if name != 'text']
+    if tabular:
+        from sklearn.metrics import accuracy_score, confusion_matrix, roc_auc_score
+        from sklearn.model_selection import train_test_split
+
+        df = store.read(columns=METADATA_FEATURES + [args.target])
+        X, y = df[METADATA_FEATURES], binary_labels(df[args.target])
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_fraction, random_state=args.seed)
+        for name in tabular:
+            if name == 'logistic':
+                from sklearn.linear_model import LogisticRegression
+                from sklearn.pipeline import make_pipeline
+                from sklearn.preprocessing import StandardScaler
+
+                model = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000)).fit(X_train, y_train)
+                extra = {}
+                proba = model.predict_proba(X_test)[:, 1]
+            else:
+                from .boosting import cross_validate_xgboost, train_best_xgboost
+
+                train, test = (add_interaction_features(frame).drop(columns=['review_length'])
+                               for frame in (X_train, X_test))
+                cv = cross_validate_xgboost(train, y_train, n_splits=args.folds, cores=args.cores)
+                model = train_best_xgboost(train, y_train, cv, cores=args.cores)
+                extra = {'best_params': cv['best_params'], 'best_rounds': cv['best_rounds'],
+                         'cv_seconds': cv['seconds'], 'folds': cv['folds'].to_dict(orient='records')}
+                proba = model.predict_proba(test)[:, 1]
+            predicted = (proba > 0.5).astype(int)
+            report[name] = {'auc': roc_auc_score(y_test, proba), 'accuracy': accuracy_score(y_test, predicted),
+                            'confusion_matrix': confusion_matrix(y_test, predicted), **extra}
+    if 'text' in args.model:
+        report['text'] = _classify_text(args, store)
+    for name, metrics in report.items():
+        print(f"{name}: AUC {metrics['auc']:.4f}, accuracy {metrics['accuracy']:.4f}")
+        print(metrics['confusion_matrix'])
+    _write_json(report, args.output)
+
+
+def run_panel(args):
+    from .panel import PanelMoments, fit_panel_store
+    from .store import ResultsStore
+
+    store = ResultsStore(args.store)
+    if args.refit and os.path.exists(args.moments):
+        fits = PanelMoments.load(args.moments).fit(args.regressors)
+    else:
+        fits = fit_panel_store(store, args.regressors, target=args.target, standardize=not args.raw,
+                               processes=args.processes)
+        fits['moments'].save(args.moments)
+        print(f"Panel moments saved to {args.moments}; --refit solves other specifications from them")
+    print("Fixed Effects Model Results:")
+    print(fits['fixed_effects'])
+    print("Random Effects Model Results:")
+    print(fits['random_effects'])
+    print("GLS Model Results:")
+    print(fits['gls'])
+    print("Hausman test (FE vs RE):", fits['hausman'])
+
+
+def run_plot(args):
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    from .cube import SCORE_COLUMNS, plot_binned_3d, plot_heatmap, plot_histogram, plot_trend, summarize_store
+    from .store import ResultsStore
+
+    store = ResultsStore(args.store)
+    try:
+        summary = summarize_store(store, progress=_progress())
+    except ValueError as error:
+        raise SystemExit(f"plot: {error}; run ingest and score first")
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary['cube'].save(os.path.join(args.output_dir, 'sentiment_cube.parquet'))
+    labels = {'sentiment_score': 'DistilBERT', 'sentiment_score_roberta': 'RoBERTa', 'sentiment_score_vader': 'VADER'}
+    histogram_label = f"{labels.get(summary['histogram_score'], summary['histogram_score'])} Sentiment Score"
+
+    def save(name, title, xlabel, ylabel):
+        plt.title(title)
+        plt.xlabel(xlabel)
+        plt.ylabel(ylabel)
+        path = os.path.join(args.output_dir, f'{name}.png')
+        plt.savefig(path, dpi=120, bbox_inches='tight')
+        plt.close()
+        print(f"Wrote {path}")
+
+    for dimension in ['year', 'month', 'day', 'weekday']:
+        plt.figure(figsize=(10, 6))
+        for score in summary['cube'].scores:
+            plot_trend(summary['cube'], dimension, score, label=labels.get(score, score))
+        plt.legend()
+        save(f'trend_{dimension}', f'{dimension.capitalize()} vs Sentiment Score', dimension.capitalize(), 'Sentiment Score')
+    if 'score' in summary:
+        plt.figure(figsize=(10, 6))
+        plot_histogram(summary['score'])
+        save('score_distribution', f'{histogram_label} Distribution', histogram_label, 'Frequency')
+    if 'length_score' in summary:
+        plt.figure(figsize=(10, 6))
+        plot_heatmap(summary['length_score'], log_x=True)
+        save('length_vs_score', f'Review Length vs {histogram_label}', 'Review Length', histogram_label)
+    if 'year_score_votes' in summary:
+        fig = plt.figure(figsize=(10, 6))
+        ax = fig.add_subplot(111, projection='3d')
+        points = plot_binned_3d(summary['year_score_votes'], ax)
+        ax.set_zlabel('Helpful Vote')
+        plt.colorbar(points, ax=ax, shrink=0.5, aspect=5).set_label('Helpful Vote')
+        save('year_score_votes', f'Year vs {histogram_label} vs Helpful Vote', 'Year', histogram_label)
+
+    scores = [column for column in SCORE_COLUMNS if column in store.columns()]
+    if scores and 'rating' in store.columns():
+        from .evaluation import evaluate_scores, rating_classes, report
+
+        df = store.read(columns=['rating'] + scores)
+        evaluation = evaluate_scores({labels[c]: df[c] for c in scores}, rating_classes(df['rating']))
+        print(report(evaluation))
+        plt.figure(figsize=(10, 6))
+        for name, result in evaluation.items():
+            fpr, tpr, _ = result['roc']
+            plt.plot(fpr, tpr, label=f"{name} (AUC = {result['auc']:.4f})")
+        plt.plot([0, 1], [0, 1], 'k--', lw=2, label='Random Guessing')
+        plt.legend(loc='lower right')
+        save('roc_comparison', 'ROC Curve Comparison', 'False Positive Rate', 'True Positive Rate')
+        for name, result in evaluation.items():
+            best = int(np.argmax(result['band_accuracy']))
+            plt.figure(figsize=(8, 6))
+            plt.imshow(result['band_confusion'][best], cmap='Blues')
+            for (i, j), count in np.ndenumerate(result['band_confusion'][best]):
+                plt.text(j, i, str(count), ha='center', va='center')
+            ticks = ['Negative', 'Neutral', 'Positive']
+            plt.xticks(range(3), ticks)
+            plt.yticks(range(3), ticks)
+            save(f'confusion_{name.lower()}', f"Confusion Matrix - {name} (neutral band ±{result['bands'][best]:.2f})",
+                 'Predicted', 'Actual (rating)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m review_sentiment', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--store', default=STORE, help='results store directory (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help='read reviews, add the features and write the results store')
+    ingest.add_argument('shards', nargs='*', help='Arrow/Parquet/JSONL files, directories or glob patterns')
+    ingest.add_argument('--category', default=None, help='download an Amazon-Reviews-2023 category, e.g. All_Beauty')
+    ingest.add_argument('--cache-dir', default=None, help='Hugging Face datasets cache directory')
+    ingest.add_argument('--batch-rows', type=int, default=50_000)
+    ingest.add_argument('--resume', action='store_true', help='continue an interrupted ingest')
+    ingest.set_defaults(run=run_ingest)
+
+    score = commands.add_parser('score', help='add sentiment score columns to the store')
+    score.add_argument('--model', nargs='+', default=['distilbert'], help='distilbert, roberta and/or vader')
+    score.add_argument('--cache', default='sentiment_cache.sqlite', help="score cache path, '' to disable")
+    score.add_argument('--device', default=None)
+    score.add_argument('--backend', default='torch', help='torch, torch-int8, onnx or onnx-int8')
+    score.add_argument('--tuning-file', default=None, help='settings saved by review_sentiment.autotune')
+    score.add_argument('--category', default=None, help='advance this category\'s incremental watermarks')
+    score.add_argument('--rescore', action='store_true', help='score every review again, not only missing ones')
+    score.set_defaults(run=run_score)
+
+    features = commands.add_parser('features', help='fit the hashed TF-IDF text features over the store')
+    features.add_argument('--output', default='text_features.npz')
+    features.add_argument('--hash-bits', type=int, default=20, help='2**bits hashed n-gram columns')
+    features.add_argument('--ngram-range', nargs=2, type=int, default=[1, 2])
+    features.add_argument('--counts', action='store_true', help='raw counts instead of TF-IDF')
+    features.add_argument('--target', default='sentiment_score')
+    features.add_argument('--test-fraction', type=float, default=0.2)
+    features.add_argument('--seed', type=int, default=0)
+    features.add_argument('--processes', type=int, default=None)
+    features.set_defaults(run=run_features)
+
+    classify = commands.add_parser('classify', help='train and evaluate sentiment classifiers')
+    classify.add_argument('--model', nargs='+', default=['logistic'], choices=['logistic', 'xgboost', 'text'])
+    classify.add_argument('--target', default='sentiment_score', help='score column the binary labels come from')
+    classify.add_argument('--test-fraction', type=float, default=0.2)
+    classify.add_argument('--seed', type=int, default=42)
+    classify.add_argument('--folds', type=int, default=5, help='xgboost cross-validation folds')
+    classify.add_argument('--cores', type=int, default=None, help='core budget for the xgboost folds')
+    classify.add_argument('--epochs', type=int, default=2, help='passes of the text model over the store')
+    classify.add_argument('--text-features', default='text_features.npz', help="fitted by 'features', if present")
+    classify.add_argument('--output', default=None, help='also write the metrics as JSON')
+    classify.set_defaults(run=run_classify)
+
+    panel = commands.add_parser('panel', help='fixed/random effects and Hausman test on the store')
+    panel.add_argument('--regressors', nargs='+', default=PANEL_REGRESSORS)
+    panel.add_argument('--target', default='sentiment_score')
+    panel.add_argument('--raw', action='store_true', help='do not standardize the regressors')
+    panel.add_argument('--moments', default='panel_moments.npz')
+    panel.add_argument('--refit', action='store_true', help='solve --regressors from saved --moments, no data pass')
+    panel.add_argument('--processes', type=int, default=None)
+    panel.set_defaults(run=run_panel)
+
+    plot = commands.add_parser('plot', help='draw the charts from pre-aggregated summaries')
+    plot.add_argument('--output-dir', default='figures')
+    plot.set_defaults(run=run_plot)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""Accuracy-vs-iterations study for the logistic regression in one training run.
+
+Refitting ``LogisticRegression(max_iter=n)`` from scratch for every ``n`` in
+``[10, 50, ..., 5000]`` repeats all the earlier iterations each time. Here a
+single warm-started model is trained up to each checkpoint in turn, only
+running the iterations between the previous checkpoint and the next one, and
+the test metrics are recorded at every stop. The total cost is one fit of the
+largest checkpoint.
+
+lbfgs drops its curvature history when a warm start resumes, so a checkpoint
+is close to, but not bit-identical with, a cold fit of the same ``max_iter``.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+def convergence_study(X_train, y_train, X_test, y_test, checkpoints, **lr_kwargs):
+    """Train once through ``checkpoints`` and return ``(history, final_model)``.
+
+    ``history`` has one row per checkpoint with the iterations run so far and
+    the test accuracy, log-loss and (one-vs-rest for multi-class) AUC.
+    ``lr_kwargs`` go to ``LogisticRegression``, e.g. ``solver='lbfgs'``.
+    """
+    from sklearn.exceptions import ConvergenceWarning
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+
+    model = LogisticRegression(warm_start=True, **lr_kwargs)
+    history = []
+    done = 0
+    iterations_run = 0
+    for checkpoint in sorted(checkpoints):
+        model.max_iter = checkpoint - done
+        if model.max_iter > 0:
+            with warnings.catch_warnings():
+                # Stopping at a checkpoint before convergence is the point of the study.
+                warnings.simplefilter('ignore', ConvergenceWarning)
+                model.fit(X_train, y_train)
+            iterations_run += int(np.max(model.n_iter_))
+        done = checkpoint
+
+        proba = model.predict_proba(X_test)
+        y_pred = model.classes_[proba.argmax(axis=1)]
+        if proba.shape[1] == 2:
+            auc = roc_auc_score(y_test, proba[:, 1])
+        else:
+            auc = roc_auc_score(y_test, proba, multi_class='ovr', labels=model.classes_)
+        history.append({
+            'max_iter': checkpoint,
+            'iterations_run': iterations_run,
+            'accuracy': accuracy_score(y_test, y_pred),
+            'log_loss': log_loss(y_test, proba, labels=model.classes_),
+            'auc': auc,
+        })
+    return pd.DataFrame(history), model
@@ -0,0 +1,215 @@
+"""Pre-aggregated summaries for the visualization stage.
+
+``sns.lineplot`` bootstraps a confidence interval over every review and
+``scatter`` draws one marker per review, which takes minutes (or all of the
+memory) at millions of rows. The charts here are drawn from small summaries
+instead, built in one streaming pass over the results store:
+
+- ``AnalysisCube``: row count, sum and sum of squares of every score column
+  per (year, month, day, weekday) cell, from one groupby per chunk. Any
+  coarser view (per month, per year, ...) is a rollup of the cube, with the
+  mean, variance and a normal-approximation 95% interval derived from the
+  moments;
+- ``BinnedCounts``: row counts on a fixed grid of bins over two or three
+  columns (e.g. review length x score), drawn as a heatmap or as one 3D
+  marker per non-empty bin.
+
+Values outside a histogram's edges are counted in its first or last bin,
+so the fixed edges never drop rows.
+
+    summary = summarize_store(ResultsStore('sentiment_analysis_results'))
+    plot_trend(summary['cube'], 'month', 'sentiment_score_roberta')
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+TIME_DIMENSIONS = ['year', 'month', 'day', 'weekday']
+SCORE_COLUMNS = ['sentiment_score', 'sentiment_score_roberta', 'sentiment_score_vader']
+MOMENTS = ('count', 'sum', 'sumsq')
+
+
+class AnalysisCube:
+    """Count, sum and sum of squares of ``scores`` per combination of ``dimensions``."""
+
+    def __init__(self, dimensions=TIME_DIMENSIONS, scores=SCORE_COLUMNS, cells=None):
+        self.dimensions = list(dimensions)
+        self.scores = list(scores)
+        self.cells = cells
+
+    def add(self, df):
+        """Aggregate ``df``'s rows into the cube; score columns missing from ``df`` are skipped."""
+        scores = [score for score in self.scores if score in df.columns]
+        values = df[scores].astype(np.float64)
+        frame = pd.concat([df[self.dimensions].reset_index(drop=True),
+                           values.notna().astype(np.int64).add_suffix('|count').reset_index(drop=True),
+                           values.fillna(0.0).add_suffix('|sum').reset_index(drop=True),
+                           (values ** 2).fillna(0.0).add_suffix('|sumsq').reset_index(drop=True)], axis=1)
+        chunk = frame.groupby(self.dimensions, sort=False).sum()
+        self.cells = chunk if self.cells is None else self.cells.add(chunk, fill_value=0)
+        return self
+
+    def merge(self, other):
+        """Add the cells of ``other`` (e.g. a cube built from another shard) to this cube."""
+        if other.dimensions != self.dimensions:
+            raise ValueError("can only merge cubes over the same dimensions")
+        self.scores += [score for score in other.scores if score not in self.scores]
+        if other.cells is not None:
+            self.cells = other.cells.copy() if self.cells is None else self.cells.add(other.cells, fill_value=0)
+        return self
+
+    def rollup(self, dimensions, score):
+        """Count, mean, variance, standard error and 95% interval of ``score`` per value of ``dimensions``."""
+        if self.cells is None:
+            raise ValueError("the cube is empty; add rows before rolling it up")
+        if isinstance(dimensions, str):
+            dimensions = [dimensions]
+        columns = [f'{score}|{moment}' for moment in MOMENTS]
+        grouped = self.cells[columns].groupby(level=dimensions).sum()
+        grouped.columns = list(MOMENTS)
+        count = grouped['count']
+        mean = grouped['sum'] / count
+        # Sums of squares about zero lose precision only when |mean| >> std, which scores in [-1, 1] never reach.
+        var = ((grouped['sumsq'] - count * mean ** 2) / (count - 1)).clip(lower=0)
+        sem = np.sqrt(var / count)
+        return pd.DataFrame({'count': count.astype(np.int64), 'mean': mean, 'var': var, 'sem': sem,
+                             'ci_low': mean - 1.96 * sem, 'ci_high': mean + 1.96 * sem}).sort_index()
+
+    def save(self, path):
+        self.cells.reset_index().to_parquet(path, index=False)
+
+    @classmethod
+    def load(cls, path, dimensions=TIME_DIMENSIONS):
+        cells = pd.read_parquet(path).set_index(list(dimensions))
+        scores = list(dict.fromkeys(column.split('|')[0] for column in cells.columns))
+        return cls(dimensions, scores, cells)
+
+
+def linear_edges(low, high, bins):
+    return np.linspace(low, high, bins + 1)
+
+
+def log_edges(high, bins):
+    """Edges ``0, 1, ..., high`` spaced evenly in log(1 + x), for heavy-tailed counts such as votes or lengths."""
+    return np.unique(np.round(np.expm1(np.linspace(0, np.log1p(high), bins + 1))))
+
+
+def integer_edges(low, high):
+    """One bin per integer value from ``low`` to ``high``."""
+    return np.arange(low, high + 2) - 0.5
+
+
+class BinnedCounts:
+    """Row counts on fixed bins over ``edges`` (column -> bin edges), accumulated chunk by chunk."""
+
+    def __init__(self, edges):
+        self.columns = list(edges)
+        self.edges = [np.asarray(edge, dtype=np.float64) for edge in edges.values()]
+        self.counts = np.zeros([len(edge) - 1 for edge in self.edges], dtype=np.int64)
+
+    def add(self, df):
+        values = df[self.columns].to_numpy(dtype=np.float64)
+        values = values[~np.isnan(values).any(axis=1)]
+        # Clip into the outer bins instead of letting histogramdd drop the tails.
+        lows = np.array([edge[0] for edge in self.edges])
+        highs = np.array([np.nextafter(edge[-1], edge[0]) for edge in self.edges])
+        counts, _ = np.histogramdd(np.clip(values, lows, highs), bins=self.edges)
+        self.counts += counts.astype(np.int64)
+        return self
+
+    def centers(self):
+        return [(edge[:-1] + edge[1:]) / 2 for edge in self.edges]
+
+    def cells(self):
+        """Non-empty bins as a frame of bin centers and ``count``."""
+        index = np.nonzero(self.counts)
+        frame = {column: centers[i] for column, centers, i in zip(self.columns, self.centers(), index)}
+        frame['count'] = self.counts[index]
+        return pd.DataFrame(frame)
+
+
+def summarize_store(store, scores=None, histograms=None, progress=None):
+    """``AnalysisCube`` plus ``BinnedCounts`` for the standard charts, in one pass over ``store``'s parts.
+
+    ``histograms`` maps a name to bin edges (column -> edges); the default
+    covers the score distribution, review length x score and year x score
+    x helpful votes for the RoBERTa score, or the first of ``scores`` the
+    store has when it has no RoBERTa column. Returns a dict with ``cube``,
+    one ``BinnedCounts`` per histogram name and the ``histogram_score``
+    the default histograms use.
+    """
+    if not store.parts():
+        raise ValueError(f"results store {store.root!r} is empty")
+    progress = progress or (lambda it: it)
+    available = store.columns()
+    scores = [score for score in (scores or SCORE_COLUMNS) if score in available]
+    if not scores:
+        raise ValueError(f"results store {store.root!r} has none of the score columns {SCORE_COLUMNS}")
+    score = 'sentiment_score_roberta' if 'sentiment_score_roberta' in scores else scores[0]
+    if histograms is None:
+        years = store.read(columns=['year'])['year']
+        year_edges = integer_edges(int(years.min()), int(years.max())) if len(years) else integer_edges(0, 0)
+        histograms = {
+            'score': {score: linear_edges(-1, 1, 50)},
+            'length_score': {'review_length': log_edges(20_000, 60), score: linear_edges(-1, 1, 40)},
+            'year_score_votes': {'year': year_edges, score: linear_edges(-1, 1, 20),
+                                 'helpful_vote': log_edges(1_000, 12)},
+        }
+        missing = {name for name, edges in histograms.items() if not all(c in available for c in edges)}
+        if missing:
+            warnings.warn(f"skipping the {sorted(missing)} histograms: {store.root!r} lacks their columns")
+        histograms = {name: edges for name, edges in histograms.items() if name not in missing}
+    binned = {name: BinnedCounts(edges) for name, edges in histograms.items()}
+    columns = list(dict.fromkeys(TIME_DIMENSIONS + scores + [c for h in binned.values() for c in h.columns]))
+    cube = AnalysisCube(TIME_DIMENSIONS, scores)
+    for part in progress(store.parts()):
+        df = store.read_part(part, columns)
+        cube.add(df)
+        for counts in binned.values():
+            counts.add(df)
+    return {'cube': cube, 'histogram_score': score, **binned}
+
+
+def plot_trend(cube, dimension, score, ax=None, label=None):
+    """Mean of ``score`` per value of ``dimension`` with its 95% interval, like ``sns.lineplot``."""
+    import matplotlib.pyplot as plt
+
+    ax = ax or plt.gca()
+    trend = cube.rollup(dimension, score)
+    ax.plot(trend.index, trend['mean'], marker='o', label=label)
+    ax.fill_between(trend.index, trend['ci_low'], trend['ci_high'], alpha=0.2)
+    return ax
+
+
+def plot_histogram(counts, ax=None):
+    """Bar chart of a one-column ``BinnedCounts``."""
+    import matplotlib.pyplot as plt
+
+    ax = ax or plt.gca()
+    ax.stairs(counts.counts, counts.edges[0], fill=True, alpha=0.7)
+    return ax
+
+
+def plot_heatmap(counts, ax=None, log_x=False):
+    """Two-column ``BinnedCounts`` as a heatmap with a log colour scale, in place of a scatter plot."""
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    ax = ax or plt.gca()
+    x_edges, y_edges = counts.edges
+    if log_x:
+        x_edges = np.maximum(x_edges, 0.5)
+        ax.set_xscale('log')
+    mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.counts.T, 0), norm=LogNorm(), cmap='viridis')
+    plt.colorbar(mesh, ax=ax, label='Reviews')
+    return ax
+
+
+def plot_binned_3d(counts, ax, color_by=2):
+    """Three-column ``BinnedCounts`` as one marker per non-empty bin, sized by its row count."""
+    cells = counts.cells()
+    x, y, z = (cells[column] for column in counts.columns)
+    sizes = 10 + 190 * np.log1p(cells['count']) / np.log1p(cells['count'].max())
+    return ax.scatter(x, y, z, s=sizes, c=cells[counts.columns[color_by]], cmap='viridis', alpha=0.7)
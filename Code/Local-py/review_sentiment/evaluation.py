@@ -0,0 +1,173 @@
+"""Evaluation of every scorer at once: ROC, neutral-band threshold sweeps and bootstrap intervals.
+
+The script evaluated each model with its own ``roc_auc_score`` /
+``roc_curve`` / ``confusion_matrix`` calls, with the label cut-offs fixed at
+±0.35 and 0. ``evaluate_scores`` takes the score columns of all the models
+and the reference labels and, from one sort per column, computes:
+
+- the full ROC curve and its AUC;
+- the three-class confusion matrix for every neutral-band threshold ``t``
+  in a grid (negative below ``-t``, positive above ``t``), read off
+  cumulative class counts with ``searchsorted`` instead of relabelling the
+  data once per threshold;
+- bootstrap confidence intervals for the AUC and the accuracy at 0, for
+  all replicates at once. The replicates use Poisson(1) row weights (the
+  usual large-sample stand-in for resampling with replacement), so a
+  replicate is a weighted sum over the already sorted scores and never
+  re-sorts.
+
+The binary metrics (ROC, AUC, accuracy at 0) compare positive with
+negative reference labels and leave the neutral ones out; the band sweep
+uses all three classes. ``report`` turns the result into one small frame.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .features import NEGATIVE, NEUTRAL, POSITIVE
+
+BANDS = np.round(np.arange(0.0, 0.95, 0.05), 2)
+
+
+def rating_classes(ratings):
+    """Reference labels from star ratings: 1-2 stars negative, 3 neutral, 4-5 positive."""
+    ratings = np.asarray(ratings, dtype=np.float64)
+    return np.select([ratings >= 4, ratings <= 2], [POSITIVE, NEGATIVE], NEUTRAL).astype(np.int8)
+
+
+def _tie_groups(sorted_scores):
+    """Start index of every run of equal values in ``sorted_scores``."""
+    return np.flatnonzero(np.r_[True, sorted_scores[1:] != sorted_scores[:-1]])
+
+
+def roc_curve_sorted(sorted_scores, positive, starts):
+    """``(fpr, tpr, thresholds, auc)`` for scores sorted ascending with boolean ``positive`` labels.
+
+    Matches ``sklearn.metrics.roc_curve`` (without intermediate point
+    dropping) and ``roc_auc_score``, ties included. Without both positive
+    and negative rows the curve is empty and the AUC is NaN.
+    """
+    if positive.all() or not positive.any():
+        empty = np.array([], dtype=np.float64)
+        return empty, empty, empty, float('nan')
+    pos = np.add.reduceat(positive.astype(np.int64), starts)[::-1]
+    neg = np.add.reduceat((~positive).astype(np.int64), starts)[::-1]
+    tpr = np.r_[0, np.cumsum(pos)] / max(pos.sum(), 1)
+    fpr = np.r_[0, np.cumsum(neg)] / max(neg.sum(), 1)
+    thresholds = np.r_[np.inf, sorted_scores[starts][::-1]]
+    return fpr, tpr, thresholds, float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1])) / 2)
+
+
+def bootstrap_auc_accuracy(sorted_scores, positive, starts, n_bootstrap=200, seed=0, block_elements=20_000_000):
+    """Poisson-bootstrap replicates of the AUC and of the accuracy at 0, as two arrays of ``n_bootstrap``.
+
+    Replicates are drawn in blocks so that at most ``block_elements``
+    weights are held at once. A replicate without positive or negative
+    weight has a NaN AUC; with no rows at all every replicate is NaN.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(sorted_scores)
+    if n == 0:
+        return np.full(n_bootstrap, np.nan), np.full(n_bootstrap, np.nan)
+    correct = (sorted_scores > 0) == positive
+    block = max(1, min(n_bootstrap, block_elements // max(n, 1)))
+    aucs, accuracies = [], []
+    for start in range(0, n_bootstrap, block):
+        weights = rng.poisson(1.0, size=(min(block, n_bootstrap - start), n)).astype(np.float32)
+        pos = np.add.reduceat(weights * positive, starts, axis=1)
+        neg = np.add.reduceat(weights * ~positive, starts, axis=1)
+        # Each positive beats the negatives in lower tie groups and draws half of those in its own.
+        below = np.cumsum(neg, axis=1) - neg
+        wins = (pos * (below + 0.5 * neg)).sum(axis=1, dtype=np.float64)
+        pairs = pos.sum(axis=1, dtype=np.float64) * neg.sum(axis=1, dtype=np.float64)
+        total = weights.sum(axis=1, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aucs.append(np.where(pairs > 0, wins / pairs, np.nan))
+            accuracies.append(np.where(total > 0, (weights * correct).sum(axis=1, dtype=np.float64) / total, np.nan))
+    return np.concatenate(aucs), np.concatenate(accuracies)
+
+
+def band_confusion(sorted_scores, sorted_truth, bands=BANDS):
+    """Three-class confusion matrices, shape ``(len(bands), 3, 3)`` (actual x predicted), one per band."""
+    classes = (NEGATIVE, NEUTRAL, POSITIVE)
+    # cumulative[c][i]: rows of actual class c among the i lowest scores.
+    cumulative = np.stack([np.r_[0, np.cumsum(sorted_truth == c)] for c in classes])
+    low = np.searchsorted(sorted_scores, -np.asarray(bands), side='left')    # predicted negative: score < -t
+    high = np.searchsorted(sorted_scores, np.asarray(bands), side='right')  # predicted positive: score > t
+    negative = cumulative[:, low]
+    positive = cumulative[:, -1:] - cumulative[:, high]
+    neutral = cumulative[:, -1:] - negative - positive
+    # (class, band) x predicted -> band x actual x predicted, in NEGATIVE, NEUTRAL, POSITIVE order.
+    return np.stack([negative, neutral, positive], axis=-1).transpose(1, 0, 2)
+
+
+def _interval(replicates, alpha):
+    """Percentile interval of the bootstrap ``replicates``, ignoring NaN ones; ``(nan, nan)`` if all are NaN."""
+    replicates = replicates[~np.isnan(replicates)]
+    if not len(replicates):
+        return float('nan'), float('nan')
+    return tuple(np.quantile(replicates, [alpha, 1 - alpha]))
+
+
+def evaluate_scores(scores, truth, bands=BANDS, n_bootstrap=200, confidence=0.95, seed=0):
+    """Evaluate every score column in ``scores`` (name -> array) against three-class ``truth``.
+
+    Returns name -> dict with ``rows``, ``binary_rows``, ``auc``,
+    ``auc_ci``, ``accuracy`` (binary, at 0), ``accuracy_ci``, ``roc``
+    (fpr, tpr, thresholds), ``bands``, ``band_confusion`` and the
+    three-class ``band_accuracy``. Rows with a missing score are skipped
+    for that model only. Metrics with no rows to compare (e.g. only 3-star
+    reference labels, or no score at all) are NaN and the ROC curve is empty.
+    """
+    truth = np.asarray(truth)
+    alpha = (1 - confidence) / 2
+    evaluation = {}
+    for name, values in scores.items():
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        order = np.argsort(values[valid], kind='stable')
+        sorted_scores, sorted_truth = values[valid][order], truth[valid][order]
+        confusion = band_confusion(sorted_scores, sorted_truth, bands)
+
+        binary = sorted_truth != NEUTRAL
+        binary_scores, positive = sorted_scores[binary], sorted_truth[binary] == POSITIVE
+        starts = _tie_groups(binary_scores)
+        fpr, tpr, thresholds, auc = roc_curve_sorted(binary_scores, positive, starts)
+        boot_auc, boot_accuracy = bootstrap_auc_accuracy(binary_scores, positive, starts, n_bootstrap, seed)
+        evaluation[name] = {
+            'rows': int(valid.sum()),
+            'binary_rows': int(binary.sum()),
+            'auc': auc,
+            'auc_ci': _interval(boot_auc, alpha),
+            'accuracy': float(np.mean((binary_scores > 0) == positive)) if len(positive) else float('nan'),
+            'accuracy_ci': _interval(boot_accuracy, alpha),
+            'roc': (fpr, tpr, thresholds),
+            'bands': np.asarray(bands),
+            'band_confusion': confusion,
+            'band_accuracy': (np.trace(confusion, axis1=1, axis2=2) / len(sorted_scores) if len(sorted_scores)
+                              else np.full(len(confusion), np.nan)),
+        }
+    return evaluation
+
+
+def report(evaluation):
+    """One row per model: AUC and accuracy with their intervals, and the best neutral band."""
+    rows = []
+    for name, result in evaluation.items():
+        best = int(np.argmax(result['band_accuracy']))
+        rows.append({'model': name, 'rows': result['rows'], 'auc': result['auc'],
+                     'auc_low': result['auc_ci'][0], 'auc_high': result['auc_ci'][1],
+                     'accuracy': result['accuracy'],
+                     'accuracy_low': result['accuracy_ci'][0], 'accuracy_high': result['accuracy_ci'][1],
+                     'best_band': result['bands'][best], 'band_accuracy': result['band_accuracy'][best]})
+    return pd.DataFrame(rows).set_index('model')
+
+
+def band_table(evaluation):
+    """Three-class accuracy and predicted-neutral share per model and band, one column per model."""
+    return pd.DataFrame({
+        (name, metric): values
+        for name, result in evaluation.items()
+        for metric, values in [('accuracy', result['band_accuracy']),
+                               ('neutral_share', result['band_confusion'][:, :, 1].sum(axis=1) / max(result['rows'], 1))]
+    }, index=pd.Index(next(iter(evaluation.values()))['bands'], name='band'))
@@ -0,0 +1,61 @@
+"""Review-level feature engineering shared by the batch and streaming pipelines.
+
+Every column is built with vectorized pandas/numpy operations (no per-row
+``.apply``) and stored in the smallest dtype that holds it, which keeps the
+feature frame a fraction of the size of the default int64/float64 one.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Columns the regressions use, in the order the original script listed them.
+METADATA_FEATURES = ['rating', 'review_length', 'helpful_vote', 'verified_purchase', 'has_images',
+                     'year', 'month', 'day', 'weekday']
+
+NEGATIVE, NEUTRAL, POSITIVE = 0, 1, 2
+
+
+def add_review_features(df):
+    """Add ``review_length``, ``has_images`` and the date features to ``df`` and return ``df``.
+
+    ``df`` itself is modified: the new columns are added to it and
+    ``helpful_vote``, ``verified_purchase``, ``rating`` and ``timestamp`` are
+    converted in place. Pass a copy to keep the original frame unchanged.
+    ``images`` may hold Python lists (Hugging Face rows) or numpy arrays
+    (Arrow/Parquet batches); ``str.len`` gives the length of either.
+    """
+    df['review_length'] = df['text'].str.len().fillna(0).astype(np.int32)
+    df['helpful_vote'] = df['helpful_vote'].fillna(0).astype(np.int32)
+    df['verified_purchase'] = df['verified_purchase'].fillna(False).astype(bool).astype(np.int8)
+    df['has_images'] = (df['images'].str.len().fillna(0) > 0).astype(np.int8)
+    if 'rating' in df.columns:
+        df['rating'] = df['rating'].astype(np.float32)
+    timestamp = df['timestamp']
+    if not pd.api.types.is_datetime64_any_dtype(timestamp):
+        timestamp = pd.to_datetime(timestamp, unit='ms')
+    df['timestamp'] = timestamp
+    df['year'] = timestamp.dt.year.astype(np.int16)
+    df['month'] = timestamp.dt.month.astype(np.int8)
+    df['day'] = timestamp.dt.day.astype(np.int8)
+    df['weekday'] = timestamp.dt.weekday.astype(np.int8)
+    return df
+
+
+def add_interaction_features(df):
+    """Return ``df`` with ``log_review_length`` and ``rating_review_length`` added (float32)."""
+    review_length = df['review_length'].to_numpy(dtype=np.float32)
+    return df.assign(
+        log_review_length=np.log1p(review_length),
+        rating_review_length=df['rating'].to_numpy(dtype=np.float32) * review_length,
+    )
+
+
+def sentiment_labels(scores, threshold=0.35):
+    """Three-class labels: 2 above ``threshold``, 0 below ``-threshold``, 1 (neutral) in between."""
+    scores = np.asarray(scores)
+    return np.select([scores > threshold, scores < -threshold], [POSITIVE, NEGATIVE], NEUTRAL).astype(np.int8)
+
+
+def binary_labels(scores, threshold=0.0):
+    """1 for scores above ``threshold``, else 0."""
+    return (np.asarray(scores) > threshold).astype(np.int8)
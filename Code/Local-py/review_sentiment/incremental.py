@@ -0,0 +1,235 @@
+"""Incremental re-scoring: only reviews that are new or edited since the last run reach the models.
+
+The Amazon review splits only grow, yet every run used to score all of them
+again. A review is identified by ``(user_id, parent_asin, timestamp)`` and its
+content by a hash of its text. A run keeps the source rows whose
+``(key, text)`` is not in the results store yet, scores them and appends them
+as new parts; stored rows whose key shows up again with a different text
+(edited reviews) are dropped from their parts first. Everything downstream
+reads the merged store as before.
+
+Per ``(category, model column)`` watermarks in ``<store>/watermarks.json``
+record the newest ``timestamp`` scored so far. Source rows past the
+watermark of every requested model are new by definition and skip the key
+lookup; only older rows are checked against the stored keys. A watermark is
+saved before the part it covers is appended: one that runs ahead of the
+store only costs extra key lookups after a crash, while one that lagged
+behind would let the rerun append the same rows again.
+
+A score column that exists in the store but has no scorer in a run is left
+as NaN for the rows that run adds. Those rows are already stored, so the key
+lookup alone would never score them again: every run first backfills the
+NaN rows (or the whole column, for a model new to the store) of each model
+it does have, part by part (see ``backfill_column``).
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import profiling
+from .features import add_review_features
+
+KEY_COLUMNS = ['user_id', 'parent_asin', 'timestamp']
+WATERMARK_FILE = 'watermarks.json'
+
+
+def timestamp_ms(values):
+    """Epoch milliseconds as int64, from raw millisecond values or datetimes."""
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    return values.to_numpy(dtype=np.int64)
+
+
+def text_hashes(texts):
+    """64-bit content hash of every text."""
+    return pd.util.hash_pandas_object(pd.Series(texts, dtype=object).fillna(''), index=False).to_numpy()
+
+
+def row_ids(df, hashes=None):
+    """``(key id, row id)`` hashes of ``df``: the review key, and the key together with the text hash."""
+    keys = pd.DataFrame({'user_id': df['user_id'].to_numpy(), 'parent_asin': df['parent_asin'].to_numpy(),
+                         'timestamp': timestamp_ms(df['timestamp'])})
+    key_id = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    hashes = df['text_hash'].to_numpy(dtype=np.uint64) if hashes is None else hashes
+    row_id = pd.util.hash_pandas_object(pd.DataFrame({'key': key_id, 'text': hashes}), index=False).to_numpy()
+    return key_id, row_id
+
+
+def load_watermarks(root):
+    path = os.path.join(root, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_watermarks(root, watermarks):
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _advance(watermarks, category, column, newest, rows):
+    entry = watermarks.setdefault(category, {}).setdefault(column, {'timestamp': None, 'rows': 0})
+    if newest is not None and (entry['timestamp'] is None or newest > entry['timestamp']):
+        entry['timestamp'] = int(newest)
+    entry['rows'] += int(rows)
+
+
+def mark_scored(store, category, columns, timestamps):
+    """Advance the watermarks of ``columns`` over ``timestamps`` after a full, non-incremental write of ``store``."""
+    watermarks = load_watermarks(store.root)
+    ts = timestamp_ms(timestamps)
+    for column in columns:
+        _advance(watermarks, category, column, ts.max() if len(ts) else None, len(ts))
+    save_watermarks(store.root, watermarks)
+
+
+def ensure_text_hash(store):
+    """Add the ``text_hash`` column to a store written before incremental runs existed."""
+    if 'text_hash' in store.columns():
+        return
+    for part in store.parts():
+        store.add_column_part('text_hash', part, text_hashes(store.read_part(part, ['text'])['text']))
+
+
+def stored_rows(store):
+    """``key_id``, ``row_id`` and ``part`` of every stored review, read from the key columns only."""
+    frames = []
+    for part in store.parts():
+        chunk = store.read_part(part, KEY_COLUMNS + ['text_hash'])
+        key_id, row_id = row_ids(chunk)
+        frames.append(pd.DataFrame({'key_id': key_id, 'row_id': row_id, 'part': part}))
+    if not frames:
+        return pd.DataFrame({'key_id': np.array([], np.uint64), 'row_id': np.array([], np.uint64), 'part': []})
+    return pd.concat(frames, ignore_index=True)
+
+
+def _drop_superseded(store, stored, superseded):
+    """Remove the stored rows with ``row_id`` in ``superseded`` and return the updated ``stored`` frame."""
+    hit = stored['row_id'].isin(superseded)
+    for part in stored.loc[hit, 'part'].unique():
+        _, row_id = row_ids(store.read_part(part, KEY_COLUMNS + ['text_hash']))
+        store.filter_part(part, ~np.isin(row_id, superseded))
+    return stored[~hit]
+
+
+def incremental_update(batches, store, scorers, category, progress=None):
+    """Score the unseen or edited reviews in ``batches`` and merge them into ``store``.
+
+    ``batches`` is an iterable of raw review DataFrames (e.g. from
+    ``ingest.iter_record_batches``), ``scorers`` maps a score column to a
+    callable taking a list of texts (all of them score each chunk at once) and ``category`` names the watermark
+    namespace, e.g. ``'All_Beauty'``. Returns a dict with the number of
+    source rows ``seen``, ``new`` and ``changed`` reviews, and ``skipped``
+    rows that were already scored.
+    """
+    from .scoring import MODELS, VADER_COLUMN, fan_out
+
+    progress = progress or (lambda it: it)
+    ensure_text_hash(store)
+    if store.parts():
+        for column, scorer in scorers.items():
+            # Catch up on the stored reviews this model has not scored: all of them for a model new to the
+            # store, or the rows an earlier run without it appended as NaN.
+            backfill_column(store, column, scorer, category)
+    watermarks = load_watermarks(store.root)
+    stored = stored_rows(store)
+    marks = [watermarks.get(category, {}).get(column, {}).get('timestamp') for column in scorers]
+    # Past this point every source row is new for all requested models; with no watermark every row is checked.
+    watermark = min(marks) if marks and None not in marks else None
+    unscored = [c for c in [column for _, column in MODELS.values()] + [VADER_COLUMN]
+                if c in store.columns() and c not in scorers]
+
+    stats = {'seen': 0, 'new': 0, 'changed': 0, 'skipped': 0}
+    with ThreadPoolExecutor(len(scorers) or 1, thread_name_prefix='scorer') as executor:
+        for chunk in progress(profiling.iterate('read', batches)):
+            chunk = chunk.reset_index(drop=True)
+            stats['seen'] += len(chunk)
+            if chunk.empty:
+                continue
+            hashes = text_hashes(chunk['text'])
+            key_id, row_id = row_ids(chunk, hashes)
+            ts = timestamp_ms(chunk['timestamp'])
+
+            old = np.ones(len(chunk), dtype=bool) if watermark is None else ts <= watermark
+            fresh = ~old
+            fresh[old] = ~np.isin(row_id[old], stored['row_id'].to_numpy())
+            if not fresh.any():
+                stats['skipped'] += len(chunk)
+                continue
+
+            # Stored versions of keys that arrive with a different text are replaced by the new version.
+            candidates = stored[stored['key_id'].isin(key_id[fresh])]
+            superseded = candidates.loc[~candidates['row_id'].isin(row_id), 'row_id'].to_numpy()
+            replaced_keys = candidates.loc[candidates['row_id'].isin(superseded), 'key_id'].to_numpy()
+            if len(superseded):
+                stored = _drop_superseded(store, stored, superseded)
+
+            with profiling.stage('features', rows=int(fresh.sum())):
+                rows = add_review_features(chunk[fresh].reset_index(drop=True))
+                rows['text_hash'] = hashes[fresh]
+            with profiling.stage('score', rows=len(rows)):
+                rows = rows.assign(**fan_out(scorers, rows['text'], executor))
+            for column in unscored:
+                rows[column] = np.nan
+            for column in scorers:
+                _advance(watermarks, category, column, ts.max(), 0)
+            save_watermarks(store.root, watermarks)
+            with profiling.stage('write', rows=len(rows)):
+                part = store.append(rows)
+            for column in scorers:
+                _advance(watermarks, category, column, None, len(rows))
+            save_watermarks(store.root, watermarks)
+
+            changed = int(np.isin(key_id[fresh], replaced_keys).sum())
+            stats['changed'] += changed
+            stats['new'] += int(fresh.sum()) - changed
+            stats['skipped'] += int((~fresh).sum())
+            stored = pd.concat([stored, pd.DataFrame({'key_id': key_id[fresh], 'row_id': row_id[fresh], 'part': part})],
+                               ignore_index=True)
+    return stats
+
+
+def backfill_column(store, column, scorer, category=None, progress=None):
+    """Score the rows of ``store`` that have no ``column`` value yet, one part at a time.
+
+    Covers a model added after the store was built (the column does not
+    exist) and rows an incremental run appended without that model (NaN).
+    Returns the number of rows scored.
+    """
+    progress = progress or (lambda it: it)
+    exists = column in store.columns()
+    scored = 0
+    newest = None
+    new_values = []
+    for part in progress(store.parts()):
+        chunk = store.read_part(part, ['timestamp'] + ([column] if exists else []))
+        if len(chunk):
+            part_newest = timestamp_ms(chunk['timestamp']).max()
+            newest = part_newest if newest is None else max(newest, part_newest)
+        values = chunk[column].to_numpy(dtype=np.float32, copy=True) if exists else np.full(len(chunk), np.nan, np.float32)
+        missing = np.isnan(values)
+        if missing.any():
+            # The text is only read for parts that have something to score.
+            texts = store.read_part(part, ['text'])['text']
+            values[missing] = scorer(texts[missing].tolist())
+            scored += int(missing.sum())
+            if exists:
+                store.add_column_part(column, part, values)
+        new_values.append(values)
+    if not exists and new_values:
+        # A brand-new column is written in one go so a crash never leaves it on only some parts.
+        store.add_column(column, np.concatenate(new_values))
+    if category is not None:
+        watermarks = load_watermarks(store.root)
+        _advance(watermarks, category, column, newest, scored)
+        save_watermarks(store.root, watermarks)
+    return scored
@@ -0,0 +1,166 @@
+"""Model loading and a multi-process CPU inference pool.
+
+On CPU-only hosts a thread pool over one shared model spends its time fighting
+over the GIL during tokenization. ``CPUInferencePool`` instead starts a few
+worker processes, each with its own copy of the model and its own torch
+intra-op thread count, and keeps only a bounded number of batches in flight.
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+from . import profiling
+
+
+def select_device(preferred=None):
+    """Return ``preferred`` if given, else ``'cuda'`` when available, else ``'cpu'``."""
+    import torch
+
+    if preferred:
+        return preferred
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def load_model(model_name, device=None):
+    """Load a tokenizer and sequence classification model in eval mode on ``device``."""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    device = select_device(device)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).to(device)
+    model.eval()
+    return tokenizer, model
+
+
+def sentiment_scores(model, tokenizer, texts, device='cpu', max_length=512):
+    """Positive minus negative softmax probability for each text."""
+    inputs = tokenizer(texts, padding=True, truncation=True, max_length=max_length, return_tensors="pt")
+    return encoded_scores(model, inputs['input_ids'], inputs['attention_mask'], device)
+
+
+def encoded_scores(model, input_ids, attention_mask, device='cpu'):
+    """Same as ``sentiment_scores`` for already tokenized, padded id and mask arrays."""
+    import torch
+
+    input_ids = torch.as_tensor(input_ids).to(device)
+    attention_mask = torch.as_tensor(attention_mask).to(device)
+    rows, tokens = len(input_ids), int(attention_mask.sum())
+    with profiling.torch_trace('forward'):
+        with profiling.stage('forward', rows, tokens), torch.no_grad():
+            logits = model(input_ids=input_ids, attention_mask=attention_mask).logits
+            if profiling.current() is not None and str(device).startswith('cuda'):
+                # Otherwise the queued GPU work would be billed to the .cpu() copy below.
+                torch.cuda.synchronize()
+        with profiling.stage('postprocess', rows):
+            scores = torch.nn.functional.softmax(logits, dim=-1)
+            sentiments = scores[:, 1] - scores[:, 0]  # POSITIVE score - NEGATIVE score
+            return sentiments.cpu().numpy()
+
+
+# Per-process state, filled in once by _init_worker when a worker starts.
+_worker = {}
+
+
+def _init_worker(model_name, intra_op_threads, max_length, backend, onnx_dir, trace_dir=None, trace_batches=0):
+    import torch
+    from transformers import AutoTokenizer
+    from .backends import load_backend
+
+    torch.set_num_threads(intra_op_threads)
+    if trace_dir:
+        # The parent's profiler asked for torch.profiler traces; this process writes its own.
+        profiling.Profiler(f'worker-{os.getpid()}', torch_trace_dir=trace_dir,
+                           torch_trace_batches=trace_batches).start()
+    _worker.update(
+        tokenizer=AutoTokenizer.from_pretrained(model_name),
+        backend=load_backend(model_name, backend, 'cpu', onnx_dir, intra_op_threads),
+        max_length=max_length,
+    )
+
+
+def _score_batch(batch):
+    # A batch is either a list of texts or an (input_ids, attention_mask) pair from pretokenize.
+    if not isinstance(batch, tuple):
+        inputs = _worker['tokenizer'](batch, padding=True, truncation=True, max_length=_worker['max_length'],
+                                      return_tensors="np")
+        batch = inputs['input_ids'], inputs['attention_mask']
+    start = time.perf_counter()
+    scores = _worker['backend'].scores(*batch)
+    # The latency is measured here, in the worker, so queueing in the parent does not count.
+    return scores, time.perf_counter() - start, int(np.asarray(batch[1]).sum())
+
+
+def default_layout(processes=None, intra_op_threads=None, cores=None):
+    """Split ``cores`` (default: all of the machine's) into ``(processes, intra_op_threads)``.
+
+    Defaults to two intra-op threads per worker, which keeps the matrix
+    multiplies reasonably wide without the workers oversubscribing the cores.
+    """
+    cores = cores or os.cpu_count() or 1
+    if intra_op_threads is None:
+        intra_op_threads = max(1, cores // processes) if processes else min(2, cores)
+    if processes is None:
+        processes = max(1, cores // intra_op_threads)
+    return processes, intra_op_threads
+
+
+class CPUInferencePool:
+    """Score text batches across worker processes that each hold their own model.
+
+    Use it as a context manager and call ``map`` with an iterable of text
+    batches or pretokenized ``(input_ids, attention_mask)`` pairs; results
+    are yielded in submission order. At most ``max_in_flight`` batches are
+    queued at once, so neither the inputs nor the finished results of the
+    whole run pile up in memory. ``backend`` picks fp32 torch, int8 or ONNX
+    Runtime inference (see ``backends``).
+    """
+
+    def __init__(self, model_name, processes=None, intra_op_threads=None, max_in_flight=None, max_length=512,
+                 backend='torch', onnx_dir='onnx_models'):
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.processes, self.intra_op_threads = default_layout(processes, intra_op_threads)
+        self.max_in_flight = max_in_flight or 2 * self.processes
+        self.max_length = max_length
+        self._executor = None
+
+    def __enter__(self):
+        # spawn rather than fork: torch's thread pools do not survive a fork.
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.model_name, self.intra_op_threads, self.max_length, self.backend, self.onnx_dir,
+                      *profiling.trace_settings()),
+        )
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown(cancel_futures=True)
+        self._executor = None
+
+    def pids(self):
+        """Process ids of the started workers."""
+        return list(self._executor._processes) if self._executor is not None else []
+
+    def map(self, batches):
+        for scores, seconds, tokens in ordered_map(self._executor, _score_batch, batches, self.max_in_flight):
+            profiling.record_batch('forward', seconds, len(scores), tokens)
+            yield scores
+
+
+def ordered_map(executor, fn, items, max_in_flight):
+    """Like ``executor.map`` but submits lazily, keeping at most ``max_in_flight`` calls queued."""
+    in_flight = deque()
+    for item in items:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+        in_flight.append(executor.submit(fn, item))
+    while in_flight:
+        yield in_flight.popleft().result()
@@ -0,0 +1,220 @@
+"""Streaming pipeline over local Amazon-Reviews-2023 shards.
+
+``pd.DataFrame(data["full"])`` copies the whole split into Python objects
+before anything else runs, which cannot work for categories with tens of
+millions of reviews. This mode reads record batches from local Arrow, Parquet
+or JSONL shards, computes the review features, scores sentiment and appends
+each chunk to the results store before reading the next, so peak memory
+depends on the chunk size and not on the size of the category.
+
+    python -m review_sentiment.ingest shards/*.parquet --output sentiment_analysis_results --models distilbert roberta vader
+
+An interrupted run picks up after its last finished chunk with ``--resume``.
+With ``--incremental CATEGORY`` the store is kept and only reviews that are
+new or edited since the last run are scored and merged in (see
+``incremental``).
+"""
+
+import argparse
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from . import profiling
+from .autotune import TUNING_FILE, tuned_settings
+from .features import add_review_features
+from .store import ResultsStore
+
+SHARD_SUFFIXES = ('.parquet', '.arrow', '.jsonl', '.json')
+
+
+def expand_shards(paths):
+    """Expand directories and glob patterns into a sorted list of shard files."""
+    shards = []
+    for path in paths:
+        if os.path.isdir(path):
+            shards.extend(os.path.join(path, name) for name in os.listdir(path) if name.endswith(SHARD_SUFFIXES))
+        else:
+            shards.extend(glob.glob(path) or [path])
+    return sorted(shards)
+
+
+def hub_shards(category, cache_dir=None):
+    """Download (or reuse the cached) Amazon-Reviews-2023 ``raw_review_<category>`` split; returns its Arrow files."""
+    import datasets
+
+    datasets.logging.set_verbosity_error()
+    data = datasets.load_dataset("McAuley-Lab/Amazon-Reviews-2023", f"raw_review_{category}", split='full',
+                                 cache_dir=cache_dir, trust_remote_code=True)
+    return [entry['filename'] for entry in data.cache_files]
+
+
+def arrow_batches(path):
+    import pyarrow as pa
+
+    # Hugging Face caches splits as Arrow IPC streams; plain .arrow files may use the file format.
+    try:
+        reader = pa.ipc.open_stream(pa.memory_map(path))
+    except pa.ArrowInvalid:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+        return
+    yield from reader
+
+
+def iter_record_batches(paths, batch_rows=50_000, columns=None):
+    """Yield the reviews in ``paths`` as pandas DataFrames of at most ``batch_rows`` rows."""
+    for path in expand_shards(paths):
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns):
+                yield batch.to_pandas()
+        elif path.endswith('.arrow'):
+            import pyarrow as pa
+
+            pending = []
+            pending_rows = 0
+            for batch in arrow_batches(path):
+                if columns:
+                    batch = batch.select(columns)
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                if pending_rows >= batch_rows:
+                    yield pa.Table.from_batches(pending).to_pandas()
+                    pending, pending_rows = [], 0
+            if pending:
+                yield pa.Table.from_batches(pending).to_pandas()
+        else:
+            for chunk in pd.read_json(path, lines=True, chunksize=batch_rows, dtype=False):
+                yield chunk[columns] if columns else chunk
+
+
+def stream_pipeline(paths, store, scorers, batch_rows=50_000, progress=None, resume=False):
+    """Featurize and score every review in ``paths`` chunk by chunk.
+
+    ``scorers`` maps an output column name to a callable taking a list of
+    texts; every chunk is handed to all of them at once (see
+    ``scoring.fan_out``). Each finished chunk is appended to ``store`` (a
+    ``ResultsStore``) as one part, replacing whatever it held before.
+    Finished chunks are recorded in a checkpoint manifest in the store, and
+    with ``resume`` a run over the same shards and settings keeps them and
+    continues after the last one (see ``checkpoint``). Returns the number of
+    rows written by this call.
+    """
+    from .checkpoint import Checkpoint
+    from .scoring import fan_out
+
+    progress = progress or (lambda it: it)
+    shards = expand_shards(paths)
+    job = {'shards': [[path, os.path.getsize(path), os.path.getmtime(path)] for path in shards],
+           'batch_rows': batch_rows, 'columns': sorted(scorers)}
+    if not resume:
+        store.clear()
+    checkpoint = Checkpoint(os.path.join(store.root, '.checkpoint'), job, restart=not resume)
+    for index, part in enumerate(store.parts()):
+        # Parts written after the last manifest update belong to an unfinished chunk.
+        if index not in checkpoint.done:
+            store.remove_part(part)
+
+    rows = 0
+    with ThreadPoolExecutor(len(scorers) or 1, thread_name_prefix='scorer') as executor:
+        for index, chunk in enumerate(progress(profiling.iterate('read', iter_record_batches(shards, batch_rows)))):
+            if index in checkpoint.done:
+                continue
+            with profiling.stage('features', rows=len(chunk)):
+                chunk = add_review_features(chunk.reset_index(drop=True))
+            with profiling.stage('score', rows=len(chunk)):
+                chunk = chunk.assign(**fan_out(scorers, chunk['text'], executor))
+            with profiling.stage('write', rows=len(chunk)):
+                store.append(chunk)
+                checkpoint.mark_done(index)
+            rows += len(chunk)
+    return rows
+
+
+def build_scorers(models, cache=None, device=None, backend='torch', tuning_file=TUNING_FILE, **scorer_kwargs):
+    """Open the scorers for short model names (see ``scoring.MODELS`` plus ``vader``).
+
+    The scorers run side by side, so on CPU the cores are split evenly
+    between them instead of each one sizing its worker pool for the whole
+    machine. Settings that ``autotune`` saved in ``tuning_file`` for this
+    host replace the defaults; the tuned worker layout is only used when the
+    model has the machine to itself. ``scorer_kwargs`` go to every
+    ``TransformerScorer`` and override both.
+    """
+    from .inference import default_layout, select_device
+    from .scoring import MODELS, VADER_COLUMN, TransformerScorer, VaderScorer
+
+    share = max(1, (os.cpu_count() or 1) // max(1, len(models)))
+    transformer_kwargs = {'device': device, 'cache': cache, 'backend': backend}
+    if len(models) > 1 and any(name != 'vader' for name in models) and select_device(device) == 'cpu':
+        transformer_kwargs['processes'], transformer_kwargs['intra_op_threads'] = default_layout(cores=share)
+    scorers = {}
+    for name in models:
+        if name == 'vader':
+            scorers[VADER_COLUMN] = VaderScorer(cache=cache, processes=share if len(models) > 1 else None)
+        else:
+            model_name, column = MODELS[name]
+            tuned = tuned_settings(model_name, backend, select_device(device), tuning_file)
+            if len(models) > 1:
+                tuned.pop('processes', None)
+                tuned.pop('intra_op_threads', None)
+            scorers[column] = TransformerScorer(model_name, **{**transformer_kwargs, **tuned, **scorer_kwargs})
+    return scorers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('shards', nargs='+', help='Arrow/Parquet/JSONL files, directories or glob patterns')
+    parser.add_argument('--output', default='sentiment_analysis_results', help='results store directory')
+    parser.add_argument('--models', nargs='+', default=['distilbert'], help='distilbert, roberta and/or vader')
+    parser.add_argument('--batch-rows', type=int, default=50_000)
+    parser.add_argument('--cache', default='sentiment_cache.sqlite', help="score cache path, '' to disable")
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--backend', default='torch', help='torch, torch-int8, onnx or onnx-int8')
+    parser.add_argument('--tuning-file', default=TUNING_FILE,
+                        help="settings saved by review_sentiment.autotune, '' to use the defaults")
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted run over the same shards instead of starting over')
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='write per-stage timings, throughput, peak RSS and batch latencies as JSON')
+    parser.add_argument('--torch-trace', metavar='DIR', default=None,
+                        help='with --profile, also record the first forward passes of each process with torch.profiler')
+    parser.add_argument('--incremental', metavar='CATEGORY', default=None,
+                        help='merge only new or edited reviews into the existing store, e.g. All_Beauty')
+    args = parser.parse_args(argv)
+
+    from tqdm import tqdm
+    from .cache import ScoreCache
+
+    profiler = profiling.Profiler('ingest', torch_trace_dir=args.torch_trace).start() if args.profile else None
+    cache = ScoreCache(args.cache) if args.cache else None
+    scorers = build_scorers(args.models, cache=cache, device=args.device, backend=args.backend,
+                            tuning_file=args.tuning_file)
+    store = ResultsStore(args.output)
+    try:
+        if args.incremental:
+            from .incremental import incremental_update
+
+            stats = incremental_update(iter_record_batches(args.shards, args.batch_rows), store, scorers,
+                                       args.incremental, progress=tqdm)
+            print(f"Merged {stats['new']} new and {stats['changed']} edited reviews into {args.output} "
+                  f"({stats['skipped']} of {stats['seen']} already scored)")
+        else:
+            rows = stream_pipeline(args.shards, store, scorers, args.batch_rows, progress=tqdm, resume=args.resume)
+            print(f"Wrote {rows} reviews to {args.output}")
+    finally:
+        for scorer in scorers.values():
+            scorer.close()
+    if cache is not None:
+        print(f"Cache hit rate: {cache.hit_rate():.2%}")
+    if profiler is not None:
+        print(f"Profile written to {profiler.write(args.profile)}")
+
+
+if __name__ == '__main__':
+    main()
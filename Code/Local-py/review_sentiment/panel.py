@@ -0,0 +1,446 @@
+"""Out-of-core fixed- and random-effects panel estimation.
+
+``PanelOLS(..., entity_effects=True)`` and ``RandomEffects`` need the whole
+design matrix in memory, which rules them out for categories with millions of
+``user_id`` entities. Both estimators only depend on a few sufficient
+statistics of ``z = [1, x, y]``:
+
+* ``Z'Z`` over all rows,
+* the per-entity sums ``S_i = sum_t z_it`` (whose first entry is the row count ``n_i``).
+
+The within (entity-demeaned) moments are ``Z'Z - sum_i S_i S_i' / n_i``, the
+between moments use the entity means ``S_i / n_i``, and the random-effects
+quasi-demeaned moments are ``Z'Z - sum_i (2 theta_i - theta_i^2) S_i S_i' / n_i``.
+``PanelAccumulator`` builds these statistics chunk by chunk and merges
+partial results from other processes, so the design matrix is never held in
+full. ``PanelMoments`` condenses them once into the matrices all three
+estimators (and the pooled ``sm.GLS`` fit) are solved from. Entity-clustered standard errors need the per-entity score sums
+``sum_t x_it e_it``, which a second pass over the chunks collects once the
+coefficients are known.
+
+The conventions follow linearmodels' defaults: the fixed-effects model
+re-adds the grand mean so the constant is reported, and its unadjusted
+covariance counts the absorbed entity effects in the residual degrees of
+freedom. Random effects uses the Swamy-Arora variance components. Clustered
+covariances are scaled by ``nobs / (nobs - nvar)``; the entity effects are
+nested in the entity clusters and so are not counted again.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+INTERACTIONS = ('log_review_length', 'rating_review_length')
+
+
+class PanelAccumulator:
+    """Chunk-by-chunk sufficient statistics for one-way entity panel models."""
+
+    def __init__(self, regressors, target, entity='user_id', consolidate_rows=2_000_000):
+        self.regressors = list(regressors)
+        self.target = target
+        self.entity = entity
+        self.columns = ['const'] + self.regressors + [target]
+        self.nobs = 0
+        self.zz = np.zeros((len(self.columns), len(self.columns)))
+        # Affine map applied to every z row, e.g. by ``standardized``; second passes need it too.
+        self.transform = np.eye(len(self.columns))
+        self.consolidate_rows = consolidate_rows
+        self._entity_sums = None
+        self._partials = []
+        self._pending_rows = 0
+
+    def design(self, chunk):
+        """``z = [1, x, y]`` rows of ``chunk`` as a float64 array, with ``transform`` applied."""
+        z = np.empty((len(chunk), len(self.columns)))
+        z[:, 0] = 1.0
+        z[:, 1:] = chunk[self.regressors + [self.target]].to_numpy(dtype=np.float64)
+        return z @ self.transform
+
+    def update(self, chunk):
+        # Rows with missing values are dropped, as linearmodels does.
+        chunk = chunk.dropna(subset=self.regressors + [self.target, self.entity])
+        z = self.design(chunk)
+        self.nobs += len(z)
+        self.zz += z.T @ z
+        self._add_partial(pd.DataFrame(z, index=chunk[self.entity].to_numpy()).groupby(level=0, sort=False).sum())
+        return self
+
+    def merge(self, other):
+        """Add the statistics of ``other`` (e.g. built in another process) to this accumulator."""
+        if other.columns != self.columns or not np.array_equal(other.transform, self.transform):
+            raise ValueError("can only merge accumulators over the same columns and transform")
+        self.nobs += other.nobs
+        self.zz += other.zz
+        other_sums = other.entity_sums()
+        if other_sums is not None:
+            self._add_partial(other_sums)
+        return self
+
+    def save(self, path):
+        """Write the statistics to ``path`` (npz), e.g. to be merged on another host later."""
+        sums = self.entity_sums()
+        if sums is None:
+            sums = pd.DataFrame(np.empty((0, len(self.columns))), index=pd.Index([], dtype=str))
+        np.savez(path, columns=np.array(self.columns), entity=np.array(self.entity), nobs=self.nobs, zz=self.zz,
+                 transform=self.transform, entities=sums.index.to_numpy(dtype=str), sums=sums.to_numpy())
+
+    @classmethod
+    def load(cls, path, consolidate_rows=2_000_000):
+        with np.load(path) as data:
+            columns = data['columns'].tolist()
+            acc = cls(columns[1:-1], columns[-1], str(data['entity']), consolidate_rows)
+            acc.nobs = int(data['nobs'])
+            acc.zz = data['zz']
+            acc.transform = data['transform']
+            if len(data['entities']):
+                acc._entity_sums = pd.DataFrame(data['sums'], index=data['entities'].astype(object))
+        return acc
+
+    def _add_partial(self, partial):
+        self._partials.append(partial)
+        self._pending_rows += len(partial)
+        if self._pending_rows >= self.consolidate_rows:
+            self._consolidate()
+
+    def _consolidate(self):
+        frames = self._partials if self._entity_sums is None else [self._entity_sums, *self._partials]
+        if frames:
+            self._entity_sums = pd.concat(frames).groupby(level=0, sort=False).sum()
+        self._partials = []
+        self._pending_rows = 0
+
+    def entity_sums(self):
+        """Per-entity sums of ``z`` as a DataFrame indexed by entity; column 0 is the row count."""
+        self._consolidate()
+        return self._entity_sums
+
+    def standardized(self):
+        """Copy with every regressor centred and scaled to unit variance, as ``StandardScaler`` would.
+
+        Standardizing is an affine map of ``z``, so it is applied to the
+        accumulated statistics directly instead of re-reading the data.
+        """
+        mean = self.zz[0] / self.nobs
+        var = np.diag(self.zz) / self.nobs - mean ** 2
+        step = np.eye(len(self.columns))
+        for j in range(1, len(self.columns) - 1):
+            scale = np.sqrt(var[j]) if var[j] > 0 else 1.0
+            step[j, j] = 1.0 / scale
+            step[0, j] = -mean[j] / scale
+        out = PanelAccumulator(self.regressors, self.target, self.entity, self.consolidate_rows)
+        out.nobs = self.nobs
+        out.zz = step.T @ self.zz @ step
+        out.transform = self.transform @ step
+        sums = self.entity_sums()
+        out._entity_sums = pd.DataFrame(sums.to_numpy() @ step, index=sums.index)
+        return out
+
+
+class PanelResult:
+    """Coefficients and covariance of one panel estimator."""
+
+    def __init__(self, name, names, params, cov, nobs, n_entities, df_resid=None, **extra):
+        self.name = name
+        self.params = pd.Series(params, index=names, name='parameter')
+        self.cov = pd.DataFrame(cov, index=names, columns=names)
+        self.nobs = nobs
+        self.n_entities = n_entities
+        self.df_resid = df_resid
+        self.extra = extra
+
+    @property
+    def std_errors(self):
+        return pd.Series(np.sqrt(np.diag(self.cov.to_numpy())), index=self.params.index, name='std_error')
+
+    def summary(self):
+        """Parameter table with standard errors, t statistics and two-sided p-values."""
+        from scipy import stats
+
+        tstats = self.params / self.std_errors
+        if self.df_resid:
+            pvalues = 2 * stats.t.sf(np.abs(tstats), self.df_resid)
+        else:
+            pvalues = 2 * stats.norm.sf(np.abs(tstats))
+        return pd.DataFrame({'parameter': self.params, 'std_error': self.std_errors,
+                             'tstat': tstats, 'pvalue': pvalues})
+
+    def __repr__(self):
+        return f"{self.name} (nobs={self.nobs}, entities={self.n_entities})\n{self.summary()}"
+
+
+def _solve(moments, k):
+    """OLS coefficients and residual sum of squares from the ``[x, y]`` moment matrix."""
+    beta = np.linalg.solve(moments[:k, :k], moments[:k, k])
+    return beta, float(moments[k, k] - beta @ moments[:k, k])
+
+
+def _hausman(fe, re):
+    """Hausman test of fixed against random effects over the coefficients both models identify."""
+    from scipy import stats
+
+    names = [n for n in fe.params.index if n != 'const']
+    diff = (fe.params[names] - re.params[names]).to_numpy()
+    cov = (fe.cov.loc[names, names] - re.cov.loc[names, names]).to_numpy()
+    statistic = float(diff @ np.linalg.pinv(cov) @ diff)
+    return {'statistic': statistic, 'df': len(names), 'pvalue': float(stats.chi2.sf(statistic, len(names)))}
+
+
+class PanelMoments:
+    """Every moment matrix the FE, RE and pooled GLS estimators need, computed once from an accumulator.
+
+    The Swamy-Arora ``theta_i`` only depends on the entity's row count
+    ``n_i``, so the per-entity sums are folded into one matrix per distinct
+    count, ``Q_T = sum_{i: n_i = T} S_i S_i' / T``. The within, between and
+    quasi-demeaned moments of any subset of the regressors are weighted sums
+    of these few matrices, which makes each further specification a small
+    linear solve instead of another pass over the data.
+    """
+
+    def __init__(self, columns, nobs, zz, counts, entities_per_count, q):
+        self.columns = list(columns)
+        self.nobs = nobs
+        self.zz = zz
+        self.counts = counts
+        self.entities_per_count = entities_per_count
+        self.q = q
+        self.n_entities = int(entities_per_count.sum())
+        self.grand_mean = zz[0] / nobs
+        self.within = zz - q.sum(axis=0)
+        self.between = np.tensordot(1.0 / counts, q, axes=1)
+        self.t_bar = self.n_entities / (entities_per_count / counts).sum()
+
+    @classmethod
+    def from_accumulator(cls, acc):
+        sums = acc.entity_sums().to_numpy()
+        counts, position, entities_per_count = np.unique(sums[:, 0], return_inverse=True, return_counts=True)
+        order = np.argsort(position, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(entities_per_count)])
+        q = np.empty((len(counts), sums.shape[1], sums.shape[1]))
+        for j, count in enumerate(counts):
+            group = sums[order[bounds[j]:bounds[j + 1]]]
+            q[j] = group.T @ group / count
+        return cls(acc.columns, acc.nobs, acc.zz.copy(), counts, entities_per_count, q)
+
+    def save(self, path):
+        np.savez(path, columns=np.array(self.columns), nobs=self.nobs, zz=self.zz, counts=self.counts,
+                 entities_per_count=self.entities_per_count, q=self.q)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['columns'].tolist(), int(data['nobs']), data['zz'], data['counts'],
+                       data['entities_per_count'], data['q'])
+
+    def _spec(self, regressors):
+        """Indices of ``[const, regressors..., target]`` and the coefficient names."""
+        names = self.columns[1:-1] if regressors is None else list(regressors)
+        missing = [n for n in names if n not in self.columns[1:-1]]
+        if missing:
+            raise KeyError(f"regressors not in the accumulated statistics: {missing}")
+        idx = [0] + [self.columns.index(n) for n in names] + [len(self.columns) - 1]
+        return np.ix_(idx, idx), ['const'] + names
+
+    def fixed_effects(self, regressors=None):
+        """Entity fixed effects with a constant (unadjusted covariance); ``regressors`` defaults to all."""
+        sel, names = self._spec(regressors)
+        k = len(names)
+        within = (self.within + self.nobs * np.outer(self.grand_mean, self.grand_mean))[sel]
+        beta, ssr = _solve(within, k)
+        df_resid = self.nobs - k - (self.n_entities - 1)
+        cov = ssr / df_resid * np.linalg.inv(within[:k, :k])
+        return PanelResult('Fixed effects (entity)', names, beta, cov, self.nobs, self.n_entities, df_resid,
+                           xx=within[:k, :k], ssr=ssr)
+
+    def random_effects(self, regressors=None):
+        """Swamy-Arora random effects (unadjusted covariance); ``regressors`` defaults to all."""
+        sel, names = self._spec(regressors)
+        k = len(names)
+        # The constant is wiped out by demeaning, so the within fit uses the other regressors only.
+        _, ssr_within = _solve(self.within[sel][1:, 1:], k - 1)
+        sigma2_e = ssr_within / (self.nobs - k - self.n_entities + 1)
+        _, ssr_between = _solve(self.between[sel], k)
+        sigma2_u = max(0.0, ssr_between / (self.n_entities - k) - sigma2_e / self.t_bar)
+        theta = 1.0 - np.sqrt(sigma2_e / (self.counts * sigma2_u + sigma2_e))
+
+        quasi = (self.zz - np.tensordot(2 * theta - theta ** 2, self.q, axes=1))[sel]
+        beta, ssr = _solve(quasi, k)
+        df_resid = self.nobs - k
+        cov = ssr / df_resid * np.linalg.inv(quasi[:k, :k])
+        return PanelResult('Random effects', names, beta, cov, self.nobs, self.n_entities, df_resid,
+                           xx=quasi[:k, :k], ssr=ssr, theta=theta, counts=self.counts,
+                           sigma2_e=sigma2_e, sigma2_u=sigma2_u, rho=sigma2_u / (sigma2_u + sigma2_e))
+
+    def pooled(self, regressors=None):
+        """Pooled regression on the raw moments, i.e. ``sm.GLS(y, X)`` with no ``sigma`` (unadjusted covariance)."""
+        sel, names = self._spec(regressors)
+        k = len(names)
+        zz = self.zz[sel]
+        beta, ssr = _solve(zz, k)
+        df_resid = self.nobs - k
+        cov = ssr / df_resid * np.linalg.inv(zz[:k, :k])
+        return PanelResult('Pooled GLS', names, beta, cov, self.nobs, self.n_entities, df_resid,
+                           xx=zz[:k, :k], ssr=ssr)
+
+    def fit(self, regressors=None):
+        """FE, RE and pooled GLS for one specification, plus the Hausman test of FE against RE."""
+        fe, re = self.fixed_effects(regressors), self.random_effects(regressors)
+        return {'fixed_effects': fe, 'random_effects': re, 'gls': self.pooled(regressors),
+                'hausman': _hausman(fe, re)}
+
+
+class ScoreAccumulator:
+    """Second pass: per-entity sums of ``x_it * e_it`` for the fixed- and random-effects fits."""
+
+    def __init__(self, acc, fe, re):
+        sums = acc.entity_sums()
+        self.entity_index = sums.index
+        self.means = sums.to_numpy() / sums.to_numpy()[:, :1]
+        self.grand_mean = acc.zz[0] / acc.nobs
+        self.acc = acc
+        self.k = len(acc.columns) - 1
+        self.beta_fe = fe.params.to_numpy()
+        self.beta_re = re.params.to_numpy()
+        # ``theta`` is stored per distinct entity row count; spread it back out to the entities.
+        self.theta = re.extra['theta'][np.searchsorted(re.extra['counts'], sums.to_numpy()[:, 0])]
+        # Allocated on the first ``add`` so copies sent to worker processes stay small.
+        self.fe_scores = None
+        self.re_scores = None
+
+    def chunk_scores(self, chunk):
+        """``(entity positions, fe score sums, re score sums)`` for one chunk."""
+        chunk = chunk.dropna(subset=self.acc.regressors + [self.acc.target, self.acc.entity])
+        z = self.acc.design(chunk)
+        idx = self.entity_index.get_indexer(chunk[self.acc.entity].to_numpy())
+        entity_means = self.means[idx]
+        k = self.k
+
+        within = z - entity_means + self.grand_mean
+        fe = within[:, :k] * (within[:, k] - within[:, :k] @ self.beta_fe)[:, None]
+        quasi = z - self.theta[idx][:, None] * entity_means
+        re = quasi[:, :k] * (quasi[:, k] - quasi[:, :k] @ self.beta_re)[:, None]
+
+        grouped = pd.DataFrame(np.hstack([fe, re])).groupby(idx).sum()
+        values = grouped.to_numpy()
+        return grouped.index.to_numpy(), values[:, :k], values[:, k:]
+
+    def add(self, idx, fe, re):
+        if self.fe_scores is None:
+            self.fe_scores = np.zeros((len(self.entity_index), self.k))
+            self.re_scores = np.zeros((len(self.entity_index), self.k))
+        self.fe_scores[idx] += fe
+        self.re_scores[idx] += re
+
+    def update(self, chunk):
+        self.add(*self.chunk_scores(chunk))
+        return self
+
+
+def clustered(result, scores):
+    """Copy of ``result`` with an entity-clustered covariance built from per-entity ``scores``."""
+    xx_inv = np.linalg.inv(result.extra['xx'])
+    meat = scores.T @ scores
+    nvar = len(result.params)
+    cov = result.nobs / (result.nobs - nvar) * xx_inv @ meat @ xx_inv
+    cov = (cov + cov.T) / 2
+    return PanelResult(result.name + ', clustered by entity', list(result.params.index), result.params.to_numpy(),
+                       cov, result.nobs, result.n_entities, result.df_resid, **result.extra)
+
+
+def fit_panel(chunks, regressors, target, entity='user_id', standardize=False):
+    """Fit fixed and random effects over ``chunks()`` with entity-clustered standard errors.
+
+    ``chunks`` is a zero-argument callable returning a fresh iterable of
+    DataFrames, since the clustered covariance needs a second pass.
+    Returns the clustered ``fixed_effects`` and ``random_effects`` results,
+    the pooled ``gls`` result, the ``hausman`` test (on the unadjusted
+    covariances) and the ``moments`` they were solved from.
+    """
+    acc = PanelAccumulator(regressors, target, entity)
+    for chunk in chunks():
+        acc.update(chunk)
+    if standardize:
+        acc = acc.standardized()
+    moments = PanelMoments.from_accumulator(acc)
+    fits = moments.fit()
+    scores = ScoreAccumulator(acc, fits['fixed_effects'], fits['random_effects'])
+    for chunk in chunks():
+        scores.update(chunk)
+    return _with_clustered(fits, scores, moments)
+
+
+def _with_clustered(fits, scores, moments):
+    fits['fixed_effects'] = clustered(fits['fixed_effects'], scores.fe_scores)
+    fits['random_effects'] = clustered(fits['random_effects'], scores.re_scores)
+    fits['moments'] = moments
+    return fits
+
+
+def read_store_part(root, part, regressors, target, entity):
+    """Columns for a panel fit from one results store part, deriving the interaction features if needed."""
+    from .features import add_interaction_features
+    from .store import ResultsStore
+
+    store = ResultsStore(root)
+    stored = set(store.columns())
+    derived = [c for c in regressors if c in INTERACTIONS and c not in stored]
+    columns = [entity, target] + [c for c in regressors if c not in derived]
+    if derived:
+        columns += [c for c in ('rating', 'review_length') if c not in columns]
+    chunk = store.read_part(part, columns)
+    return add_interaction_features(chunk) if derived else chunk
+
+
+def _first_pass(root, part, regressors, target, entity):
+    acc = PanelAccumulator(regressors, target, entity)
+    acc.update(read_store_part(root, part, regressors, target, entity))
+    acc.entity_sums()
+    return acc
+
+
+_worker = {}
+
+
+def _init_second_pass(scores):
+    _worker['scores'] = scores
+
+
+def _second_pass(root, part):
+    scores = _worker['scores']
+    acc = scores.acc
+    return scores.chunk_scores(read_store_part(root, part, acc.regressors, acc.target, acc.entity))
+
+
+def fit_panel_store(store, regressors, target='sentiment_score', entity='user_id', standardize=False,
+                    processes=None):
+    """``fit_panel`` over every part of a ``ResultsStore``, one part per task across ``processes`` workers.
+
+    Each worker returns the statistics of its part and the parent merges
+    them; only the per-entity sums ever travel between processes. The
+    returned ``moments`` can be saved and refit with other regressor subsets
+    without reading the store again.
+    """
+    parts = store.parts()
+    if not parts:
+        raise ValueError(f"results store {store.root!r} is empty")
+    processes = processes or min(len(parts), multiprocessing.cpu_count()) or 1
+    context = multiprocessing.get_context('spawn')
+    args = [(store.root, part, regressors, target, entity) for part in parts]
+
+    acc = PanelAccumulator(regressors, target, entity)
+    with ProcessPoolExecutor(processes, mp_context=context) as executor:
+        for partial in executor.map(_first_pass, *zip(*args)):
+            acc.merge(partial)
+    if standardize:
+        acc = acc.standardized()
+    moments = PanelMoments.from_accumulator(acc)
+    fits = moments.fit()
+
+    scores = ScoreAccumulator(acc, fits['fixed_effects'], fits['random_effects'])
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_second_pass,
+                             initargs=(scores,)) as executor:
+        for idx, fe_part, re_part in executor.map(_second_pass, [store.root] * len(parts), parts):
+            scores.add(idx, fe_part, re_part)
+    return _with_clustered(fits, scores, moments)
@@ -0,0 +1,235 @@
+"""Tokenize once per tokenizer family and reuse the ids from disk.
+
+Tokenizing the full raw text of every review on every batch pays for
+thousands of tokens that ``max_length=512`` throws away. Here each text is
+first clipped to a character budget derived from the token limit, the fast
+tokenizer runs over large chunks (its Rust backend spreads a batch across
+cores), and the resulting ``input_ids`` are kept as one flat array plus
+offsets. Attention masks are all ones before padding, so they are rebuilt
+when a batch is collated instead of being stored. With a cache directory the
+ids of every text are saved by a hash of the text (see ``TokenCache``), so
+any later call, whatever other texts it gets, reuses them.
+
+With ``head_tail=True`` long reviews keep their first and last tokens instead
+of only the first ones; the end of a review is often where the verdict is.
+"""
+
+import hashlib
+import os
+import shutil
+import time
+
+import numpy as np
+
+# Characters per token assumed when clipping. It is not a bound (URLs or runs of whitespace make longer tokens), so
+# clips fall on whitespace and a clipped text that comes out short of the limit is tokenized again in full.
+CHARS_PER_TOKEN = 8
+
+
+def char_budget(max_length=512, chars_per_token=CHARS_PER_TOKEN):
+    return max_length * chars_per_token
+
+
+def _head(text, budget):
+    cut = text[:budget]
+    return cut.rsplit(None, 1)[0] if len(text) > budget and cut.strip() else cut
+
+
+def _tail(text, budget):
+    cut = text[len(text) - budget:]
+    return cut.split(None, 1)[-1] if len(text) > budget and cut.strip() else cut
+
+
+def clip_text(text, budget, head_tail=False):
+    """Cut ``text`` to at most ``budget`` characters at whitespace, keeping both ends when ``head_tail`` is set."""
+    if len(text) <= budget:
+        return text
+    if not head_tail:
+        return _head(text, budget)
+    half = budget // 2
+    return _head(text, half) + ' ' + _tail(text, half)
+
+
+def family_key(tokenizer):
+    """Identifies tokenizers that produce the same ids, e.g. all checkpoints sharing one vocab.
+
+    Sorts the whole vocabulary, so callers compute it once per tokenizer.
+    """
+    vocab = tokenizer.get_vocab()
+    digest = hashlib.sha1(repr(sorted(vocab.items())).encode('utf-8')).hexdigest()[:12]
+    return f"{type(tokenizer).__name__}-{digest}"
+
+
+def text_keys(texts):
+    """64-bit key of every text (the first 8 bytes of its sha1)."""
+    return np.array([int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little') for text in texts],
+                    dtype=np.uint64)
+
+
+class TokenCache:
+    """Token ids by text key for one tokenizer family and truncation setting, kept in ``directory``.
+
+    Entries live in segments of sorted keys plus their ragged ids. A call
+    that tokenizes new texts adds one segment; past ``max_segments`` the
+    smaller half of them is merged into one, so lookups stay a few binary
+    searches. Each distinct text is stored once, so the cache grows with the
+    corpus and not with the number of calls.
+    """
+
+    def __init__(self, directory, max_segments=16):
+        self.directory = directory
+        self.max_segments = max_segments
+
+    def segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.startswith('segment-')
+                      and not name.endswith('.tmp'))
+
+    def _load(self, name):
+        path = os.path.join(self.directory, name)
+        return (np.load(os.path.join(path, 'keys.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'ids.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'offsets.npy')))
+
+    def get(self, keys):
+        """``{index into keys: ids}`` for the keys found in any segment."""
+        found = {}
+        for name in self.segments():
+            try:
+                segment_keys, ids, offsets = self._load(name)
+            except FileNotFoundError:
+                # Merged away by another process since listing.
+                continue
+            if not len(segment_keys):
+                continue
+            position = np.minimum(np.searchsorted(segment_keys, keys), len(segment_keys) - 1)
+            for i in np.flatnonzero(segment_keys[position] == keys):
+                if i not in found:
+                    found[i] = np.array(ids[offsets[position[i]]:offsets[position[i] + 1]])
+        return found
+
+    def put(self, keys, encoded):
+        """Add ``encoded`` (one id array per key) as a new segment, merging segments if there are too many."""
+        keys, first = np.unique(np.asarray(keys, dtype=np.uint64), return_index=True)
+        self._write(keys, [encoded[i] for i in first])
+        segments = self.segments()
+        if len(segments) > self.max_segments:
+            sizes = {name: os.path.getsize(os.path.join(self.directory, name, 'keys.npy')) for name in segments}
+            self._merge(sorted(segments, key=sizes.get)[:len(segments) // 2])
+
+    def _write(self, keys, encoded):
+        name = f'segment-{time.time_ns():020d}-{os.getpid()}'
+        tmp_path = os.path.join(self.directory, name + '.tmp')
+        os.makedirs(tmp_path, exist_ok=True)
+        lengths = np.array([len(ids) for ids in encoded], dtype=np.int64)
+        np.save(os.path.join(tmp_path, 'keys.npy'), keys)
+        np.save(os.path.join(tmp_path, 'ids.npy'), np.concatenate(encoded) if encoded else np.empty(0, np.int32))
+        np.save(os.path.join(tmp_path, 'offsets.npy'), np.concatenate([[0], np.cumsum(lengths)]))
+        os.replace(tmp_path, os.path.join(self.directory, name))
+
+    def _merge(self, names):
+        keys, encoded = [], []
+        for name in names:
+            try:
+                segment_keys, ids, offsets = self._load(name)
+            except FileNotFoundError:
+                continue
+            keys.append(np.asarray(segment_keys))
+            encoded.extend(np.array(ids[offsets[i]:offsets[i + 1]]) for i in range(len(segment_keys)))
+        if keys:
+            keys, first = np.unique(np.concatenate(keys), return_index=True)
+            self._write(keys, [encoded[i] for i in first])
+        for name in names:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+class Encodings:
+    """Ragged token ids for a list of texts: ``ids[offsets[i]:offsets[i + 1]]`` belongs to text ``i``."""
+
+    def __init__(self, ids, offsets, pad_token_id):
+        self.ids = ids
+        self.offsets = offsets
+        self.pad_token_id = pad_token_id
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __getitem__(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def collate(self, indices):
+        """Padded ``(input_ids, attention_mask)`` int64 arrays for the rows in ``indices``."""
+        rows = [self[i] for i in indices]
+        width = max(len(row) for row in rows)
+        input_ids = np.full((len(rows), width), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+        for r, row in enumerate(rows):
+            input_ids[r, :len(row)] = row
+            attention_mask[r, :len(row)] = 1
+        return input_ids, attention_mask
+
+
+def _encode_chunk(texts, tokenizer, max_length, head_tail):
+    budget = char_budget(max_length)
+    if not head_tail:
+        clipped = [clip_text(t, budget) for t in texts]
+        encoded = tokenizer(clipped, truncation=True, max_length=max_length)['input_ids']
+        redo = [i for i, (t, c) in enumerate(zip(texts, clipped)) if len(c) < len(t) and len(encoded[i]) < max_length]
+        if redo:
+            full = tokenizer([texts[i] for i in redo], truncation=True, max_length=max_length)['input_ids']
+            for i, ids in zip(redo, full):
+                encoded[i] = ids
+        return encoded
+    keep = max_length - tokenizer.num_special_tokens_to_add()
+    head = keep // 2
+    tail = keep - head
+    half = budget // 2
+    clipped = {}
+    long = [i for i, t in enumerate(texts) if len(t) > budget]
+    if long:
+        heads = tokenizer([_head(texts[i], half) for i in long], add_special_tokens=False)['input_ids']
+        tails = tokenizer([_tail(texts[i], half) for i in long], add_special_tokens=False)['input_ids']
+        # The first token of a tail may tokenize differently out of context, so it must fall outside the kept ones.
+        clipped = {i: h[:head] + t[len(t) - tail:] for i, h, t in zip(long, heads, tails)
+                   if len(h) >= head and len(t) > tail}
+    encoded = [None] * len(texts)
+    full = [i for i in range(len(texts)) if i not in clipped]
+    if full:
+        for i, ids in zip(full, tokenizer([texts[i] for i in full], add_special_tokens=False)['input_ids']):
+            encoded[i] = ids[:head] + ids[len(ids) - tail:] if len(ids) > keep else ids
+    for i, ids in clipped.items():
+        encoded[i] = ids
+    return [tokenizer.build_inputs_with_special_tokens(ids) for ids in encoded]
+
+
+def pretokenize(texts, tokenizer, cache_dir=None, max_length=512, head_tail=False, chunk_size=10_000, family=None):
+    """Token ids for ``texts``; with ``cache_dir``, texts any earlier call tokenized are read from disk.
+
+    The cache is one ``TokenCache`` per tokenizer family and truncation
+    setting, looked up by text. ``family`` is the tokenizer's
+    ``family_key``, computed here when not given.
+    """
+    texts = list(texts)
+    encoded = [None] * len(texts)
+    cache = None
+    if cache_dir is not None:
+        mode = 'headtail' if head_tail else 'head'
+        cache = TokenCache(os.path.join(cache_dir, f"{family or family_key(tokenizer)}-{max_length}-{mode}"))
+        keys = text_keys(texts)
+        for i, ids in cache.get(keys).items():
+            encoded[i] = ids
+    missing = [i for i, ids in enumerate(encoded) if ids is None]
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start:start + chunk_size]
+        for i, ids in zip(chunk, _encode_chunk([texts[i] for i in chunk], tokenizer, max_length, head_tail)):
+            encoded[i] = np.asarray(ids, dtype=np.int32)
+    if cache is not None and missing:
+        cache.put(keys[missing], [encoded[i] for i in missing])
+    lengths = np.array([len(ids) for ids in encoded], dtype=np.int64)
+    ids = np.concatenate(encoded) if encoded else np.empty(0, dtype=np.int32)
+    return Encodings(ids, np.concatenate([[0], np.cumsum(lengths)]), tokenizer.pad_token_id)
@@ -0,0 +1,197 @@
+"""Per-stage timing, throughput, memory and batch latency for pipeline runs.
+
+A ``Profiler`` started for a run becomes the process-wide active profiler,
+and the pipeline code reports into it through the module-level ``stage``,
+``iterate`` and ``record_batch`` helpers. Those helpers do nothing when no
+profiler is active, so instrumented code costs nothing in normal runs.
+
+    profiler = Profiler('all_beauty').start()
+    with stage('load_dataset'):
+        ...
+    profiler.write()  # profiles/all_beauty-<time>.json
+
+The report lists, per stage, wall time, call count, rows/s, tokens/s and
+the process's peak RSS when the stage ended; stages may nest, so their times
+can overlap. Batch latencies (e.g. every forward pass, measured inside the
+worker process that ran it) are summarised as p50/p90/p99/max. With
+``torch_trace_dir`` the first ``torch_trace_batches`` forward passes of
+each process are also recorded with ``torch.profiler`` and exported as
+Chrome traces.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+
+_active = {'profiler': None}
+
+
+def current():
+    """The active ``Profiler``, or None."""
+    return _active['profiler']
+
+
+def peak_rss_mb(children=False):
+    """Peak resident set size of this process (or of its finished child processes) in MiB."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Profiler:
+    """Collects stage timings and batch latencies for one run; see the module docstring."""
+
+    def __init__(self, name='run', torch_trace_dir=None, torch_trace_batches=5):
+        self.name = name
+        self.torch_trace_dir = torch_trace_dir
+        self.torch_trace_batches = torch_trace_batches
+        self.stages = {}
+        self.batches = {}
+        self.torch_traces = []
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._start = time.perf_counter()
+
+    def start(self):
+        """Make this the active profiler and return it."""
+        _active['profiler'] = self
+        return self
+
+    def stop(self):
+        if _active['profiler'] is self:
+            _active['profiler'] = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add(self, name, seconds, rows=0, tokens=0):
+        with self._lock:
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'tokens': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+            entry['rows'] += int(rows)
+            entry['tokens'] += int(tokens)
+            entry['peak_rss_mb'] = peak_rss_mb()
+
+    def record_batch(self, name, seconds, rows=0, tokens=0):
+        with self._lock:
+            self.batches.setdefault(name, []).append((seconds, int(rows), int(tokens)))
+
+    def report(self):
+        """The run's metrics as a JSON-serialisable dict."""
+        wall = time.perf_counter() - self._start
+        stages = {}
+        for name, entry in self.stages.items():
+            seconds = entry['seconds']
+            stages[name] = dict(entry, share=seconds / wall if wall else 0.0,
+                                rows_per_s=entry['rows'] / seconds if seconds else 0.0,
+                                tokens_per_s=entry['tokens'] / seconds if seconds else 0.0)
+        batches = {}
+        for name, records in self.batches.items():
+            seconds, rows, tokens = (np.array(column, dtype=np.float64) for column in zip(*records))
+            p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000
+            batches[name] = {'count': len(records), 'rows': int(rows.sum()), 'tokens': int(tokens.sum()),
+                             'seconds': float(seconds.sum()), 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99,
+                             'max_ms': float(seconds.max() * 1000),
+                             'rows_per_s': float(rows.sum() / seconds.sum()) if seconds.sum() else 0.0,
+                             'tokens_per_s': float(tokens.sum() / seconds.sum()) if seconds.sum() else 0.0}
+        return {
+            'run': self.name,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._started)),
+            'wall_seconds': wall,
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'peak_rss_mb': {'self': peak_rss_mb(), 'children': peak_rss_mb(children=True)},
+            'stages': stages,
+            'batches': batches,
+            'torch_traces': self.torch_traces,
+        }
+
+    def write(self, path=None):
+        """Write ``report()`` as JSON (default ``profiles/<name>-<start time>.json``) and return the path."""
+        if path is None:
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self._started))
+            path = os.path.join('profiles', f'{self.name}-{stamp}.json')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+@contextlib.contextmanager
+def stage(name, rows=0, tokens=0):
+    """Time the block as stage ``name``; the yielded dict's ``rows``/``tokens`` can be set inside it."""
+    profiler = current()
+    counts = {'rows': rows, 'tokens': tokens}
+    if profiler is None:
+        yield counts
+        return
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        profiler.add(name, time.perf_counter() - start, counts['rows'], counts['tokens'])
+
+
+def iterate(name, items):
+    """Yield from ``items``, timing each step as stage ``name`` with ``len(item)`` rows."""
+    profiler = current()
+    if profiler is None:
+        yield from items
+        return
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        profiler.add(name, time.perf_counter() - start, len(item))
+        yield item
+
+
+def record_batch(name, seconds, rows=0, tokens=0):
+    profiler = current()
+    if profiler is not None:
+        profiler.record_batch(name, seconds, rows, tokens)
+
+
+def trace_settings():
+    """``(torch_trace_dir, torch_trace_batches)`` of the active profiler, for worker processes to reuse."""
+    profiler = current()
+    if profiler is None or not profiler.torch_trace_dir:
+        return None, 0
+    return profiler.torch_trace_dir, profiler.torch_trace_batches
+
+
+@contextlib.contextmanager
+def torch_trace(label='forward'):
+    """Record the block with ``torch.profiler`` while the active profiler still wants traces."""
+    profiler = current()
+    if profiler is None or not profiler.torch_trace_dir or len(profiler.torch_traces) >= profiler.torch_trace_batches:
+        yield
+        return
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+    with profile(activities=activities, record_shapes=True) as prof:
+        yield
+    os.makedirs(profiler.torch_trace_dir, exist_ok=True)
+    path = os.path.join(profiler.torch_trace_dir, f'{label}-{os.getpid()}-{len(profiler.torch_traces):03d}.json')
+    prof.export_chrome_trace(path)
+    profiler.torch_traces.append(path)
@@ -0,0 +1,199 @@
+"""Sentiment scorers for the transformer models and VADER.
+
+``TransformerScorer`` puts together device selection, the CPU process pool,
+length-bucketed batches and the persistent score cache, so the DistilBERT and
+RoBERTa passes share one code path. A scorer stays open across calls, which
+lets streaming runs feed it one chunk at a time without reloading the model.
+
+Texts are tokenized once in the parent (see ``pretokenize``) and the workers
+only receive padded id/mask arrays. ``fan_out`` runs several scorers on the
+same texts at once, so a chunk is read and featurized once for all models.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from . import profiling
+from .batching import score_bucketed
+from .cache import cached_scores, model_key
+from .backends import ensure_onnx, load_backend
+from .inference import CPUInferencePool, select_device
+from .pretokenize import family_key, pretokenize
+from .vader import VaderPool
+
+# Short names used on the command line -> (Hugging Face model, results column).
+MODELS = {
+    'distilbert': ("Dmyadav2001/Sentimental-Analysis", 'sentiment_score'),
+    'roberta': ("Eugenia/roberta-base-bne-finetuned-amazon_reviews_multi", 'sentiment_score_roberta'),
+}
+VADER_COLUMN = 'sentiment_score_vader'
+
+
+class TransformerScorer:
+    """Callable that scores a list of texts with one transformer model.
+
+    With a ``ScoreCache`` only distinct texts the cache has not seen reach
+    the model. The tokenizer, model or worker pool are created on the first
+    call that actually needs the model and live until ``close``.
+    ``progress`` wraps the per-batch result iterator, e.g. ``tqdm``.
+    ``token_cache_dir`` keeps the token ids on disk for reruns and
+    ``head_tail`` keeps both ends of long reviews (see ``pretokenize``).
+    ``backend`` selects fp32 torch, int8 or ONNX Runtime inference (see
+    ``backends``); the non-torch backends are CPU only.
+    """
+
+    def __init__(self, model_name, device=None, cache=None, max_tokens=8192, max_batch_size=64,
+                 max_length=512, processes=None, intra_op_threads=None, progress=None,
+                 token_cache_dir=None, head_tail=False, backend='torch', onnx_dir='onnx_models'):
+        self.model_name = model_name
+        self.device = select_device(device)
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.processes = processes
+        self.intra_op_threads = intra_op_threads
+        self.progress = progress or (lambda it: it)
+        self.token_cache_dir = token_cache_dir
+        self.head_tail = head_tail
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.stats = {'rows': 0, 'batches': 0, 'tokens': 0, 'padded_tokens': 0, 'padding_ratio': 0.0}
+        self._tokenizer = None
+        self._token_family = None
+        self._backend = None
+        self._pool = None
+
+    def _start(self):
+        from transformers import AutoTokenizer
+
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self._token_family = family_key(self._tokenizer)
+        if self.device == 'cpu':
+            if self.backend.startswith('onnx'):
+                # Export once here rather than racing to do it in every worker.
+                ensure_onnx(self.model_name, self.onnx_dir, int8=self.backend == 'onnx-int8')
+            self._pool = CPUInferencePool(self.model_name, self.processes, self.intra_op_threads,
+                                          max_length=self.max_length, backend=self.backend,
+                                          onnx_dir=self.onnx_dir).__enter__()
+        else:
+            self._backend = load_backend(self.model_name, self.backend, self.device, self.onnx_dir)
+
+    def _score_batches(self, batches):
+        if self._pool is not None:
+            return self.progress(self._pool.map(batches))
+        return self.progress(self._score_local(ids, mask) for ids, mask in batches)
+
+    def _score_local(self, input_ids, attention_mask):
+        start = time.perf_counter()
+        scores = self._backend.scores(input_ids, attention_mask)
+        profiling.record_batch('forward', time.perf_counter() - start, len(scores),
+                               int(np.asarray(attention_mask).sum()))
+        return scores
+
+    def _score_missing(self, texts):
+        if self._tokenizer is None:
+            self._start()
+        with profiling.stage('tokenize', rows=len(texts)) as counts:
+            encodings = pretokenize(texts, self._tokenizer, self.token_cache_dir, self.max_length, self.head_tail,
+                                    family=self._token_family)
+            counts['tokens'] = int(encodings.lengths.sum())
+        scores, run_stats = score_bucketed(texts, self._tokenizer, self._score_batches, max_tokens=self.max_tokens,
+                                           max_batch_size=self.max_batch_size, max_length=self.max_length,
+                                           lengths=encodings.lengths, make_batch=encodings.collate)
+        for name in ('rows', 'batches', 'tokens', 'padded_tokens'):
+            self.stats[name] += run_stats[name]
+        padded = self.stats['padded_tokens']
+        self.stats['padding_ratio'] = (padded - self.stats['tokens']) / padded if padded else 0.0
+        return scores
+
+    def __call__(self, texts):
+        texts = list(texts)
+        with profiling.stage(f'score {self.model_name}', rows=len(texts)):
+            if self.cache is None:
+                return self._score_missing(texts)
+            key = model_key(self.model_name, self.max_length, 'head_tail' if self.head_tail else 'head', self.backend)
+            return cached_scores(texts, key, self.cache, self._score_missing)
+
+    def pids(self):
+        """This process and the worker processes holding the model, e.g. to measure their memory."""
+        return [os.getpid()] + (self._pool.pids() if self._pool is not None else [])
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.__exit__(None, None, None)
+        self._tokenizer = self._backend = self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class VaderScorer:
+    """Callable that returns the VADER compound score of each text.
+
+    With ``processes`` other than 1 the distinct uncached texts are scored on
+    a ``VaderPool``, started on first use and kept until ``close``;
+    ``processes=None`` uses every core.
+    """
+
+    def __init__(self, cache=None, processes=None, chunk_size=2000):
+        self.cache = cache
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self._analyzer = None
+        self._pool = None
+
+    def _score_missing(self, texts):
+        if self.processes == 1:
+            if self._analyzer is None:
+                from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+                self._analyzer = SentimentIntensityAnalyzer()
+            return np.array([self._analyzer.polarity_scores(text)['compound'] for text in texts], dtype=np.float32)
+        if self._pool is None:
+            self._pool = VaderPool(self.processes, self.chunk_size).__enter__()
+        return self._pool(texts)
+
+    def __call__(self, texts):
+        texts = list(texts)
+        with profiling.stage('score vader', rows=len(texts)):
+            if self.cache is None:
+                return self._score_missing(texts)
+            return cached_scores(texts, 'vaderSentiment|compound', self.cache, self._score_missing)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.__exit__(None, None, None)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def score_transformer(texts, model_name, **kwargs):
+    """Score ``texts`` once with a fresh ``TransformerScorer``; returns ``(scores, stats)``."""
+    with TransformerScorer(model_name, **kwargs) as scorer:
+        scores = scorer(texts)
+    return scores, scorer.stats
+
+
+def fan_out(scorers, texts, executor=None):
+    """Score ``texts`` with every scorer in ``scorers`` (column -> scorer); returns column -> scores.
+
+    With a thread ``executor`` the scorers run concurrently. Each one spends
+    its time in its own worker processes, on the GPU or waiting on them, so
+    threads are enough to overlap the models.
+    """
+    texts = list(texts)
+    if executor is None or len(scorers) < 2:
+        return {column: scorer(texts) for column, scorer in scorers.items()}
+    futures = {column: executor.submit(scorer, texts) for column, scorer in scorers.items()}
+    return {column: future.result() for column, future in futures.items()}
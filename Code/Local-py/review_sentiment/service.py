@@ -0,0 +1,554 @@
+"""Long-running scoring service with micro-batching.
+
+The batch scripts load a model, score a file and throw the model away. This
+service keeps the scorers warm and answers requests as they arrive, over
+local HTTP or a Unix socket:
+
+    python -m review_sentiment.service serve --models distilbert vader --port 8000
+    python -m review_sentiment.service serve --models distilbert --socket /tmp/sentiment.sock
+
+    POST /score  {"texts": ["Love it", "Broke after a week"], "models": ["distilbert"]}
+             ->  {"scores": {"sentiment_score": [0.98, -0.97]}, "latency_ms": 12.3}
+    GET  /stats  request latency p50/p90/p99, throughput and batch sizes
+    GET  /health
+
+Every model has a ``MicroBatcher``: concurrent requests are queued and
+coalesced into one scorer call once ``max_batch_rows`` texts are waiting or
+the oldest request has waited ``max_wait_ms``, so a burst of single-review
+requests costs a few forward passes instead of one each. The queue is
+bounded by ``max_pending_rows``; beyond it requests are refused with 503
+and ``Retry-After`` rather than queued into ever longer latencies.
+
+``loadtest`` drives a running service from concurrent clients and reports
+throughput and latency per concurrency level:
+
+    python -m review_sentiment.service loadtest --url http://127.0.0.1:8000 --concurrency 1 4 16 64
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from .autotune import TUNING_FILE
+
+
+class Overloaded(RuntimeError):
+    """The service's queue is full; retry later."""
+
+
+def latency_summary(seconds):
+    """Count, p50/p90/p99/max in milliseconds of a sequence of latencies in seconds."""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    if not len(seconds):
+        return {'count': 0}
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000
+    return {'count': len(seconds), 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'max_ms': float(seconds.max() * 1000)}
+
+
+def request_texts(request):
+    """The texts of a ``/score`` request body: a ``texts`` list of strings, or a single ``text`` string.
+
+    Raises ``ValueError`` for anything else, so a string sent as ``texts``
+    is not scored one character at a time and non-strings are not
+    silently converted.
+    """
+    if not isinstance(request, dict):
+        raise ValueError('the request body must be a JSON object')
+    if 'texts' in request:
+        texts = request['texts']
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise ValueError("'texts' must be a list of strings")
+    elif 'text' in request:
+        if not isinstance(request['text'], str):
+            raise ValueError("'text' must be a string")
+        texts = [request['text']]
+    else:
+        raise ValueError("the request needs 'texts' (a list of strings) or 'text' (a string)")
+    models = request.get('models')
+    if models is not None and (not isinstance(models, list) or not all(isinstance(m, str) for m in models)):
+        raise ValueError("'models' must be a list of model names")
+    return texts
+
+
+class MicroBatcher:
+    """Coalesces ``submit`` calls from many threads into batched calls of ``scorer``.
+
+    ``submit`` returns a ``Future`` for the scores of its texts. A single
+    background thread takes waiting requests in arrival order, up to
+    ``max_batch_rows`` texts (a larger request goes alone), as soon as that
+    many are queued or the oldest has waited ``max_wait_ms``. ``submit``
+    raises ``Overloaded`` when the texts already queued plus the new ones
+    would exceed ``max_pending_rows``.
+    """
+
+    def __init__(self, scorer, max_batch_rows=128, max_wait_ms=10, max_pending_rows=4096, name='scorer'):
+        self.scorer = scorer
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending_rows = max_pending_rows
+        self.batch_rows = deque(maxlen=10_000)
+        self.batch_seconds = deque(maxlen=10_000)
+        self._queue = deque()
+        self._queued_rows = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f'batcher-{name}', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        texts = list(texts)
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('the batcher is closed')
+            if self._queued_rows and self._queued_rows + len(texts) > self.max_pending_rows:
+                raise Overloaded(f'{self._queued_rows} texts already queued')
+            self._queue.append((texts, future, time.perf_counter()))
+            self._queued_rows += len(texts)
+            self._cond.notify()
+        return future
+
+    def pending_rows(self):
+        return self._queued_rows
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = self._queue[0][2] + self.max_wait
+            while self._queued_rows < self.max_batch_rows and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, rows = [], 0
+            while self._queue and (not batch or rows + len(self._queue[0][0]) <= self.max_batch_rows):
+                texts, future, _ = self._queue.popleft()
+                self._queued_rows -= len(texts)
+                # Requests whose caller gave up (cancelled futures) are dropped here.
+                if future.set_running_or_notify_cancel():
+                    batch.append((texts, future))
+                    rows += len(texts)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            texts = [text for request, _ in batch for text in request]
+            start = time.perf_counter()
+            try:
+                scores = np.asarray(self.scorer(texts), dtype=np.float32)
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.batch_seconds.append(time.perf_counter() - start)
+            self.batch_rows.append(len(texts))
+            offset = 0
+            for request, future in batch:
+                future.set_result(scores[offset:offset + len(request)])
+                offset += len(request)
+
+    def close(self):
+        """Score what is already queued, then stop the batching thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+class ScoringService:
+    """Warm scorers (column -> scorer, e.g. from ``ingest.build_scorers``) behind one ``MicroBatcher`` each.
+
+    ``score`` can be called from any number of threads; the HTTP servers
+    below are thin wrappers around it.
+    """
+
+    def __init__(self, scorers, max_batch_rows=128, max_wait_ms=10, max_pending_rows=4096, max_request_rows=1024):
+        from .scoring import MODELS, VADER_COLUMN
+
+        self.scorers = scorers
+        self.max_request_rows = max_request_rows
+        self.batchers = {column: MicroBatcher(scorer, max_batch_rows, max_wait_ms, max_pending_rows, column)
+                         for column, scorer in scorers.items()}
+        # Requests may name a model by its short name or by its results column.
+        self.aliases = {name: column for name, (_, column) in MODELS.items()}
+        self.aliases['vader'] = VADER_COLUMN
+        self.latencies = deque(maxlen=100_000)
+        self.counts = {'requests': 0, 'rows': 0, 'rejected': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def warm_up(self):
+        """Load every model now (in its worker processes, if any) instead of on the first request."""
+        for scorer in self.scorers.values():
+            scorer(['This is a warm-up review.'])
+
+    def columns(self, models=None):
+        if not models:
+            return list(self.batchers)
+        columns = [self.aliases.get(model, model) for model in models]
+        unknown = [model for model, column in zip(models, columns) if column not in self.batchers]
+        if unknown:
+            raise KeyError(f"unknown models {unknown}; this service scores {sorted(self.batchers)}")
+        return columns
+
+    def score(self, texts, models=None, timeout=None):
+        """Scores of ``texts`` from each requested model as column -> float32 array."""
+        start = time.perf_counter()
+        texts = ['' if text is None else str(text) for text in texts]
+        if len(texts) > self.max_request_rows:
+            raise ValueError(f"{len(texts)} texts in one request; the limit is {self.max_request_rows}")
+        columns = self.columns(models)
+        futures = {}
+        try:
+            for column in columns:
+                futures[column] = self.batchers[column].submit(texts)
+        except Overloaded:
+            for future in futures.values():
+                future.cancel()
+            with self._lock:
+                self.counts['rejected'] += 1
+            raise
+        try:
+            scores = {column: future.result(timeout) for column, future in futures.items()}
+        except Exception:
+            with self._lock:
+                self.counts['errors'] += 1
+            raise
+        with self._lock:
+            self.latencies.append(time.perf_counter() - start)
+            self.counts['requests'] += 1
+            self.counts['rows'] += len(texts)
+        return scores
+
+    def stats(self):
+        uptime = time.perf_counter() - self._started
+        with self._lock:
+            latencies = list(self.latencies)
+            counts = dict(self.counts)
+        models = {}
+        for column, batcher in self.batchers.items():
+            rows = np.asarray(batcher.batch_rows, dtype=np.float64)
+            models[column] = {'batches': latency_summary(list(batcher.batch_seconds)),
+                              'mean_batch_rows': float(rows.mean()) if len(rows) else 0.0,
+                              'pending_rows': batcher.pending_rows()}
+        return dict(counts, uptime_s=uptime, requests_per_s=counts['requests'] / uptime,
+                    rows_per_s=counts['rows'] / uptime, latency=latency_summary(latencies), models=models)
+
+    def close(self):
+        for batcher in self.batchers.values():
+            batcher.close()
+        for scorer in self.scorers.values():
+            scorer.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps client connections open between requests.
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok', 'models': list(self.server.service.batchers)})
+        elif self.path == '/stats':
+            self._reply(200, self.server.service.stats())
+        else:
+            self._reply(404, {'error': f'no such endpoint {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._reply(404, {'error': f'no such endpoint {self.path}'})
+            return
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            texts = request_texts(request)
+            scores = self.server.service.score(texts, request.get('models'))
+        except Overloaded as exc:
+            self._reply(503, {'error': str(exc)}, [('Retry-After', '1')])
+        except (ValueError, KeyError, TypeError) as exc:
+            self._reply(400, {'error': f'{type(exc).__name__}: {exc}'})
+        except Exception as exc:
+            self._reply(500, {'error': f'{type(exc).__name__}: {exc}'})
+        else:
+            self._reply(200, {'scores': {column: values.tolist() for column, values in scores.items()},
+                              'latency_ms': (time.perf_counter() - start) * 1000})
+
+
+class _TCPHandler(_Handler):
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # second one waits for the client's delayed ACK (~40 ms a request).
+    disable_nagle_algorithm = True
+
+
+class _ServiceMixin:
+    daemon_threads = True
+    request_queue_size = 128
+    handler = _Handler
+
+    def __init__(self, address, service, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        super().__init__(address, self.handler)
+
+
+class ScoringHTTPServer(_ServiceMixin, ThreadingHTTPServer):
+    """``ScoringService`` over TCP at ``(host, port)``."""
+
+    handler = _TCPHandler
+
+
+class ScoringUnixServer(_ServiceMixin, socketserver.ThreadingUnixStreamServer):
+    """``ScoringService`` over HTTP on the Unix socket at ``path``."""
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ScoringClient:
+    """Client for one service over a kept-alive connection; not shared between threads.
+
+    ``address`` is an ``http://host:port`` URL or the path of a Unix socket.
+    """
+
+    def __init__(self, address, timeout=60):
+        if address.startswith('http'):
+            url = urlsplit(address)
+            self._connect = lambda: http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+        else:
+            self._connect = lambda: _UnixHTTPConnection(address, timeout)
+        self._connection = None
+
+    def _request(self, method, path, body=None):
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                         headers={'Content-Type': 'application/json'})
+                response = self._connection.getresponse()
+                data = json.loads(response.read())
+            except (ConnectionError, http.client.HTTPException):
+                # The server may have closed an idle keep-alive connection; reconnect once.
+                self.close()
+                if attempt:
+                    raise
+                continue
+            if response.status == 503:
+                raise Overloaded(data.get('error'))
+            if response.status != 200:
+                raise RuntimeError(f"{response.status}: {data.get('error')}")
+            return data
+
+    def score(self, texts, models=None):
+        """Column -> list of scores for ``texts``."""
+        return self._request('POST', '/score', {'texts': list(texts), 'models': models})['scores']
+
+    def stats(self):
+        return self._request('GET', '/stats')
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def load_test(address, texts, concurrency=16, requests=1000, rows_per_request=1, models=None, seed=0):
+    """Send ``requests`` requests of ``rows_per_request`` texts from ``concurrency`` threads at once.
+
+    Returns the throughput, the client-side latency percentiles and the
+    number of requests the service refused as overloaded.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(texts), size=(requests, rows_per_request))
+    next_request = iter(range(requests))
+    lock = threading.Lock()
+    latencies, failures = [], {'rejected': 0, 'errors': 0}
+
+    def client_loop():
+        client = ScoringClient(address)
+        try:
+            while True:
+                with lock:
+                    index = next(next_request, None)
+                if index is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    client.score([texts[i] for i in picks[index]], models)
+                except Overloaded:
+                    with lock:
+                        failures['rejected'] += 1
+                    continue
+                except Exception:
+                    with lock:
+                        failures['errors'] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    return dict(failures, concurrency=concurrency, completed=len(latencies), seconds=seconds,
+                requests_per_s=len(latencies) / seconds, rows_per_s=len(latencies) * rows_per_request / seconds,
+                latency=latency_summary(latencies))
+
+
+def serve(args):
+    from .cache import ScoreCache
+    from .ingest import build_scorers
+
+    cache = ScoreCache(args.cache) if args.cache else None
+    scorers = build_scorers(args.models, cache=cache, device=args.device, backend=args.backend,
+                            tuning_file=args.tuning_file)
+    service = ScoringService(scorers, args.max_batch_rows, args.max_wait_ms, args.max_pending_rows,
+                             args.max_request_rows)
+    print(f"Loading {', '.join(args.models)}...")
+    service.warm_up()
+    if args.socket:
+        server = ScoringUnixServer(args.socket, service, args.verbose)
+        where = args.socket
+    else:
+        server = ScoringHTTPServer((args.host, args.port), service, args.verbose)
+        where = f'http://{args.host}:{server.server_address[1]}'
+    print(f"Scoring service listening on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+def run_load_test(args):
+    if args.sample:
+        from .ingest import iter_record_batches
+
+        texts = next(iter_record_batches([args.sample], batch_rows=10_000, columns=['text']))['text'].tolist()
+    else:
+        from .benchmark import synthetic_reviews
+
+        texts = synthetic_reviews(10_000, args.lengths, args.seed)['text'].tolist()
+    address = args.socket or args.url
+    print(f"{'clients':>8} {'req/s':>9} {'rows/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'rejected':>9} {'errors':>7}")
+    results = []
+    for concurrency in args.concurrency:
+        result = load_test(address, texts, concurrency, args.requests, args.rows_per_request, args.models, args.seed)
+        results.append(result)
+        latency = result['latency']
+        print(f"{concurrency:>8} {result['requests_per_s']:>9.1f} {result['rows_per_s']:>9.1f} "
+              f"{latency.get('p50_ms', float('nan')):>8.1f} {latency.get('p99_ms', float('nan')):>8.1f} "
+              f"{result['rejected']:>9} {result['errors']:>7}")
+    client = ScoringClient(address)
+    server_stats = client.stats()
+    client.close()
+    print(f"Server: {server_stats['requests']} requests, latency p50 {server_stats['latency'].get('p50_ms', 0):.1f} ms, "
+          f"p99 {server_stats['latency'].get('p99_ms', 0):.1f} ms")
+    for column, model in server_stats['models'].items():
+        print(f"  {column}: {model['batches']['count']} batches, {model['mean_batch_rows']:.1f} texts per batch")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'load_test': results, 'server': server_stats}, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='load the models and answer scoring requests')
+    serve_parser.add_argument('--models', nargs='+', default=['distilbert'], help='distilbert, roberta and/or vader')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--socket', default=None, help='listen on this Unix socket instead of TCP')
+    serve_parser.add_argument('--cache', default='sentiment_cache.sqlite', help="score cache path, '' to disable")
+    serve_parser.add_argument('--device', default=None)
+    serve_parser.add_argument('--backend', default='torch', help='torch, torch-int8, onnx or onnx-int8')
+    serve_parser.add_argument('--tuning-file', default=TUNING_FILE,
+                              help="settings saved by review_sentiment.autotune, '' to use the defaults")
+    serve_parser.add_argument('--max-batch-rows', type=int, default=128, help='texts coalesced into one model call')
+    serve_parser.add_argument('--max-wait-ms', type=float, default=10,
+                              help='longest a request waits for others to join its batch')
+    serve_parser.add_argument('--max-pending-rows', type=int, default=4096,
+                              help='queued texts per model before requests are refused with 503')
+    serve_parser.add_argument('--max-request-rows', type=int, default=1024)
+    serve_parser.add_argument('--verbose', action='store_true', help='log every request')
+
+    load_parser = commands.add_parser('loadtest', help='measure a running service under concurrent clients')
+    load_parser.add_argument('--url', default='http://127.0.0.1:8000')
+    load_parser.add_argument('--socket', default=None, help='connect to this Unix socket instead of --url')
+    load_parser.add_argument('--models', nargs='+', default=None, help='default: every model the service has')
+    load_parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16, 64])
+    load_parser.add_argument('--requests', type=int, default=1000, help='requests per concurrency level')
+    load_parser.add_argument('--rows-per-request', type=int, default=1)
+    load_parser.add_argument('--sample', default=None, help='take review texts from this shard instead of synthetic ones')
+    load_parser.add_argument('--lengths', default='amazon', help='synthetic review lengths: short, amazon or long')
+    load_parser.add_argument('--seed', type=int, default=0)
+    load_parser.add_argument('--output', default=None, help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args)
+    else:
+        run_load_test(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Partitioned Parquet store for the scored review table.
+
+Replaces the CSV + JSONL dual writes and the ``json.loads`` reloads. Layout::
+
+    <root>/base/part-00000.parquet        reviews + features, one file per appended chunk
+    <root>/columns/<name>/part-00000.parquet  one column added later, aligned with the base part
+
+Adding a score column (e.g. ``sentiment_score_roberta``) writes only that
+column's files, and ``read(columns=...)`` opens just the files holding the
+requested columns, memory-mapped, so the regression stages never parse the
+review text.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Column dtypes every part is written with, so parts written by different runs always line up.
+RESULTS_SCHEMA = {
+    'rating': 'float32',
+    'helpful_vote': 'int32',
+    'verified_purchase': 'int8',
+    'has_images': 'int8',
+    'review_length': 'int32',
+    'year': 'int16',
+    'month': 'int8',
+    'day': 'int8',
+    'weekday': 'int8',
+    'sentiment_score': 'float32',
+    'sentiment_score_roberta': 'float32',
+    'sentiment_score_vader': 'float32',
+    'text_hash': 'uint64',
+}
+
+
+def apply_schema(df):
+    """Cast the known columns of ``df`` to their ``RESULTS_SCHEMA`` dtypes."""
+    casts = {column: dtype for column, dtype in RESULTS_SCHEMA.items() if column in df.columns}
+    if 'timestamp' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df = df.assign(timestamp=pd.to_datetime(df['timestamp'], unit='ms'))
+    return df.astype(casts)
+
+
+class ResultsStore:
+    """Append-only table of scored reviews under ``root``."""
+
+    def __init__(self, root):
+        self.root = root
+        self.base_dir = os.path.join(root, 'base')
+        self.columns_dir = os.path.join(root, 'columns')
+
+    def parts(self):
+        if not os.path.isdir(self.base_dir):
+            return []
+        return sorted(name for name in os.listdir(self.base_dir) if name.endswith('.parquet'))
+
+    def part_rows(self):
+        import pyarrow.parquet as pq
+
+        return [pq.ParquetFile(os.path.join(self.base_dir, part)).metadata.num_rows for part in self.parts()]
+
+    def base_columns(self):
+        import pyarrow.parquet as pq
+
+        parts = self.parts()
+        return pq.read_schema(os.path.join(self.base_dir, parts[0])).names if parts else []
+
+    def added_columns(self):
+        if not os.path.isdir(self.columns_dir):
+            return []
+        return sorted(name for name in os.listdir(self.columns_dir) if not name.startswith('.'))
+
+    def columns(self):
+        return self.base_columns() + [c for c in self.added_columns() if c not in self.base_columns()]
+
+    def __len__(self):
+        return sum(self.part_rows())
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def append(self, df):
+        """Write ``df`` as a new base part and return the part's file name.
+
+        Values for columns kept under ``columns/`` go to those files instead;
+        such a column missing from ``df`` is written as NaN so every part
+        keeps the same columns.
+        """
+        os.makedirs(self.base_dir, exist_ok=True)
+        part = f'part-{len(self.parts()):05d}.parquet'
+        df = df.reset_index(drop=True)
+        added = self.added_columns()
+        _write_atomic(apply_schema(df.drop(columns=added, errors='ignore')), os.path.join(self.base_dir, part))
+        for name in added:
+            self.add_column_part(name, part, df[name] if name in df.columns else np.full(len(df), np.nan))
+        return part
+
+    def remove_part(self, part):
+        """Delete ``part`` with its added column files."""
+        for name in self.added_columns():
+            path = os.path.join(self.columns_dir, name, part)
+            if os.path.exists(path):
+                os.remove(path)
+        os.remove(os.path.join(self.base_dir, part))
+
+    def write(self, df, rows_per_part=250_000):
+        """Replace the store's contents with ``df``, split into parts of ``rows_per_part`` rows."""
+        self.clear()
+        for start in range(0, len(df), rows_per_part):
+            self.append(df.iloc[start:start + rows_per_part])
+
+    def add_column(self, name, values):
+        """Store ``values`` (aligned with the whole table) as column ``name``.
+
+        Only the new column is written, split along the existing base parts;
+        a column that already exists is replaced.
+        """
+        values = np.asarray(values)
+        rows = self.part_rows()
+        if len(values) != sum(rows):
+            raise ValueError(f"{name} has {len(values)} values but the store holds {sum(rows)} rows")
+        tmp_dir = os.path.join(self.columns_dir, f'.{name}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        offsets = np.cumsum([0] + rows)
+        for part, start, stop in zip(self.parts(), offsets[:-1], offsets[1:]):
+            frame = apply_schema(pd.DataFrame({name: values[start:stop]}))
+            _write_atomic(frame, os.path.join(tmp_dir, part))
+        final_dir = os.path.join(self.columns_dir, name)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+
+    def add_column_part(self, name, part, values):
+        """Store the values of column ``name`` for a single base ``part``.
+
+        A column kept in the base part itself is rewritten there.
+        """
+        if name in self.base_columns() and name not in self.added_columns():
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            path = os.path.join(self.base_dir, part)
+            table = pq.read_table(path)
+            column = pa.Table.from_pandas(apply_schema(pd.DataFrame({name: np.asarray(values)})),
+                                          preserve_index=False).column(0)
+            _write_table_atomic(table.set_column(table.schema.get_field_index(name), name, column), path)
+            return
+        column_dir = os.path.join(self.columns_dir, name)
+        os.makedirs(column_dir, exist_ok=True)
+        _write_atomic(apply_schema(pd.DataFrame({name: np.asarray(values)})), os.path.join(column_dir, part))
+
+    def filter_part(self, part, keep):
+        """Rewrite ``part``, its base file and every added column, keeping the rows where ``keep`` is true."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        mask = pa.array(np.asarray(keep, dtype=bool))
+        paths = [os.path.join(self.base_dir, part)]
+        paths += [os.path.join(self.columns_dir, name, part) for name in self.added_columns()]
+        for path in paths:
+            _write_table_atomic(pq.read_table(path).filter(mask), path)
+
+    def read(self, columns=None):
+        """Load the table, or only ``columns`` of it, as a pandas DataFrame."""
+        import pyarrow as pa
+
+        added = self.added_columns()
+        base = self.base_columns()
+        wanted = columns if columns is not None else self.columns()
+        missing = [c for c in wanted if c not in added and c not in base]
+        if missing:
+            raise KeyError(f"columns not in the results store: {missing}")
+        tables = [self._read_part_table(part, wanted, added) for part in self.parts()]
+        if not tables:
+            return pd.DataFrame(columns=wanted)
+        # Parts written from different chunks may infer different types for nested columns (e.g. all-empty ``images``).
+        return pa.concat_tables(tables, promote_options='permissive').to_pandas()
+
+    def read_part(self, part, columns):
+        """Load ``columns`` of a single base ``part`` (see ``parts``) as a pandas DataFrame."""
+        return self._read_part_table(part, columns, self.added_columns()).to_pandas()
+
+    def _read_part_table(self, part, columns, added):
+        import pyarrow.parquet as pq
+
+        base_wanted = [c for c in columns if c not in added]
+        table = pq.read_table(os.path.join(self.base_dir, part), columns=base_wanted, memory_map=True)
+        for column in columns:
+            if column in added:
+                extra = pq.read_table(os.path.join(self.columns_dir, column, part), memory_map=True)
+                table = table.append_column(column, extra.column(0))
+        return table.select(columns)
+
+
+def _write_atomic(df, path):
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _write_table_atomic(table, path):
+    import pyarrow.parquet as pq
+
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
@@ -0,0 +1,250 @@
+"""Hashed n-gram text features and an out-of-core linear sentiment model.
+
+The classifiers in ``main v1.1.py`` only see the nine metadata columns. Here
+the review text itself becomes features: word and bigram counts hashed into
+``n_features`` columns (``HashingVectorizer``, so there is no vocabulary to
+build, store or keep in sync between chunks), optionally TF-IDF weighted,
+with the standardized metadata columns appended. Everything stays a CSR
+matrix and is produced one chunk of reviews at a time, hashed in parallel
+worker processes.
+
+``train_text_classifier`` feeds those chunks to an ``SGDClassifier`` with
+``partial_fit``, so a whole catalog can be modelled in bounded memory and
+without a transformer:
+
+    batches = lambda: (results.read_part(part, ['text', *METADATA_FEATURES, 'sentiment_score'])
+                       for part in results.parts())
+    with TextFeaturizer() as featurizer:
+        model, metrics = train_text_classifier(batches, featurizer, label=lambda df: binary_labels(df['sentiment_score']))
+
+The first pass over the data only counts document frequencies and the
+metadata means and variances; the following ``epochs`` passes train. A fixed
+share of the reviews, picked by a hash of their text, is held out of every
+pass and scored at the end.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .features import METADATA_FEATURES
+from .inference import ordered_map
+
+N_FEATURES = 2 ** 20
+
+_worker = {}
+
+
+def hashing_vectorizer(n_features=N_FEATURES, ngram_range=(1, 2)):
+    """Stateless raw-count vectorizer; TF-IDF weighting and normalisation are applied afterwards."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(n_features=n_features, ngram_range=ngram_range, alternate_sign=False, norm=None,
+                             dtype=np.float32)
+
+
+def _init_worker(n_features, ngram_range):
+    _worker['vectorizer'] = hashing_vectorizer(n_features, ngram_range)
+
+
+def _hash_chunk(texts):
+    return _worker['vectorizer'].transform(texts)
+
+
+class TextFeaturizer:
+    """Turns review frames (``text`` plus ``metadata`` columns) into CSR feature matrices.
+
+    ``partial_fit`` accumulates the document frequencies of the hashed
+    n-grams and the metadata means and variances over a stream of frames;
+    ``transform`` then weights the counts by inverse document frequency
+    (smoothed, as ``TfidfTransformer`` does), L2-normalises each row and
+    appends the standardized metadata. With ``tfidf=False`` the raw counts
+    are kept. Texts are hashed on ``processes`` workers (default: every
+    core) in ``chunk_rows`` pieces; use it as a context manager, or call
+    ``close``, to stop them.
+    """
+
+    def __init__(self, n_features=N_FEATURES, ngram_range=(1, 2), tfidf=True, metadata=METADATA_FEATURES,
+                 processes=None, chunk_rows=10_000):
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.tfidf = tfidf
+        self.metadata = list(metadata)
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_rows = chunk_rows
+        self.n_docs = 0
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.meta_mean = np.zeros(len(self.metadata))
+        self.meta_m2 = np.zeros(len(self.metadata))
+        self._vectorizer = None
+        self._executor = None
+
+    def counts(self, texts):
+        """Hashed n-gram counts of ``texts`` as a CSR matrix."""
+        import scipy.sparse as sp
+
+        texts = pd.Series(texts, dtype=object).fillna('').tolist()
+        if self.processes == 1 or len(texts) <= self.chunk_rows:
+            if self._vectorizer is None:
+                self._vectorizer = hashing_vectorizer(self.n_features, self.ngram_range)
+            return self._vectorizer.transform(texts)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.n_features, self.ngram_range),
+            )
+        chunks = (texts[start:start + self.chunk_rows] for start in range(0, len(texts), self.chunk_rows))
+        return sp.vstack(list(ordered_map(self._executor, _hash_chunk, chunks, 2 * self.processes)), format='csr')
+
+    def partial_fit(self, df, counts=None):
+        """Add ``df``'s rows to the document frequencies and metadata moments; returns their counts."""
+        counts = self.counts(df['text']) if counts is None else counts
+        counts.sum_duplicates()
+        self.doc_freq += np.bincount(counts.indices, minlength=self.n_features)
+        if self.metadata and len(df):
+            # Chan et al.'s pairwise update, so the moments do not depend on how the stream is chunked.
+            values = df[self.metadata].to_numpy(dtype=np.float64)
+            n, mean = len(values), values.mean(axis=0)
+            delta = mean - self.meta_mean
+            total = self.n_docs + n
+            self.meta_m2 += ((values - mean) ** 2).sum(axis=0) + delta ** 2 * self.n_docs * n / total
+            self.meta_mean += delta * n / total
+        self.n_docs += counts.shape[0]
+        return counts
+
+    def idf(self):
+        return (np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1).astype(np.float32)
+
+    def transform(self, df, counts=None):
+        """CSR features of ``df``: weighted n-gram columns followed by the standardized metadata."""
+        import scipy.sparse as sp
+        from sklearn.preprocessing import normalize
+
+        X = self.counts(df['text']) if counts is None else counts.astype(np.float32, copy=True)
+        if self.tfidf:
+            X.data *= self.idf()[X.indices]
+            X = normalize(X, copy=False)
+        if not self.metadata:
+            return X
+        std = np.sqrt(self.meta_m2 / max(1, self.n_docs - 1))
+        scaled = (df[self.metadata].to_numpy(dtype=np.float64) - self.meta_mean) / np.where(std > 0, std, 1.0)
+        return sp.hstack([X, sp.csr_matrix(scaled.astype(np.float32))], format='csr')
+
+    def save(self, path):
+        """Write the settings, document frequencies and metadata moments to ``path`` (npz)."""
+        np.savez(path, n_features=self.n_features, ngram_range=self.ngram_range, tfidf=self.tfidf,
+                 metadata=np.array(self.metadata, dtype=str), n_docs=self.n_docs, doc_freq=self.doc_freq,
+                 meta_mean=self.meta_mean, meta_m2=self.meta_m2)
+
+    @classmethod
+    def load(cls, path, processes=None, chunk_rows=10_000):
+        with np.load(path) as data:
+            featurizer = cls(int(data['n_features']), tuple(data['ngram_range']), bool(data['tfidf']),
+                             data['metadata'].tolist(), processes, chunk_rows)
+            featurizer.n_docs = int(data['n_docs'])
+            featurizer.doc_freq = data['doc_freq']
+            featurizer.meta_mean = data['meta_mean']
+            featurizer.meta_m2 = data['meta_m2']
+        return featurizer
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def holdout_mask(texts, fraction=0.2, seed=0):
+    """True for the ``fraction`` of reviews held out for testing, decided by a hash of each text.
+
+    The same review lands on the same side in every pass and every run,
+    however the stream is chunked.
+    """
+    hashes = pd.util.hash_pandas_object(pd.Series(texts, dtype=object).fillna(''), index=False,
+                                        hash_key=f'{seed:016d}').to_numpy()
+    return (hashes % 10_000) < fraction * 10_000
+
+
+def fit_featurizer(batches, featurizer, test_fraction=0.2, seed=0, progress=None):
+    """Run ``featurizer.partial_fit`` over the training rows of ``batches()`` (see ``holdout_mask``)."""
+    progress = progress or (lambda it, **kwargs: it)
+    for df in progress(batches(), desc='Document frequencies'):
+        featurizer.partial_fit(df[~holdout_mask(df['text'], test_fraction, seed)])
+    return featurizer
+
+
+def train_text_classifier(batches, featurizer, label, classes=(0, 1), epochs=2, minibatch_rows=5_000,
+                          test_fraction=0.2, seed=0, progress=None, **sgd_kwargs):
+    """Fit an ``SGDClassifier`` on ``featurizer``'s features of a stream of review frames.
+
+    ``batches`` is a zero-argument callable returning a fresh iterable of
+    frames (it is called ``epochs + 2`` times, one fewer when ``featurizer``
+    was already fitted, e.g. loaded with ``TextFeaturizer.load``), and
+    ``label`` maps a frame to its class array. Each frame's training rows are shuffled and fed to
+    ``partial_fit`` in ``minibatch_rows`` slices. ``sgd_kwargs`` go to
+    ``SGDClassifier`` (default: logistic loss, ``alpha=1e-6``).
+
+    Returns ``(model, metrics)``; ``metrics`` holds the holdout accuracy,
+    AUC (one-vs-rest for more than two classes), confusion matrix, and the
+    training rows seen and seconds per epoch.
+    """
+    import time
+
+    from sklearn.linear_model import SGDClassifier
+
+    progress = progress or (lambda it, **kwargs: it)
+    classes = np.asarray(classes)
+    rng = np.random.default_rng(seed)
+    if not featurizer.n_docs:
+        fit_featurizer(batches, featurizer, test_fraction, seed, progress)
+
+    model = SGDClassifier(**{'loss': 'log_loss', 'alpha': 1e-6, 'random_state': seed, **sgd_kwargs})
+    epochs_log = []
+    for epoch in range(epochs):
+        start, rows = time.perf_counter(), 0
+        for df in progress(batches(), desc=f'Epoch {epoch + 1}'):
+            train = df[~holdout_mask(df['text'], test_fraction, seed)]
+            if not len(train):
+                continue
+            X, y = featurizer.transform(train), np.asarray(label(train))
+            order = rng.permutation(len(y))
+            for offset in range(0, len(y), minibatch_rows):
+                rows_slice = order[offset:offset + minibatch_rows]
+                model.partial_fit(X[rows_slice], y[rows_slice], classes=classes)
+            rows += len(y)
+        epochs_log.append({'epoch': epoch + 1, 'rows': rows, 'seconds': time.perf_counter() - start})
+    metrics = evaluate_text_classifier(model, featurizer, batches, label, test_fraction, seed, progress)
+    metrics['epochs'] = epochs_log
+    return model, metrics
+
+
+def evaluate_text_classifier(model, featurizer, batches, label, test_fraction=0.2, seed=0, progress=None):
+    """Accuracy, AUC and confusion matrix of ``model`` on the held-out rows of ``batches``."""
+    from sklearn.metrics import accuracy_score, confusion_matrix, roc_auc_score
+
+    progress = progress or (lambda it, **kwargs: it)
+    probabilities, labels = [], []
+    for df in progress(batches(), desc='Holdout'):
+        test = df[holdout_mask(df['text'], test_fraction, seed)]
+        if len(test):
+            probabilities.append(model.predict_proba(featurizer.transform(test)))
+            labels.append(np.asarray(label(test)))
+    proba, y = np.concatenate(probabilities), np.concatenate(labels)
+    y_pred = model.classes_[proba.argmax(axis=1)]
+    if proba.shape[1] == 2:
+        auc = roc_auc_score(y, proba[:, 1])
+    else:
+        auc = roc_auc_score(y, proba, multi_class='ovr', labels=model.classes_)
+    return {'rows': len(y), 'accuracy': accuracy_score(y, y_pred), 'auc': auc,
+            'confusion_matrix': confusion_matrix(y, y_pred, labels=model.classes_),
+            'y_true': y, 'y_proba': proba}
@@ -0,0 +1,61 @@
+"""VADER scoring across a process pool.
+
+``SentimentIntensityAnalyzer.polarity_scores`` is pure Python, so a single
+list comprehension leaves every core but one idle. ``VaderPool`` shards the
+texts into chunks and scores them in worker processes, each holding one
+analyzer built once at startup, and streams the chunk results back in order.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .inference import ordered_map
+
+_worker = {}
+
+
+def _init_worker():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+    _worker['analyzer'] = SentimentIntensityAnalyzer()
+
+
+def _score_chunk(texts):
+    analyzer = _worker['analyzer']
+    return np.array([analyzer.polarity_scores(text)['compound'] for text in texts], dtype=np.float32)
+
+
+class VaderPool:
+    """Context manager scoring lists of texts with VADER on ``processes`` workers."""
+
+    def __init__(self, processes=None, chunk_size=2000, max_in_flight=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight or 2 * self.processes
+        self._executor = None
+
+    def __enter__(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+        )
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown(cancel_futures=True)
+        self._executor = None
+
+    def map(self, texts):
+        """Yield one score array per ``chunk_size`` texts, in order."""
+        chunks = (texts[start:start + self.chunk_size] for start in range(0, len(texts), self.chunk_size))
+        return ordered_map(self._executor, _score_chunk, chunks, self.max_in_flight)
+
+    def __call__(self, texts):
+        texts = list(texts)
+        if not texts:
+            return np.empty(0, dtype=np.float32)
+        return np.concatenate(list(self.map(texts)))
@@ -0,0 +1,149 @@
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from review_sentiment import batchrun, ingest
+from review_sentiment.benchmark import synthetic_reviews
+from review_sentiment.cli import PANEL_REGRESSORS
+from review_sentiment.cube import AnalysisCube, summarize_store
+from review_sentiment.panel import PanelMoments, fit_panel_store
+from review_sentiment.store import ResultsStore
+
+
+def length_scorer(texts):
+    return np.array([np.tanh((len(text) % 17 - 8) / 4) for text in texts], dtype=np.float32)
+
+
+class Scorer:
+    def __init__(self, fail_calls=()):
+        self.calls = 0
+        self.fail_calls = fail_calls
+
+    def __call__(self, texts):
+        self.calls += 1
+        if self.calls in self.fail_calls:
+            raise RuntimeError('scorer crashed')
+        return length_scorer(texts)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sources(tmp_path):
+    beauty, books = tmp_path / 'data' / 'beauty', tmp_path / 'data' / 'books'
+    beauty.mkdir(parents=True)
+    books.mkdir(parents=True)
+    df = synthetic_reviews(2_300, seed=1).drop(columns=['sentiment_score'])
+    pq.write_table(pa.Table.from_pandas(df.iloc[:1_300], preserve_index=False), beauty / 'a.parquet',
+                   row_group_size=300)
+    df.iloc[1_300:].to_json(beauty / 'b.jsonl', orient='records', lines=True)
+    other = synthetic_reviews(700, seed=2).drop(columns=['sentiment_score'])
+    table = pa.Table.from_pandas(other, preserve_index=False)
+    with pa.OSFile(str(books / 'c.arrow'), 'wb') as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=100):
+            writer.write_batch(batch)
+    return {'Beauty': ([str(beauty)], df), 'Books': ([str(books / '*.arrow')], other)}
+
+
+def plan(root, sources, **kwargs):
+    return batchrun.plan_run(str(root), {category: paths for category, (paths, _) in sources.items()},
+                             models=['distilbert'], shard_rows=500, batch_rows=200, log=lambda message: None,
+                             **kwargs)
+
+
+def test_shard_ranges_cover_every_row_once():
+    shards = batchrun.shard_ranges([['a', 7], ['b', 0], ['c', 5]], 4)
+    assert [(s['start'], s['stop']) for s in shards] == [(0, 4), (4, 8), (8, 12)]
+    assert shards[1]['sources'] == [['a', 4, 7], ['c', 0, 1]]
+
+
+def test_read_rows_matches_the_source_rows(sources):
+    paths, df = sources['Beauty']
+    files = [[path, batchrun.count_rows(path)] for path in ingest.expand_shards(paths)]
+    shard = batchrun.shard_ranges(files, 1_000)[1]
+    rows = list(batchrun.read_rows(shard['sources'], batch_rows=128))
+    assert [row for chunk in rows for row in chunk['text']] == df['text'].iloc[1_000:2_000].tolist()
+
+
+def test_run_merges_shards_into_category_results(tmp_path, sources, monkeypatch):
+    monkeypatch.setattr(ingest, 'build_scorers', lambda models, **kwargs: {'sentiment_score': Scorer()})
+    root = tmp_path / 'run'
+    plan(root, sources)
+    assert batchrun.run_worker(str(root), poll_seconds=0.01, log=lambda message: None) == 9
+    for category, (_, df) in sources.items():
+        store = ResultsStore(str(root / 'results' / category / 'store'))
+        stored = store.read(columns=['text', 'sentiment_score'])
+        assert stored['text'].tolist() == df['text'].tolist()
+        np.testing.assert_allclose(stored['sentiment_score'], length_scorer(df['text']))
+
+        direct = fit_panel_store(store, PANEL_REGRESSORS, standardize=True, processes=1)
+        merged = PanelMoments.load(str(root / 'results' / category / 'panel_moments.npz'))
+        np.testing.assert_allclose(merged.zz, direct['moments'].zz)
+        np.testing.assert_allclose(merged.fit()['fixed_effects'].params, direct['fixed_effects'].params)
+
+        cube = AnalysisCube.load(str(root / 'results' / category / 'sentiment_cube.parquet'))
+        expected = summarize_store(store, scores=['sentiment_score'])['cube']
+        np.testing.assert_allclose(cube.rollup('month', 'sentiment_score').to_numpy(),
+                                   expected.rollup('month', 'sentiment_score').to_numpy())
+
+
+def test_expired_lease_is_taken_over(tmp_path, sources):
+    root = tmp_path / 'run'
+    plan(root, sources, lease_seconds=0.2)
+    queue = batchrun.WorkQueue(str(root), lease_seconds=0.2, max_attempts=3)
+    task_id, _, token = queue.claim('dead-host:1')
+    time.sleep(0.3)
+    claimed = [queue.claim('live-host:1') for _ in range(8)]
+    again = [c for c in claimed if c and c[0] == task_id]
+    assert len(again) == 1 and again[0][1]['attempts'] == 2
+    assert queue.tasks()[task_id]['errors'] == ['lease of dead-host:1 expired']
+    # The worker that lost its lease can neither renew nor complete it.
+    assert not queue.renew(task_id, token)
+    assert not queue.complete(task_id, token)
+
+
+def test_failed_attempt_is_retried(tmp_path, sources, monkeypatch):
+    monkeypatch.setattr(ingest, 'build_scorers', lambda models, **kwargs: {'sentiment_score': Scorer(fail_calls=(1,))})
+    root = tmp_path / 'run'
+    plan(root, sources)
+    batchrun.run_worker(str(root), poll_seconds=0.01, log=lambda message: None)
+    tasks = batchrun.WorkQueue(str(root)).tasks()
+    retried = [task for task in tasks.values() if task['errors']]
+    assert len(retried) == 1 and retried[0]['attempts'] == 2 and retried[0]['status'] == 'done'
+    assert all(task['status'] == 'done' for task in tasks.values())
+
+
+def test_permanent_failure_fails_the_merge_and_workers_exit(tmp_path, sources, monkeypatch):
+    monkeypatch.setattr(ingest, 'build_scorers', lambda models, **kwargs: {'sentiment_score': Scorer(fail_calls=(1,))})
+    root = tmp_path / 'run'
+    plan(root, sources, max_attempts=1)
+    batchrun.run_worker(str(root), poll_seconds=0.01, log=lambda message: None)
+    summary, errors = batchrun.status(str(root))
+    failed_shard = next(task_id for task_id in errors if not task_id.endswith('/merge'))
+    failed_category = failed_shard.split('/')[0]
+    assert summary[failed_category]['failed'] == 2 and summary[failed_category]['pending'] == 0
+    assert errors[f'{failed_category}/merge'] == [f'required task {failed_shard} failed']
+    other = 'Books' if failed_category == 'Beauty' else 'Beauty'
+    assert os.path.isdir(root / 'results' / other / 'store')
+
+
+def test_error_moving_the_result_into_place_fails_the_attempt(tmp_path, sources, monkeypatch):
+    monkeypatch.setattr(ingest, 'build_scorers', lambda models, **kwargs: {'sentiment_score': Scorer()})
+
+    def broken(attempt, final):
+        def commit():
+            raise OSError('read-only filesystem')
+        return commit
+
+    monkeypatch.setattr(batchrun, '_move_into_place', broken)
+    root = tmp_path / 'run'
+    plan(root, sources, max_attempts=2)
+    assert batchrun.run_worker(str(root), poll_seconds=0.01, log=lambda message: None) == 0
+    tasks = batchrun.WorkQueue(str(root)).tasks()
+    assert {task['status'] for task in tasks.values()} == {'failed'}
+    assert not [name for name in os.listdir(root / 'shards' / 'Books') if '.attempt-' in name]
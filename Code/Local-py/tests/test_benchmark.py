@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from review_sentiment import benchmark
+
+
+def _bench_ok(df, workdir):
+    return lambda: df['review_length'].sum()
+
+
+def _bench_broken(df, workdir):
+    def run():
+        raise ValueError('bad input')
+    return run
+
+
+def _bench_missing(df, workdir):
+    import not_an_installed_module  # noqa: F401
+
+
+@pytest.fixture
+def benchmarks(monkeypatch):
+    monkeypatch.setattr(benchmark, 'BENCHMARKS', {'broken': (None, _bench_broken), 'missing': (None, _bench_missing),
+                                                  'ok': (None, _bench_ok), 'capped': (10, _bench_ok)})
+
+
+def test_a_failing_case_is_recorded_and_the_suite_goes_on(benchmarks):
+    results = benchmark.run_benchmarks(sizes=[50], repeat=2, log=lambda message: None)
+    by_name = {result['benchmark']: result for result in results}
+    assert by_name['broken']['failed'] == 'ValueError: bad input'
+    assert by_name['missing']['skipped'] == 'missing dependency: not_an_installed_module'
+    assert by_name['capped']['skipped'] == 'above the 10-row cap'
+    assert by_name['ok']['median_s'] >= 0 and by_name['ok']['repeat'] == 2
+
+
+def test_results_are_written_before_failing_the_run(benchmarks, tmp_path):
+    output = tmp_path / 'run.json'
+    with pytest.raises(SystemExit) as exit_info:
+        benchmark.main(['--sizes', '50', '--repeat', '1', '--output', str(output)])
+    assert exit_info.value.code == 1
+    results = json.loads(output.read_text())['results']
+    assert [result['benchmark'] for result in results] == ['broken', 'missing', 'ok', 'capped']
+
+
+def test_compare_flags_slowdowns_beyond_the_tolerance():
+    baseline = {'results': [{'benchmark': 'ok', 'rows': 50, 'lengths': 'amazon', 'median_s': 1.0},
+                            {'benchmark': 'broken', 'rows': 50, 'lengths': 'amazon', 'failed': 'ValueError: x'}]}
+    results = [{'benchmark': 'ok', 'rows': 50, 'lengths': 'amazon', 'median_s': 1.5},
+               {'benchmark': 'broken', 'rows': 50, 'lengths': 'amazon', 'median_s': 9.0}]
+    (regression,) = benchmark.compare(results, baseline, tolerance=0.2)
+    assert regression['benchmark'] == 'ok' and regression['slowdown'] == pytest.approx(1.5)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from review_sentiment.boosting import parameter_grid
+
+
+def test_parameter_grid_covers_every_combination():
+    grid = parameter_grid({'max_depth': [4, 6], 'learning_rate': [0.05, 0.1, 0.2]})
+    assert len(grid) == 6
+    assert {'max_depth': 6, 'learning_rate': 0.2} in grid
+    assert parameter_grid({}) == [{}]
+
+
+def test_cross_validation_picks_a_grid_point_and_refits():
+    pytest.importorskip('xgboost')
+    from review_sentiment.boosting import cross_validate_xgboost, train_best_xgboost
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 4))
+    y = (X[:, 0] + 0.5 * X[:, 1] + 0.3 * rng.normal(size=400) > 0).astype(int)
+    cv = cross_validate_xgboost(X, y, grid={'max_depth': [2, 3]}, n_splits=3, num_boost_round=50,
+                                early_stopping_rounds=5, cores=2, log=lambda message: None)
+    assert len(cv['folds']) == 6 and len(cv['summary']) == 2
+    assert cv['summary']['mean_auc'].is_monotonic_decreasing
+    assert cv['best_params'] in parameter_grid({'max_depth': [2, 3]})
+    assert (cv['folds']['best_iteration'] < cv['folds']['rounds']).all()
+    model = train_best_xgboost(X, y, cv, cores=1)
+    assert model.n_estimators == cv['best_rounds']
+    assert model.predict_proba(X).shape == (400, 2)
@@ -0,0 +1,39 @@
+import numpy as np
+
+from review_sentiment.cache import ScoreCache, cached_scores, model_key
+
+
+class CountingScorer:
+    def __init__(self):
+        self.seen = []
+
+    def __call__(self, texts):
+        self.seen.extend(texts)
+        return np.array([len(text) / 10 for text in texts], dtype=np.float32)
+
+
+def test_only_distinct_uncached_texts_reach_the_model(tmp_path):
+    key = model_key('some/model')
+    scorer = CountingScorer()
+    with ScoreCache(str(tmp_path / 'cache.sqlite')) as cache:
+        first = cached_scores(['good', 'bad', 'good'], key, cache, scorer)
+        second = cached_scores(['bad', 'great', 'good'], key, cache, scorer)
+        assert scorer.seen == ['good', 'bad', 'great']
+        np.testing.assert_allclose(first, [0.4, 0.3, 0.4])
+        np.testing.assert_allclose(second, [0.3, 0.5, 0.4])
+        assert cache.stats == {'rows': 6, 'unique': 5, 'hits': 2, 'misses': 3}
+        assert cache.hit_rate() == 2 / 5
+
+
+def test_scores_survive_a_reopen_and_stay_per_model_key(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    with ScoreCache(path) as cache:
+        cached_scores(['good'], model_key('some/model'), cache, CountingScorer())
+    scorer = CountingScorer()
+    with ScoreCache(path) as cache:
+        cached_scores(['good'], model_key('some/model'), cache, scorer)
+        assert scorer.seen == []
+        cached_scores(['good'], model_key('some/model', max_length=128), cache, scorer)
+        cached_scores(['good'], model_key('some/model', backend='onnx'), cache, scorer)
+        assert scorer.seen == ['good', 'good']
+    assert model_key('some/model') == 'some/model|max_length=512|truncation=head'
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from review_sentiment.benchmark import synthetic_reviews
+from review_sentiment.checkpoint import checkpointed_scores
+from review_sentiment.ingest import stream_pipeline
+from review_sentiment.store import ResultsStore
+
+
+class FlakyScorer:
+    """Scores texts by length and raises on call number ``fail_on`` (1-based), like a crash mid-run."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = 0
+        self.rows = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError('simulated crash')
+        self.rows += len(texts)
+        return np.array([len(text) / 1000 for text in texts], dtype=np.float32)
+
+
+def test_resume_scores_only_the_unfinished_ranges(tmp_path):
+    texts = synthetic_reviews(95, seed=0)['text'].tolist()
+    directory = str(tmp_path / 'checkpoint')
+    with pytest.raises(RuntimeError):
+        checkpointed_scores({'sentiment_score': FlakyScorer(fail_on=3)}, texts, directory, chunk_rows=20)
+    resumed = FlakyScorer()
+    scores = checkpointed_scores({'sentiment_score': resumed}, texts, directory, chunk_rows=20)
+    assert resumed.rows == 95 - 40
+    np.testing.assert_array_equal(scores['sentiment_score'],
+                                  checkpointed_scores({'sentiment_score': FlakyScorer()}, texts,
+                                                      str(tmp_path / 'fresh'), chunk_rows=20)['sentiment_score'])
+
+
+def test_checkpoint_of_another_job_is_refused(tmp_path):
+    directory = str(tmp_path / 'checkpoint')
+    checkpointed_scores({'sentiment_score': FlakyScorer()}, ['a', 'b', 'c'], directory, chunk_rows=2)
+    with pytest.raises(ValueError, match='different job'):
+        checkpointed_scores({'sentiment_score': FlakyScorer()}, ['a', 'b', 'd'], directory, chunk_rows=2)
+    restarted = FlakyScorer()
+    checkpointed_scores({'sentiment_score': restarted}, ['a', 'b', 'd'], directory, chunk_rows=2, restart=True)
+    assert restarted.rows == 3
+
+
+def test_resumed_stream_writes_every_review_once(tmp_path):
+    shard = tmp_path / 'reviews.jsonl'
+    source = synthetic_reviews(70, seed=1).drop(columns=['sentiment_score'])
+    source.to_json(shard, orient='records', lines=True)
+    store = ResultsStore(str(tmp_path / 'store'))
+    with pytest.raises(RuntimeError):
+        stream_pipeline([str(shard)], store, {'sentiment_score': FlakyScorer(fail_on=3)}, batch_rows=25)
+    assert len(store) == 50
+    resumed = FlakyScorer()
+    assert stream_pipeline([str(shard)], store, {'sentiment_score': resumed}, batch_rows=25, resume=True) == 20
+    assert resumed.rows == 20
+    assert len(store) == 70
+    assert store.read(columns=['text'])['text'].tolist() == source['text'].tolist()
+
+
+def test_finished_job_with_cleanup_lets_the_next_job_start(tmp_path):
+    directory = str(tmp_path / 'checkpoint')
+    checkpointed_scores({'sentiment_score': FlakyScorer()}, ['a', 'b', 'c'], directory, chunk_rows=2, cleanup=True)
+    assert not os.path.exists(directory)
+    scorer = FlakyScorer()
+    scores = checkpointed_scores({'sentiment_score': scorer}, ['dd', 'eee'], directory, chunk_rows=2, cleanup=True)
+    assert scorer.rows == 2
+    np.testing.assert_allclose(scores['sentiment_score'], [0.002, 0.003])
@@ -0,0 +1,26 @@
+import numpy as np
+
+from review_sentiment.convergence import convergence_study
+
+
+def three_class_data(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 4))
+    y = np.digitize(X @ np.array([1.0, -0.5, 0.3, 0.0]) + 0.5 * rng.normal(size=n), [-0.5, 0.5])
+    return X[:200], y[:200], X[200:], y[200:]
+
+
+def test_one_row_per_checkpoint_within_the_iteration_budget():
+    checkpoints = [50, 1, 5, 20]
+    history, model = convergence_study(*three_class_data(), checkpoints, solver='lbfgs')
+    assert history['max_iter'].tolist() == sorted(checkpoints)
+    assert history['iterations_run'].is_monotonic_increasing
+    assert history['iterations_run'].iloc[-1] <= max(checkpoints)
+    assert list(model.classes_) == [0, 1, 2]
+    assert history['accuracy'].between(0, 1).all() and history['auc'].between(0, 1).all()
+
+
+def test_binary_targets_use_the_positive_class_auc():
+    X_train, y_train, X_test, y_test = three_class_data(seed=1)
+    history, _ = convergence_study(X_train, y_train > 0, X_test, y_test > 0, [10, 100])
+    assert len(history) == 2 and history['auc'].iloc[-1] > 0.5
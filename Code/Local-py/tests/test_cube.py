@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from review_sentiment.benchmark import synthetic_reviews
+from review_sentiment.cube import AnalysisCube, summarize_store
+from review_sentiment.features import add_review_features
+from review_sentiment.store import ResultsStore
+
+
+def scored(n, seed=0):
+    return add_review_features(synthetic_reviews(n, seed=seed))
+
+
+def test_rollup_matches_a_groupby_over_the_rows():
+    df = scored(300)
+    df.loc[::7, 'sentiment_score'] = np.nan
+    cube = AnalysisCube(scores=['sentiment_score'])
+    for start in range(0, len(df), 64):
+        cube.add(df.iloc[start:start + 64])
+    trend = cube.rollup('month', 'sentiment_score')
+    expected = df.groupby('month')['sentiment_score'].agg(['count', 'mean', 'var'])
+    assert (trend['count'] == expected['count']).all()
+    np.testing.assert_allclose(trend['mean'], expected['mean'])
+    np.testing.assert_allclose(trend['var'], expected['var'])
+
+
+def test_merged_shard_cubes_equal_one_cube():
+    df = scored(200)
+    whole = AnalysisCube(scores=['sentiment_score']).add(df)
+    merged = AnalysisCube(scores=['sentiment_score']).add(df.iloc[:90]).merge(
+        AnalysisCube(scores=['sentiment_score']).add(df.iloc[90:]))
+    np.testing.assert_allclose(merged.rollup('year', 'sentiment_score'), whole.rollup('year', 'sentiment_score'))
+
+
+def test_empty_cube_refuses_to_roll_up():
+    with pytest.raises(ValueError, match='empty'):
+        AnalysisCube().rollup('year', 'sentiment_score')
+
+
+def test_default_histograms_use_an_available_score(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    store.write(scored(120))
+    summary = summarize_store(store)
+    assert summary['histogram_score'] == 'sentiment_score'
+    assert summary['score'].counts.sum() == 120
+    assert summary['cube'].scores == ['sentiment_score']
+
+
+def test_histograms_missing_columns_are_skipped_with_a_warning(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    store.write(scored(50).drop(columns=['helpful_vote']))
+    with pytest.warns(UserWarning, match='year_score_votes'):
+        summary = summarize_store(store)
+    assert 'year_score_votes' not in summary and 'score' in summary
+
+
+def test_empty_store_raises(tmp_path):
+    with pytest.raises(ValueError, match='empty'):
+        summarize_store(ResultsStore(str(tmp_path / 'store')))
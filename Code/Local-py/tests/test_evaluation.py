@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from sklearn.metrics import confusion_matrix, roc_auc_score
+
+from review_sentiment.evaluation import (BANDS, bootstrap_auc_accuracy, evaluate_scores, rating_classes,
+                                         report, _tie_groups)
+from review_sentiment.features import sentiment_labels
+
+
+def rated_scores(n=400, seed=0):
+    """Scores rounded to 0.05 (so many ties, some exactly on a band edge) with NaNs, and star ratings."""
+    rng = np.random.default_rng(seed)
+    ratings = rng.integers(1, 6, n)
+    scores = np.round(np.clip((ratings - 3) / 3 + rng.normal(scale=0.5, size=n), -1, 1) / 0.05) * 0.05
+    scores[rng.random(n) < 0.1] = np.nan
+    return scores, ratings
+
+
+def test_auc_and_accuracy_match_sklearn_with_ties_and_nans():
+    scores, ratings = rated_scores()
+    truth = rating_classes(ratings)
+    result = evaluate_scores({'model': scores}, truth, n_bootstrap=50)['model']
+    keep = ~np.isnan(scores) & (truth != 1)
+    assert result['rows'] == int((~np.isnan(scores)).sum()) and result['binary_rows'] == int(keep.sum())
+    assert result['auc'] == pytest.approx(roc_auc_score(truth[keep] == 2, scores[keep]))
+    assert result['accuracy'] == pytest.approx(np.mean((scores[keep] > 0) == (truth[keep] == 2)))
+    fpr, tpr, thresholds = result['roc']
+    assert fpr[0] == tpr[0] == 0 and fpr[-1] == tpr[-1] == 1 and np.isinf(thresholds[0])
+    assert result['auc_ci'][0] <= result['auc'] <= result['auc_ci'][1]
+
+
+def test_band_confusion_matches_relabelling_per_band():
+    scores, ratings = rated_scores(seed=1)
+    truth = rating_classes(ratings)
+    result = evaluate_scores({'model': scores}, truth, n_bootstrap=10)['model']
+    valid = ~np.isnan(scores)
+    for band, confusion in zip(BANDS, result['band_confusion']):
+        expected = confusion_matrix(truth[valid], sentiment_labels(scores[valid], band), labels=[0, 1, 2])
+        np.testing.assert_array_equal(confusion, expected)
+    np.testing.assert_allclose(result['band_accuracy'], np.trace(result['band_confusion'], axis1=1, axis2=2) / valid.sum())
+
+
+def test_bootstrap_replicates_are_weighted_aucs():
+    scores, ratings = rated_scores(n=60, seed=2)
+    keep = ~np.isnan(scores) & (ratings != 3)
+    order = np.argsort(scores[keep], kind='stable')
+    sorted_scores, positive = scores[keep][order], ratings[keep][order] >= 4
+    aucs, accuracies = bootstrap_auc_accuracy(sorted_scores, positive, _tie_groups(sorted_scores), n_bootstrap=5, seed=3)
+    weights = np.random.default_rng(3).poisson(1.0, size=(5, len(sorted_scores)))
+    for auc, accuracy, weight in zip(aucs, accuracies, weights):
+        assert auc == pytest.approx(roc_auc_score(positive, sorted_scores, sample_weight=weight), rel=1e-6)
+        assert accuracy == pytest.approx(np.average((sorted_scores > 0) == positive, weights=weight), rel=1e-6)
+
+
+@pytest.mark.parametrize('scores, truth', [
+    (np.array([.1, .2]), np.array([1, 1])),               # only neutral (3-star) references
+    (np.array([np.nan, np.nan, np.nan]), np.array([0, 1, 2])),  # no scores at all
+    (np.array([.1, -.2, .4]), np.array([2, 2, 1])),        # no negative references
+])
+def test_missing_classes_give_nan_instead_of_crashing(scores, truth):
+    result = evaluate_scores({'a': scores}, truth, n_bootstrap=5)['a']
+    assert np.isnan(result['auc']) and np.isnan(result['auc_ci']).all()
+    assert all(len(values) == 0 for values in result['roc'])
+    assert len(report({'a': result})) == 1
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from review_sentiment.features import add_interaction_features, add_review_features, binary_labels, sentiment_labels
+
+
+def raw_reviews():
+    """Hand-built rows covering the empty, missing and array-valued inputs of the Hugging Face and Arrow readers."""
+    return pd.DataFrame({
+        'text': ['Great product!', '', 'meh', 'Broke after two days, would not buy again'],
+        'rating': [5.0, 3.0, 2.0, 1.0],
+        'images': [[], None, np.array([{'url': 'a'}, {'url': 'b'}], dtype=object), [{'url': 'c'}]],
+        'helpful_vote': [3, np.nan, 0, 12],
+        'verified_purchase': [True, None, False, True],
+        # 2019-12-31 23:59:59.999 (Tuesday), 2020-02-29 12:00 (Saturday), the epoch (Thursday), 2023-07-04 (Tuesday).
+        'timestamp': [1577836799999, 1582977600000, 0, 1688428800000],
+    })
+
+
+def test_features_match_the_row_wise_formulas():
+    raw = raw_reviews()
+    # The original script's per-row formulas; ``if x`` is ambiguous for numpy arrays, hence ``len``.
+    expected = pd.DataFrame({
+        'review_length': raw['text'].apply(len),
+        'helpful_vote': raw['helpful_vote'].fillna(0),
+        'verified_purchase': raw['verified_purchase'].apply(lambda x: 1 if x else 0),
+        'has_images': raw['images'].apply(lambda x: 1 if x is not None and len(x) else 0),
+    })
+    timestamp = pd.to_datetime(raw['timestamp'], unit='ms')
+    for part in ('year', 'month', 'day', 'weekday'):
+        expected[part] = getattr(timestamp.dt, part)
+
+    out = add_review_features(raw.copy())
+    for column in expected:
+        assert out[column].tolist() == expected[column].tolist(), column
+    assert out['year'].tolist() == [2019, 2020, 1970, 2023]
+    assert out['weekday'].tolist() == [1, 5, 3, 1]
+    assert (out['timestamp'] == timestamp).all()
+    assert out.dtypes[['review_length', 'helpful_vote', 'verified_purchase', 'has_images', 'year', 'rating']].tolist() == \
+        [np.int32, np.int32, np.int8, np.int8, np.int16, np.float32]
+
+
+def test_datetime_timestamps_are_kept():
+    raw = raw_reviews()
+    raw['timestamp'] = pd.to_datetime(raw['timestamp'], unit='ms')
+    assert add_review_features(raw)['day'].tolist() == [31, 29, 1, 4]
+
+
+def test_interaction_features():
+    df = add_review_features(raw_reviews())
+    out = add_interaction_features(df)
+    np.testing.assert_allclose(out['log_review_length'], np.log(df['review_length'] + 1), rtol=1e-6)
+    np.testing.assert_allclose(out['rating_review_length'], df['rating'] * df['review_length'])
+    assert 'log_review_length' not in df.columns
+
+
+def test_labels_at_the_thresholds():
+    def categorize_sentiment(score):
+        if score > 0.35:
+            return 2
+        elif score < -0.35:
+            return 0
+        else:
+            return 1
+
+    scores = np.array([-1.0, -0.3500001, -0.35, 0.0, 0.35, 0.3500001, 1.0], dtype=np.float64)
+    assert sentiment_labels(scores).tolist() == [categorize_sentiment(s) for s in scores] == [0, 0, 1, 1, 1, 2, 2]
+    assert sentiment_labels(scores, threshold=0).tolist() == [0, 0, 0, 1, 2, 2, 2]
+    assert binary_labels(scores).tolist() == [0, 0, 0, 0, 1, 1, 1]
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from review_sentiment.benchmark import synthetic_reviews
+from review_sentiment.features import add_review_features
+from review_sentiment.incremental import incremental_update, load_watermarks, mark_scored
+from review_sentiment.store import ResultsStore
+
+
+def reviews(n, seed=0):
+    df = synthetic_reviews(n, seed=seed).drop(columns=['sentiment_score'])
+    return df.sort_values('timestamp', ignore_index=True)
+
+
+def length_scorer(texts):
+    return np.array([len(text) / 1000 for text in texts], dtype=np.float32)
+
+
+SCORERS = {'sentiment_score': length_scorer}
+
+
+def test_second_run_over_the_same_reviews_adds_nothing(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = reviews(40)
+    first = incremental_update([df.iloc[:20], df.iloc[20:]], store, SCORERS, 'Beauty')
+    second = incremental_update([df], store, SCORERS, 'Beauty')
+    assert first['new'] == 40
+    assert second == {'seen': 40, 'new': 0, 'changed': 0, 'skipped': 40}
+    assert len(store) == 40
+    assert load_watermarks(store.root)['Beauty']['sentiment_score']['timestamp'] == df['timestamp'].max()
+
+
+def test_edited_review_replaces_the_stored_version(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = reviews(30)
+    incremental_update([df], store, SCORERS, 'Beauty')
+    edited = df.copy()
+    edited.loc[3, 'text'] = 'completely rewritten review text'
+    stats = incremental_update([edited], store, SCORERS, 'Beauty')
+    assert (stats['new'], stats['changed'], stats['skipped']) == (0, 1, 29)
+    stored = store.read(columns=['text', 'sentiment_score'])
+    assert len(stored) == 30
+    assert sorted(stored['text']) == sorted(edited['text'])
+    row = stored[stored['text'] == 'completely rewritten review text']
+    assert row['sentiment_score'].iloc[0] == pytest.approx(len('completely rewritten review text') / 1000)
+
+
+def test_rerun_after_a_crash_does_not_duplicate_appended_rows(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = reviews(15)
+    incremental_update([df.iloc[:5]], store, SCORERS, 'Beauty')
+
+    def crashing():
+        yield df.iloc[5:10]
+        raise RuntimeError('preempted')
+
+    with pytest.raises(RuntimeError):
+        incremental_update(crashing(), store, SCORERS, 'Beauty')
+    assert len(store) == 10
+    stats = incremental_update([df.iloc[5:10], df.iloc[10:]], store, SCORERS, 'Beauty')
+    assert (stats['new'], stats['skipped']) == (5, 5)
+    assert len(store) == 15
+    assert sorted(store.read(columns=['text'])['text']) == sorted(df['text'])
+
+
+def test_full_write_with_watermarks_only_checks_older_reviews(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = reviews(25)
+    scored = add_review_features(df.iloc[:20].copy())
+    scored['sentiment_score'] = length_scorer(scored['text'])
+    store.write(scored)
+    mark_scored(store, 'Beauty', SCORERS, scored['timestamp'])
+    assert load_watermarks(store.root)['Beauty']['sentiment_score'] == {
+        'timestamp': int(df['timestamp'].iloc[19]), 'rows': 20}
+    stats = incremental_update([df], store, SCORERS, 'Beauty')
+    assert (stats['new'], stats['skipped']) == (5, 20)
+    assert len(store) == 25
+
+
+def test_rows_added_without_a_model_are_backfilled_when_it_returns(tmp_path):
+    calls = []
+
+    def vader_scorer(texts):
+        calls.append(len(texts))
+        return np.full(len(texts), 0.5, dtype=np.float32)
+
+    both = {'sentiment_score': length_scorer, 'sentiment_score_vader': vader_scorer}
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = reviews(30)
+    incremental_update([df.iloc[:10]], store, both, 'Beauty')
+    incremental_update([df.iloc[:20]], store, SCORERS, 'Beauty')
+    assert store.read(columns=['sentiment_score_vader'])['sentiment_score_vader'].isna().sum() == 10
+    calls.clear()
+    stats = incremental_update([df], store, both, 'Beauty')
+    assert (stats['new'], stats['skipped']) == (10, 20)
+    # The ten rows the second run added without VADER, then the ten new ones.
+    assert calls == [10, 10]
+    out = store.read(columns=['sentiment_score', 'sentiment_score_vader'])
+    assert len(out) == 30 and not out.isna().any().any()
+    assert (out['sentiment_score_vader'] == 0.5).all()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from review_sentiment.panel import PanelAccumulator, PanelMoments, fit_panel, fit_panel_store
+from review_sentiment.store import ResultsStore
+
+linearmodels = pytest.importorskip('linearmodels')
+
+
+def panel_frame(n_users=60, seed=0):
+    rng = np.random.default_rng(seed)
+    user = np.repeat(np.arange(n_users), rng.integers(1, 8, n_users))
+    effect = rng.normal(size=n_users)[user]
+    x1 = rng.normal(size=len(user)) + 0.5 * effect
+    x2 = rng.normal(size=len(user))
+    y = 1 + 0.5 * x1 - 0.3 * x2 + effect + rng.normal(size=len(user))
+    return pd.DataFrame({'user_id': [f'u{u}' for u in user], 'x1': x1, 'x2': x2, 'sentiment_score': y})
+
+
+def reference(df, regressors):
+    from linearmodels.panel import PanelOLS, RandomEffects
+
+    panel = df.assign(t=df.groupby('user_id').cumcount()).set_index(['user_id', 't'])
+    exog = panel[regressors].assign(const=1.0)[['const'] + regressors]
+    fe = PanelOLS(panel['sentiment_score'], exog, entity_effects=True)
+    re = RandomEffects(panel['sentiment_score'], exog)
+    return {'fixed_effects': fe.fit(cov_type='clustered', cluster_entity=True),
+            'random_effects': re.fit(cov_type='clustered', cluster_entity=True)}
+
+
+def assert_matches(fits, expected):
+    for name in ('fixed_effects', 'random_effects'):
+        np.testing.assert_allclose(fits[name].params, expected[name].params, rtol=1e-8)
+        np.testing.assert_allclose(fits[name].std_errors, expected[name].std_errors, rtol=1e-6)
+
+
+def test_chunked_fit_matches_linearmodels():
+    df = panel_frame()
+    fits = fit_panel(lambda: [df.iloc[:100], df.iloc[100:]], ['x1', 'x2'], 'sentiment_score')
+    assert_matches(fits, reference(df, ['x1', 'x2']))
+    assert fits['fixed_effects'].n_entities == df['user_id'].nunique()
+
+
+def test_merged_and_reloaded_accumulators_equal_one_pass(tmp_path):
+    df = panel_frame()
+    whole = PanelAccumulator(['x1', 'x2'], 'sentiment_score').update(df)
+    first = PanelAccumulator(['x1', 'x2'], 'sentiment_score').update(df.iloc[:150])
+    second = PanelAccumulator(['x1', 'x2'], 'sentiment_score').update(df.iloc[150:])
+    second.save(tmp_path / 'second.npz')
+    merged = first.merge(PanelAccumulator.load(tmp_path / 'second.npz'))
+    assert merged.nobs == whole.nobs
+    np.testing.assert_allclose(merged.zz, whole.zz)
+    pd.testing.assert_frame_equal(merged.entity_sums().sort_index(), whole.entity_sums().sort_index())
+
+
+def test_store_fit_matches_linearmodels(tmp_path):
+    df = panel_frame(seed=1)
+    store = ResultsStore(str(tmp_path / 'store'))
+    store.write(df.iloc[:120])
+    store.append(df.iloc[120:])
+    fits = fit_panel_store(store, ['x1', 'x2'], processes=1)
+    assert_matches(fits, reference(df, ['x1', 'x2']))
+
+
+def test_cached_moments_match_unadjusted_fits_on_standardized_regressors(tmp_path):
+    import statsmodels.api as sm
+    from linearmodels.panel import PanelOLS, RandomEffects
+    from sklearn.preprocessing import StandardScaler
+
+    df = panel_frame(seed=2)
+    acc = PanelAccumulator(['x1', 'x2'], 'sentiment_score').update(df).standardized()
+    PanelMoments.from_accumulator(acc).save(tmp_path / 'moments.npz')
+    fits = PanelMoments.load(tmp_path / 'moments.npz').fit()
+
+    scaled = df.copy()
+    scaled[['x1', 'x2']] = StandardScaler().fit_transform(df[['x1', 'x2']])
+    panel = scaled.assign(t=scaled.groupby('user_id').cumcount()).set_index(['user_id', 't'])
+    exog = sm.add_constant(panel[['x1', 'x2']])
+    expected = {'fixed_effects': PanelOLS(panel['sentiment_score'], exog, entity_effects=True).fit(),
+                'random_effects': RandomEffects(panel['sentiment_score'], exog).fit(),
+                'gls': sm.GLS(panel['sentiment_score'], exog).fit()}
+    for name, result in expected.items():
+        np.testing.assert_allclose(fits[name].params, result.params, rtol=1e-8, atol=1e-12)
+        std_errors = result.std_errors if name != 'gls' else result.bse
+        np.testing.assert_allclose(fits[name].std_errors, std_errors, rtol=1e-6)
+    assert 0 <= fits['hausman']['pvalue'] <= 1
+
+
+def test_regressor_subset_equals_a_fresh_fit():
+    df = panel_frame(seed=3)
+    full = PanelMoments.from_accumulator(PanelAccumulator(['x1', 'x2'], 'sentiment_score').update(df))
+    only_x1 = PanelMoments.from_accumulator(PanelAccumulator(['x1'], 'sentiment_score').update(df))
+    for name in ('fixed_effects', 'random_effects', 'pooled'):
+        subset, fresh = getattr(full, name)(['x1']), getattr(only_x1, name)()
+        np.testing.assert_allclose(subset.params, fresh.params)
+        np.testing.assert_allclose(subset.cov, fresh.cov)
+    with pytest.raises(KeyError):
+        full.fixed_effects(['x3'])
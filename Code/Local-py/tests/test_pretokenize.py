@@ -0,0 +1,100 @@
+import os
+import zlib
+
+import numpy as np
+
+from review_sentiment.pretokenize import CHARS_PER_TOKEN, TokenCache, char_budget, clip_text, pretokenize
+
+
+class WordTokenizer:
+    """Stand-in for a fast tokenizer: one id per whitespace-separated word, ``[CLS] ... [SEP]`` around them."""
+
+    pad_token_id = 0
+    cls, sep = 1, 2
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_vocab(self):
+        return {'[PAD]': 0, '[CLS]': 1, '[SEP]': 2}
+
+    def _ids(self, text):
+        return [zlib.crc32(word.encode()) % 30_000 + 3 for word in text.split()]
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def build_inputs_with_special_tokens(self, ids):
+        return [self.cls] + list(ids) + [self.sep]
+
+    def __call__(self, texts, truncation=False, max_length=None, add_special_tokens=True):
+        self.calls += 1
+        encoded = []
+        for text in texts:
+            ids = self._ids(text)
+            if add_special_tokens:
+                if truncation:
+                    ids = ids[:max_length - 2]
+                ids = self.build_inputs_with_special_tokens(ids)
+            encoded.append(ids)
+        return {'input_ids': encoded}
+
+
+def reference(tokenizer, text, max_length, head_tail):
+    ids = tokenizer._ids(text)
+    keep = max_length - 2
+    if len(ids) > keep:
+        ids = ids[:keep // 2] + ids[len(ids) - (keep - keep // 2):] if head_tail else ids[:keep]
+    return tokenizer.build_inputs_with_special_tokens(ids)
+
+
+def texts(n, seed=0):
+    rng = np.random.default_rng(seed)
+    words = np.array(['good', 'bad', 'product', 'https://example.com/' + 'x' * 200, 'it', 'works', 'a'])
+    return [' '.join(rng.choice(words, rng.integers(1, 120), p=[.2, .2, .2, .02, .18, .1, .1])) for _ in range(n)]
+
+
+def test_clipping_never_changes_the_ids():
+    tokenizer = WordTokenizer()
+    sample = texts(300) + ['word ' * 200, 'https://' + 'y' * 3000 + ' tail words', 'z' * 5000]
+    for head_tail in (False, True):
+        encodings = pretokenize(sample, tokenizer, max_length=32, head_tail=head_tail)
+        for i, text in enumerate(sample):
+            assert encodings[i].tolist() == reference(tokenizer, text, 32, head_tail), (head_tail, text[:40])
+
+
+def test_clip_text_cuts_at_whitespace():
+    budget = char_budget(4)
+    assert budget == 4 * CHARS_PER_TOKEN
+    clipped = clip_text('alpha beta gamma delta epsilon zeta', 20)
+    assert clipped == 'alpha beta gamma'
+    assert clip_text('short', 20) == 'short'
+    assert len(clip_text('alpha beta gamma delta epsilon zeta eta', 20, head_tail=True)) <= 21
+
+
+def test_cache_is_shared_across_calls_with_different_texts(tmp_path):
+    tokenizer = WordTokenizer()
+    sample = texts(200, seed=1)
+    first = pretokenize(sample[:120], tokenizer, str(tmp_path), max_length=32)
+    calls = tokenizer.calls
+    second = pretokenize(sample[100:] + sample[:10], tokenizer, str(tmp_path), max_length=32)
+    assert tokenizer.calls > calls
+    calls = tokenizer.calls
+    third = pretokenize(sample[50:150][::-1], tokenizer, str(tmp_path), max_length=32)
+    assert tokenizer.calls == calls
+    for i, text in enumerate(sample[50:150][::-1]):
+        assert third[i].tolist() == reference(tokenizer, text, 32, False)
+    assert first[100].tolist() == second[0].tolist()
+
+
+def test_cache_size_follows_distinct_texts_not_calls(tmp_path):
+    tokenizer = WordTokenizer()
+    sample = texts(400, seed=2)
+    for call in range(60):
+        rng = np.random.default_rng(call)
+        pretokenize([sample[i] for i in rng.choice(len(sample), 30)], tokenizer, str(tmp_path), max_length=32)
+    (directory,) = os.listdir(tmp_path)
+    cache = TokenCache(os.path.join(tmp_path, directory))
+    assert len(cache.segments()) <= cache.max_segments
+    keys = np.concatenate([np.load(os.path.join(cache.directory, name, 'keys.npy')) for name in cache.segments()])
+    assert len(keys) == len(np.unique(keys)) <= len(set(sample))
@@ -0,0 +1,159 @@
+import http.client
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from review_sentiment.service import MicroBatcher, Overloaded, ScoringHTTPServer, ScoringService, request_texts
+
+
+class StubScorer:
+    """Scores a text by its length and records the size of every call; ``gate`` holds calls until set."""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+        self.entered = threading.Event()
+
+    def __call__(self, texts):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(len(texts))
+        return np.array([len(text) for text in texts], dtype=np.float32)
+
+    def close(self):
+        pass
+
+
+def test_concurrent_requests_are_coalesced_into_one_call():
+    scorer = StubScorer()
+    batcher = MicroBatcher(scorer, max_batch_rows=6, max_wait_ms=2000)
+    try:
+        start = time.perf_counter()
+        futures = [batcher.submit(['a' * i, 'b']) for i in range(1, 4)]
+        results = [future.result(5) for future in futures]
+        # The batch filled up, so it went out well before the 2 s deadline.
+        assert time.perf_counter() - start < 1.5
+    finally:
+        batcher.close()
+    assert scorer.batches == [6]
+    assert [r.tolist() for r in results] == [[1, 1], [2, 1], [3, 1]]
+
+
+def test_a_lone_request_is_flushed_at_the_deadline():
+    scorer = StubScorer()
+    batcher = MicroBatcher(scorer, max_batch_rows=100, max_wait_ms=50)
+    try:
+        start = time.perf_counter()
+        assert batcher.submit(['hello']).result(5).tolist() == [5]
+        assert time.perf_counter() - start >= 0.045
+    finally:
+        batcher.close()
+    assert scorer.batches == [1]
+
+
+def test_full_queue_is_refused_and_drains_after():
+    gate = threading.Event()
+    scorer = StubScorer(gate)
+    batcher = MicroBatcher(scorer, max_batch_rows=2, max_wait_ms=0, max_pending_rows=4)
+    try:
+        first = batcher.submit(['a', 'b'])
+        assert scorer.entered.wait(5)
+        queued = batcher.submit(['c', 'd', 'e'])
+        with pytest.raises(Overloaded):
+            batcher.submit(['f', 'g'])
+        assert batcher.pending_rows() == 3
+        gate.set()
+        assert first.result(5).tolist() == [1, 1] and queued.result(5).tolist() == [1, 1, 1]
+    finally:
+        gate.set()
+        batcher.close()
+
+
+def test_scorer_errors_reach_every_request_in_the_batch():
+    def broken(texts):
+        raise RuntimeError('model crashed')
+
+    batcher = MicroBatcher(broken, max_batch_rows=4, max_wait_ms=500)
+    try:
+        futures = [batcher.submit(['a', 'b']), batcher.submit(['c', 'd'])]
+        for future in futures:
+            with pytest.raises(RuntimeError, match='model crashed'):
+                future.result(5)
+    finally:
+        batcher.close()
+
+
+@pytest.mark.parametrize('body', [{'texts': 'abc'}, {'texts': ['ok', 3]}, {'texts': None}, {'text': ['a']},
+                                  {'text': 5}, {}, ['abc'], {'texts': ['a'], 'models': 'vader'}])
+def test_malformed_requests_are_rejected(body):
+    with pytest.raises(ValueError):
+        request_texts(body)
+
+
+def test_well_formed_requests():
+    assert request_texts({'texts': ['a', 'b'], 'models': ['vader']}) == ['a', 'b']
+    assert request_texts({'text': 'a'}) == ['a']
+    assert request_texts({'texts': []}) == []
+
+
+@pytest.fixture
+def server():
+    service = ScoringService({'sentiment_score': StubScorer()}, max_wait_ms=1)
+    server = ScoringHTTPServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def post(server, body):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    connection.request('POST', '/score', body=json.dumps(body), headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    data = json.loads(response.read())
+    connection.close()
+    return response.status, data
+
+
+def test_http_scores_and_validates(server):
+    status, data = post(server, {'texts': ['abc', 'de'], 'models': ['distilbert']})
+    assert status == 200 and data['scores'] == {'sentiment_score': [3.0, 2.0]}
+    status, data = post(server, {'texts': 'abc'})
+    assert status == 400 and 'list of strings' in data['error']
+    assert post(server, {'texts': ['a'], 'models': ['nope']})[0] == 400
+
+
+def test_http_overload_is_503_with_retry_after():
+    gate = threading.Event()
+    scorer = StubScorer(gate)
+    service = ScoringService({'sentiment_score': scorer}, max_batch_rows=1, max_wait_ms=0, max_pending_rows=1)
+    server = ScoringHTTPServer(('127.0.0.1', 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    waiting = [threading.Thread(target=post, args=(server, {'texts': [text]})) for text in 'ab']
+    try:
+        waiting[0].start()
+        assert scorer.entered.wait(5)
+        waiting[1].start()
+        deadline = time.perf_counter() + 5
+        while service.batchers['sentiment_score'].pending_rows() < 1 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+        connection.request('POST', '/score', body=json.dumps({'texts': ['c']}))
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        assert response.status == 503 and response.getheader('Retry-After') == '1'
+        assert service.counts['rejected'] == 1
+    finally:
+        gate.set()
+        for thread in waiting:
+            thread.join(5)
+        server.shutdown()
+        server.server_close()
+        service.close()
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from review_sentiment.benchmark import synthetic_reviews
+from review_sentiment.features import add_review_features
+from review_sentiment.store import ResultsStore
+
+
+def scored(n, seed=0):
+    return add_review_features(synthetic_reviews(n, seed=seed))
+
+
+def test_round_trip_keeps_rows_and_schema_dtypes(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = scored(45)
+    store.write(df, rows_per_part=20)
+    assert store.parts() == ['part-00000.parquet', 'part-00001.parquet', 'part-00002.parquet']
+    assert len(store) == 45
+    out = store.read()
+    assert out['text'].tolist() == df['text'].tolist()
+    assert out['sentiment_score'].dtype == np.float32 and out['year'].dtype == np.int16
+    assert list(store.read(columns=['rating', 'year']).columns) == ['rating', 'year']
+    with pytest.raises(KeyError):
+        store.read(columns=['no_such_column'])
+
+
+def test_added_columns_are_aligned_with_the_parts(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    store.write(scored(30), rows_per_part=12)
+    values = np.arange(30, dtype=np.float32)
+    store.add_column('sentiment_score_vader', values)
+    np.testing.assert_array_equal(store.read(columns=['sentiment_score_vader'])['sentiment_score_vader'], values)
+    store.add_column_part('sentiment_score_vader', 'part-00001.parquet', np.zeros(12))
+    np.testing.assert_array_equal(store.read_part('part-00001.parquet', ['sentiment_score_vader'])['sentiment_score_vader'],
+                                  np.zeros(12, dtype=np.float32))
+    with pytest.raises(ValueError):
+        store.add_column('sentiment_score_vader', values[:5])
+
+    store.append(scored(5, seed=1))
+    assert store.read_part('part-00003.parquet', ['sentiment_score_vader'])['sentiment_score_vader'].isna().all()
+    assert len(store.read()) == 35
+
+
+def test_filter_and_remove_parts(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = scored(20)
+    store.write(df, rows_per_part=10)
+    store.add_column('sentiment_score_vader', np.arange(20, dtype=np.float32))
+    store.filter_part('part-00000.parquet', np.arange(10) % 2 == 0)
+    out = store.read(columns=['text', 'sentiment_score_vader'])
+    assert out['sentiment_score_vader'].tolist() == [0, 2, 4, 6, 8] + list(range(10, 20))
+    assert out['text'].tolist() == df['text'].iloc[[0, 2, 4, 6, 8] + list(range(10, 20))].tolist()
+    store.remove_part('part-00001.parquet')
+    assert len(store) == 5 and store.columns()[-1] == 'sentiment_score_vader'
+
+
+def test_parts_with_differently_inferred_nested_types_concatenate(tmp_path):
+    store = ResultsStore(str(tmp_path / 'store'))
+    df = scored(4)
+    df['images'] = pd.Series([[], [], [{'url': 'a'}], []], dtype=object)
+    # The first part only holds empty lists, so its ``images`` type is inferred as a list of nulls.
+    store.write(df, rows_per_part=2)
+    assert store.read(columns=['images'])['images'].map(len).tolist() == [0, 0, 1, 0]
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from review_sentiment.benchmark import synthetic_reviews
+from review_sentiment.features import add_review_features
+from review_sentiment.textfeatures import TextFeaturizer, hashing_vectorizer, holdout_mask
+
+METADATA = ['rating', 'review_length', 'helpful_vote']
+
+
+def reviews(n=120, seed=0):
+    df = add_review_features(synthetic_reviews(n, seed=seed))
+    df.loc[3, 'text'] = None
+    return df
+
+
+def fitted(frames, **kwargs):
+    featurizer = TextFeaturizer(n_features=2 ** 12, processes=1, **kwargs)
+    for frame in frames:
+        featurizer.partial_fit(frame)
+    return featurizer
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 50])
+def test_partial_fit_does_not_depend_on_chunking(chunk):
+    df = reviews()
+    whole = fitted([df], metadata=METADATA)
+    chunked = fitted([df.iloc[start:start + chunk] for start in range(0, len(df), chunk)], metadata=METADATA)
+    assert chunked.n_docs == whole.n_docs == len(df)
+    np.testing.assert_array_equal(chunked.idf(), whole.idf())
+    np.testing.assert_allclose(chunked.meta_mean, df[METADATA].mean())
+    np.testing.assert_allclose(chunked.meta_m2 / (len(df) - 1), df[METADATA].astype(np.float64).var(), rtol=1e-9)
+    np.testing.assert_allclose(chunked.meta_m2, whole.meta_m2, rtol=1e-9)
+
+
+def test_tfidf_matches_sklearn():
+    from sklearn.feature_extraction.text import TfidfTransformer
+
+    df = reviews()
+    featurizer = fitted([df.iloc[:60], df.iloc[60:]], metadata=[])
+    counts = hashing_vectorizer(2 ** 12).transform(df['text'].fillna('').tolist())
+    expected = TfidfTransformer().fit_transform(counts)
+    np.testing.assert_allclose(featurizer.transform(df).toarray(), expected.toarray(), rtol=1e-5, atol=1e-7)
+    raw = fitted([df], metadata=[], tfidf=False)
+    np.testing.assert_array_equal(raw.transform(df).toarray(), counts.toarray())
+
+
+def test_metadata_columns_are_standardized(tmp_path):
+    df = reviews()
+    featurizer = fitted([df], metadata=METADATA)
+    X = featurizer.transform(df)
+    assert X.shape == (len(df), 2 ** 12 + len(METADATA))
+    meta = X[:, -len(METADATA):].toarray()
+    np.testing.assert_allclose(meta.mean(axis=0), 0, atol=1e-5)
+    np.testing.assert_allclose(meta.std(axis=0, ddof=1), 1, rtol=1e-4)
+    featurizer.save(tmp_path / 'featurizer.npz')
+    loaded = TextFeaturizer.load(tmp_path / 'featurizer.npz', processes=1)
+    assert (loaded.transform(df) != X).nnz == 0
+
+
+def test_parallel_hashing_matches_serial():
+    texts = reviews(50)['text']
+    with TextFeaturizer(n_features=2 ** 12, processes=2, chunk_rows=16) as featurizer:
+        parallel = featurizer.counts(texts)
+    serial = TextFeaturizer(n_features=2 ** 12, processes=1).counts(texts)
+    assert (parallel != serial).nnz == 0
+
+
+def test_holdout_mask_does_not_depend_on_chunking():
+    texts = pd.Series(reviews(500)['text'])
+    whole = holdout_mask(texts, 0.2, seed=3)
+    chunked = np.concatenate([holdout_mask(texts.iloc[start:start + 37], 0.2, seed=3) for start in range(0, 500, 37)])
+    np.testing.assert_array_equal(whole, chunked)
+    assert 0.1 < whole.mean() < 0.3
+    assert not np.array_equal(whole, holdout_mask(texts, 0.2, seed=4))